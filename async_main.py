@@ -0,0 +1,379 @@
+# async_main.py
+# Асинхронный режим бота на AsyncTeleBot (config.RUNTIME = "async").
+#
+# Все вызовы Telegram выполняются в цикле событий и не занимают поток на время ожидания.
+# Обращения к SQLite и Google Sheets уходят в отдельный пул потоков (run_blocking),
+# поэтому тысячи одновременных нажатий и заявок обслуживаются одним процессом.
+# Фоновый конвейер (БД -> Sheets / уведомления) общий с синхронным режимом.
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+from config import (TOKEN, RUN_MODE, ASYNC_BLOCKING_WORKERS, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                    WEBHOOK_URL, WEBHOOK_SECRET_TOKEN, WEBHOOK_WORKERS, EXPORT_MAX_FILE_SIZE)
+from handlers import (add_user, is_known_channel, start_search, render_users_page, render_search_page, user_card,
+                      render_staff_list, render_stats, parse_users_page_data, parse_user_details_data,
+                      export_executor, export_caption, EXPORT_TOO_LARGE_TEXT, ReconcileProgress,
+                      render_reconcile_report,
+                      start_background, stop_background, START_TEXT, HELP_TEXT)
+from db import user_has_privileges, is_director, set_privilege, list_staff
+from export import export_users, parse_export_args
+from reconcile import reconcile
+from metrics import timed_handler
+from state_store import create_state_store
+
+logger = logging.getLogger(__name__)
+
+bot = AsyncTeleBot(TOKEN, parse_mode='HTML')
+
+_blocking_executor = ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+# Состояния диалога пользователей (хранилище и TTL задаются в config.py).
+# Обращения идут через run_blocking: хранилище может быть в SQLite
+user_states = create_state_store()
+
+# Возможные состояния
+STATE_NONE = None
+STATE_SEARCH_USERS = 'search_users'
+STATE_GRANT = 'grant'
+STATE_REVOKE = 'revoke'
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет блокирующую функцию (SQLite, Sheets) в пуле потоков, не останавливая цикл событий."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
+
+
+async def insufficient_rights(message):
+    logger.warning("Недостаточно прав у пользователя: %s", message.from_user.username)
+    await bot.reply_to(message, "У вас недостаточно прав, обратитесь к директору для получения прав.")
+
+
+async def show(chat_id, text, keyboard, message_id=None):
+    if message_id is not None:
+        try:
+            await bot.edit_message_text(text, chat_id, message_id, reply_markup=keyboard, parse_mode='HTML')
+        except ApiTelegramException as e:
+            if "message is not modified" in str(e):
+                logger.warning(
+                    "Попытка отредактировать сообщение без изменений: chat_id=%s, message_id=%s", chat_id, message_id)
+            else:
+                logger.error("Ошибка при редактировании сообщения: %s", e)
+    else:
+        await bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='HTML')
+
+
+@bot.chat_join_request_handler()
+@timed_handler
+async def handle_chat_join_request(chat_join_request):
+    user = chat_join_request.from_user
+    channel_id = chat_join_request.chat.id
+    logger.info("Обработка запроса на вступление: channel_id=%s, user_id=%s, username=%s", channel_id, user.id, user.username)
+    if not is_known_channel(channel_id):
+        logger.warning("Заявка в канал, которого нет в CHANNELS, пропущена: channel_id=%s", channel_id)
+        return
+    await bot.approve_chat_join_request(channel_id, user.id)
+    # Постановка в очередь может ждать при переполнении очереди канала - не держим цикл событий
+    await run_blocking(add_user, channel_id, user.id, user.username, user.first_name, user.last_name)
+    logger.info("Пользователь поставлен в очередь на добавление: user_id=%s", user.id)
+
+
+@bot.message_handler(commands=['start'])
+@timed_handler
+async def start_cmd(message):
+    logger.info("Команда /start от пользователя: user_id=%s", message.from_user.id)
+    await run_blocking(user_states.pop, message.from_user.id, None)
+    await bot.reply_to(message, START_TEXT)
+
+
+@bot.message_handler(commands=['help'])
+@timed_handler
+async def help_cmd(message):
+    logger.info("Команда /help от пользователя: user_id=%s", message.from_user.id)
+    await bot.reply_to(message, HELP_TEXT, parse_mode='HTML')
+
+
+@bot.message_handler(commands=['list_users'])
+@timed_handler
+async def list_users_cmd(message):
+    logger.info("Команда /list_users от пользователя: user_id=%s", message.from_user.id)
+    if not user_has_privileges(message.from_user.username, message.from_user.id):
+        await insufficient_rights(message)
+        return
+
+    parts = message.text.split(maxsplit=1)
+    page = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 1
+    text, keyboard = await run_blocking(render_users_page, page)
+    await show(message.chat.id, text, keyboard)
+
+
+@bot.message_handler(commands=['list_staff'])
+@timed_handler
+async def list_staff_cmd(message):
+    logger.info("Команда /list_staff от пользователя: user_id=%s", message.from_user.id)
+    if not user_has_privileges(message.from_user.username, message.from_user.id):
+        await insufficient_rights(message)
+        return
+
+    staff = await run_blocking(list_staff)
+    if not staff:
+        await bot.reply_to(message, "Нет сотрудников.")
+        return
+    await bot.reply_to(message, render_staff_list(staff), parse_mode='HTML')
+
+
+@bot.message_handler(commands=['search_users'])
+@timed_handler
+async def search_users_cmd(message):
+    logger.info("Команда /search_users от пользователя: user_id=%s", message.from_user.id)
+    if not user_has_privileges(message.from_user.username, message.from_user.id):
+        await insufficient_rights(message)
+        return
+
+    await run_blocking(user_states.set, message.from_user.id, STATE_SEARCH_USERS)
+    await bot.reply_to(
+        message,
+        "🔍 Поиск пользователя...\nВведите `username`, `first_name`, `last_name` или `ID` пользователя:",
+        parse_mode='Markdown'
+    )
+
+
+@bot.message_handler(commands=['grant'])
+@timed_handler
+async def grant_cmd(message):
+    logger.info("Команда /grant от пользователя: user_id=%s", message.from_user.id)
+    if not is_director(message.from_user.username):
+        await insufficient_rights(message)
+        return
+
+    await run_blocking(user_states.set, message.from_user.id, STATE_GRANT)
+    await bot.reply_to(message, "🛠 Назначение сотрудника...\nУкажите `@username` пользователя:", parse_mode='Markdown')
+
+
+@bot.message_handler(commands=['revoke'])
+@timed_handler
+async def revoke_cmd(message):
+    logger.info("Команда /revoke от пользователя: user_id=%s", message.from_user.id)
+    if not is_director(message.from_user.username):
+        await insufficient_rights(message)
+        return
+
+    await run_blocking(user_states.set, message.from_user.id, STATE_REVOKE)
+    await bot.reply_to(message, "🗑 Удаление сотрудника...\nУкажите `@username` пользователя:", parse_mode='Markdown')
+
+
+@bot.message_handler(commands=['stats'])
+@timed_handler
+async def stats_cmd(message):
+    logger.info("Команда /stats от пользователя: user_id=%s", message.from_user.id)
+    if not is_director(message.from_user.username):
+        await insufficient_rights(message)
+        return
+
+    text = await run_blocking(render_stats)
+    await bot.reply_to(message, text, parse_mode='HTML')
+
+
+@bot.message_handler(commands=['export_users'])
+@timed_handler
+async def export_users_cmd(message):
+    logger.info("Команда /export_users от пользователя: user_id=%s, text=%s", message.from_user.id, message.text)
+    if not user_has_privileges(message.from_user.username, message.from_user.id):
+        await insufficient_rights(message)
+        return
+
+    try:
+        options = parse_export_args(message.text)
+    except ValueError as e:
+        await bot.reply_to(message, f"❌ {e}. Формат: /export_users [csv|xlsx] [staff] [ГГГГ-ММ-ДД]")
+        return
+
+    await bot.reply_to(message, f"⏳ Готовлю выгрузку ({options.describe()}), файл придёт отдельным сообщением.")
+    # Выгрузки идут в своём пуле, чтобы долгое чтение таблицы не занимало потоки run_blocking
+    loop = asyncio.get_running_loop()
+    try:
+        path, filename, count = await loop.run_in_executor(export_executor, export_users, options)
+    except Exception as e:
+        logger.error("Ошибка выгрузки пользователей для chat_id=%s: %s", message.chat.id, e)
+        await bot.send_message(message.chat.id, f"❌ Не удалось выгрузить пользователей: {e}", parse_mode=None)
+        return
+    try:
+        if os.path.getsize(path) > EXPORT_MAX_FILE_SIZE:
+            await bot.send_message(message.chat.id, EXPORT_TOO_LARGE_TEXT)
+            return
+        with open(path, 'rb') as f:
+            await bot.send_document(message.chat.id, f, visible_file_name=filename, caption=export_caption(options, count))
+    finally:
+        os.remove(path)
+
+
+@bot.message_handler(commands=['reconcile'])
+@timed_handler
+async def reconcile_cmd(message):
+    logger.info("Команда /reconcile от пользователя: user_id=%s", message.from_user.id)
+    if not is_director(message.from_user.username):
+        await insufficient_rights(message)
+        return
+
+    dry_run = 'dry' in message.text.split()[1:]
+    status = await bot.reply_to(message, "🔄 Сверка таблиц...")
+    loop = asyncio.get_running_loop()
+    # Ход сверки приходит из рабочего потока, сообщение правится в цикле событий
+    progress = ReconcileProgress(lambda text: asyncio.run_coroutine_threadsafe(
+        bot.edit_message_text(text, message.chat.id, status.message_id), loop))
+    try:
+        reports = await run_blocking(reconcile, dry_run=dry_run, progress=progress)
+    except Exception as e:
+        logger.error("Ошибка сверки таблиц: %s", e)
+        await bot.send_message(message.chat.id, f"❌ Сверка не выполнена: {e}", parse_mode=None)
+        return
+    await bot.send_message(message.chat.id, render_reconcile_report(reports, dry_run))
+
+
+@bot.message_handler(func=lambda message: True)
+@timed_handler
+async def handle_message(message):
+    user_id = message.from_user.id
+    state = await run_blocking(user_states.get, user_id, STATE_NONE)
+
+    if message.text and message.text.startswith('/'):
+        logger.warning("Неизвестная команда от пользователя: user_id=%s, text=%s", user_id, message.text)
+        await bot.reply_to(message,
+                           "❌ Я не знаю такой команды. Попробуй /help, чтобы увидеть список доступных команд и функционал.")
+        return
+
+    if state == STATE_SEARCH_USERS:
+        await handle_search_users(message)
+    elif state == STATE_GRANT:
+        await handle_privilege_change(message, 1)
+    elif state == STATE_REVOKE:
+        await handle_privilege_change(message, 0)
+    else:
+        await bot.reply_to(message, "❓ Я не знаю, что с этим делать. Попробуй /help.")
+
+
+async def handle_search_users(message):
+    query = message.text.strip()
+    await run_blocking(user_states.pop, message.from_user.id, None)
+
+    token = await run_blocking(start_search, query)
+    if token is None:
+        await bot.reply_to(message, "❌ По вашему запросу ничего не найдено.")
+        return
+    text, keyboard = await run_blocking(render_search_page, token, 1)
+    await show(message.chat.id, text, keyboard)
+
+
+async def handle_privilege_change(message, value):
+    username = message.text.strip()
+    if not username.startswith('@') or len(username) < 2:
+        await bot.reply_to(message, "❌ Неверный формат username. Пожалуйста, укажите в формате `@username`.",
+                           parse_mode='Markdown')
+        return
+
+    clean_username = username[1:]
+    if await run_blocking(set_privilege, clean_username, value):
+        done = "выданы пользователю" if value else "отозваны у пользователя"
+        await bot.reply_to(message, f"✅ Права {done} @{clean_username}.")
+        await run_blocking(user_states.pop, message.from_user.id, None)
+    else:
+        action = "выдать права пользователю" if value else "отозвать права у пользователя"
+        await bot.reply_to(message, f"❌ Не удалось {action} @{clean_username}. Возможно, пользователь не найден.")
+
+
+async def _check_call_rights(call):
+    if user_has_privileges(call.from_user.username, call.from_user.id):
+        return True
+    await bot.answer_callback_query(call.id, "❌ У вас недостаточно прав!")
+    return False
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('users_page:'))
+@timed_handler
+async def callback_users_page(call):
+    if not await _check_call_rights(call):
+        return
+    page, cursor_kwargs = parse_users_page_data(call.data)
+    text, keyboard = await run_blocking(render_users_page, page, **cursor_kwargs)
+    await show(call.message.chat.id, text, keyboard, call.message.message_id)
+    await bot.answer_callback_query(call.id)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('search_page:'))
+@timed_handler
+async def callback_search_page(call):
+    if not await _check_call_rights(call):
+        return
+    try:
+        _, token, page_str = call.data.split(':')
+        page = int(page_str)
+    except ValueError:
+        await bot.answer_callback_query(call.id, "❌ Некорректный запрос.")
+        return
+    text, keyboard = await run_blocking(render_search_page, token, page)
+    await show(call.message.chat.id, text, keyboard, call.message.message_id)
+    await bot.answer_callback_query(call.id)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(('user_details:', 'search_user_details:')))
+@timed_handler
+async def callback_user_details(call):
+    if not await _check_call_rights(call):
+        return
+    try:
+        user_id, back_data = parse_user_details_data(call.data)
+    except ValueError:
+        await bot.answer_callback_query(call.id, "❌ Некорректный запрос.")
+        return
+
+    card = await run_blocking(user_card, user_id, back_data)
+    if card is None:
+        await bot.answer_callback_query(call.id, "❌ Пользователь не найден.")
+        return
+    text, keyboard = card
+    await show(call.message.chat.id, text, keyboard, call.message.message_id)
+    await bot.answer_callback_query(call.id)
+
+
+async def _serve_webhook():
+    from webhook import WebhookServer
+    loop = asyncio.get_running_loop()
+    server = WebhookServer(bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+                           workers=WEBHOOK_WORKERS, loop=loop)
+    if WEBHOOK_URL:
+        await bot.remove_webhook()
+        await bot.set_webhook(url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET_TOKEN)
+    try:
+        # HTTP-сервер блокирующий, поэтому работает в отдельном потоке
+        await loop.run_in_executor(None, server.serve_forever)
+    finally:
+        server.shutdown()
+
+
+async def _main():
+    logger.info("Инициализация бота (asyncio)...")
+    start_background()
+    try:
+        if RUN_MODE == "webhook":
+            await _serve_webhook()
+        else:
+            logger.info("Бот успешно запущен в режиме polling (asyncio). Ожидаем входящие команды...")
+            await bot.infinity_polling()
+    finally:
+        await bot.close_session()
+
+
+def run():
+    try:
+        asyncio.run(_main())
+    except Exception as e:
+        logger.error("Ошибка при запуске бота: %s", e)
+    finally:
+        _blocking_executor.shutdown(wait=True)
+        stop_background()
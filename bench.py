@@ -0,0 +1,273 @@
+# bench.py
+# Нагрузочный прогон бота без Telegram и Google: обработчики из main.py работают против
+# локальной замены Bot API (fake_telegram.py) и таблиц в памяти (fake_sheets.py), БД - во временном каталоге.
+#
+#   python bench.py --joins 5000 --admins 5 --latency 0.02 --rate-limit 0.05
+#   python bench.py --output bench_output.txt
+#
+# Отчёт: заявок в секунду, p50/p99 задержки одобрения заявки, время ответов администраторам,
+# время записи в БД и Google Sheets, потребление памяти.
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import config
+
+BENCH_CHANNEL_BASE = -1001000000000
+ADMIN_CHAT_BASE = 9000000000
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[index]
+
+
+def _configure(tmpdir, args):
+    # Настройки подменяются до импорта модулей бота: они читают config при импорте
+    config.TOKEN = "123456:BENCH-TOKEN"
+    config.DB_PATH = os.path.join(tmpdir, "bench.db")
+    config.METRICS_ENABLED = False
+    config.LOG_LEVEL = args.log_level
+    config.LOG_SAMPLING = {}
+    config.CHANNELS = {
+        BENCH_CHANNEL_BASE - i: {
+            "title": f"bench-{i}",
+            "sheets": [(f"bench-{i}-full", "full"), (f"bench-{i}-short", "short")],
+            "staff": [],
+        }
+        for i in range(args.channels)
+    }
+    config.CHANNEL_ID = BENCH_CHANNEL_BASE
+
+
+def _seed_staff(db, count):
+    for i in range(count):
+        uid = ADMIN_CHAT_BASE + 1000 + i
+        db.add_user_to_db(uid, f"staff{i}", "Staff", str(i))
+        db.set_privilege(f"staff{i}", 1)
+
+
+def run_joins(server, count, rate, channels):
+    """
+    Поток заявок на вступление: count заявок, rate в секунду (0 - все сразу).
+    Половина заявок идёт в первый канал, остальные поровну в другие - проверка, что нагруженный
+    канал не задерживает остальные.
+    """
+    started = time.perf_counter()
+    for i in range(count):
+        uid = 100000 + i
+        channel = 0 if channels == 1 or i % 2 == 0 else 1 + (i // 2) % (channels - 1)
+        server.push_join_request(BENCH_CHANNEL_BASE - channel, uid, username=f"user{i}", first_name=f"Имя{i}", last_name=f"Фамилия{i}")
+        if rate:
+            pause = started + (i + 1) / rate - time.perf_counter()
+            if pause > 0:
+                time.sleep(pause)
+    return started
+
+
+def _find_button(entry, prefix, forward=True):
+    markup = entry[2].get('reply_markup')
+    if not markup:
+        return None
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    datas = [b.get('callback_data', '') for row in markup.get('inline_keyboard', []) for b in row]
+    datas = [d for d in datas if d.startswith(prefix)]
+    if not datas:
+        return None
+    return datas[-1] if forward else random.choice(datas)
+
+
+class AdminSession(threading.Thread):
+    """Администратор листает список пользователей, открывает карточки и ищет по базе."""
+
+    def __init__(self, server, index, pages, searches, timeout):
+        super().__init__(name=f"bench-admin-{index}", daemon=True)
+        self.server = server
+        self.chat_id = ADMIN_CHAT_BASE + index
+        self.username = config.DIRECTOR_USERNAME
+        self.pages = pages
+        self.searches = searches
+        self.timeout = timeout
+        self.latencies = {}
+        self.failures = 0
+
+    def _step(self, kind, push, methods):
+        since = self.server.outgoing_count(self.chat_id)
+        started = time.perf_counter()
+        push()
+        entry = self.server.wait_outgoing(self.chat_id, since, methods, timeout=self.timeout)
+        if entry is None:
+            self.failures += 1
+            return None
+        self.latencies.setdefault(kind, []).append(entry[0] - started)
+        return entry
+
+    def _message(self, kind, text):
+        return self._step(kind, lambda: self.server.push_message(self.chat_id, self.username, text), ('sendMessage',))
+
+    def _callback(self, kind, data, message_id):
+        return self._step(kind, lambda: self.server.push_callback(self.chat_id, self.username, data, message_id),
+                          ('editMessageText',))
+
+    def _browse(self, entry, page_prefix, details_prefix):
+        message_id = entry[3]
+        for _ in range(self.pages):
+            details = _find_button(entry, details_prefix, forward=False)
+            if details and self._callback("card", details, message_id) is None:
+                return
+            data = _find_button(entry, page_prefix)
+            if data is None:
+                return
+            entry = self._callback("page", data, message_id)
+            if entry is None:
+                return
+
+    def run(self):
+        entry = self._message("list_users", "/list_users")
+        if entry is not None:
+            self._browse(entry, "users_page:", "user_details:")
+        for _ in range(self.searches):
+            if self._message("search_prompt", "/search_users") is None:
+                continue
+            entry = self._message("search", random.choice(["user", "Имя", "Фамилия1", "user4"]))
+            if entry is not None:
+                self._browse(entry, "search_page:", "search_user_details:")
+
+
+def _format_latencies(values):
+    return (f"n={len(values)}, p50={percentile(values, 0.5) * 1000:.1f} мс, "
+            f"p99={percentile(values, 0.99) * 1000:.1f} мс, max={max(values) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на локальных заменах Telegram и Google Sheets")
+    parser.add_argument('--joins', type=int, default=2000, help="число заявок на вступление")
+    parser.add_argument('--join-rate', type=float, default=0, help="заявок в секунду (0 - одним пакетом)")
+    parser.add_argument('--channels', type=int, default=1, help="число каналов")
+    parser.add_argument('--admins', type=int, default=3, help="одновременных сессий администраторов")
+    parser.add_argument('--pages', type=int, default=5, help="страниц, которые листает администратор")
+    parser.add_argument('--searches', type=int, default=2, help="поисков за сессию администратора")
+    parser.add_argument('--staff', type=int, default=0, help="сотрудников, получающих уведомления о заявках")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа Bot API, секунды")
+    parser.add_argument('--jitter', type=float, default=0.0, help="разброс задержки, секунды")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="доля ответов 429 на sendMessage/editMessageText")
+    parser.add_argument('--timeout', type=float, default=120.0, help="предельное время ожидания одного этапа, секунды")
+    parser.add_argument('--tracemalloc', action='store_true', help="считать пик памяти Python (замедляет прогон)")
+    parser.add_argument('--log-level', default="WARNING")
+    parser.add_argument('--output', help="дописать отчёт в файл (например, bench_output.txt)")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="bot-bench-")
+    _configure(tmpdir, args)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    from fake_telegram import FakeTelegramServer
+    from telebot import apihelper
+
+    server = FakeTelegramServer(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit)
+    server.start()
+    apihelper.API_URL = server.api_url
+
+    import main as bot_main
+    import db
+    import handlers
+    from fake_sheets import FakeSheetsBackend
+    from google_sheets import set_backend
+
+    sheets_backend = FakeSheetsBackend()
+    set_backend(sheets_backend)
+
+    _seed_staff(db, args.staff)
+    handlers.start_background()
+    poller = threading.Thread(target=bot_main.bot.infinity_polling,
+                              kwargs={'timeout': 5, 'long_polling_timeout': 1}, name="bench-polling", daemon=True)
+    poller.start()
+
+    report = []
+    try:
+        # 1. Заявки на вступление
+        started = run_joins(server, args.joins, args.join_rate, args.channels)
+        approved_all = server.wait_approved(args.joins, timeout=args.timeout)
+        approved = list(server.join_approved.values())
+        approve_elapsed = (max(approved) - started) if approved else 0.0
+        latencies = [server.join_approved[uid] - server.join_enqueued[uid] for uid in server.join_approved]
+
+        # 2. Сессии администраторов идут, пока конвейер дописывает заявки в БД
+        admins = [AdminSession(server, i, args.pages, args.searches, args.timeout) for i in range(args.admins)]
+        admin_started = time.perf_counter()
+        for admin in admins:
+            admin.start()
+        for admin in admins:
+            admin.join()
+        admin_elapsed = time.perf_counter() - admin_started
+
+        # 3. Дожидаемся записи в БД и очереди Google Sheets
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and db.get_users_count() < args.joins + args.staff:
+            time.sleep(0.05)
+        stored_elapsed = time.perf_counter() - started
+        stored = db.get_users_count() - args.staff
+        members_by_channel = db.count_channel_members()
+    finally:
+        bot_main.bot.stop_polling()
+        handlers.stop_background()
+        server.stop()
+
+    sheet_rows = sum(len(ws.rows) for ws in sheets_backend.worksheets.values())
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        max_rss = 0.0
+
+    report.append(f"=== bench {time.strftime('%Y-%m-%d %H:%M:%S')} ===")
+    report.append(f"параметры: joins={args.joins}, channels={args.channels}, join_rate={args.join_rate or 'пакет'}, admins={args.admins}, "
+                  f"staff={args.staff}, latency={args.latency}, jitter={args.jitter}, rate_limit={args.rate_limit}")
+    report.append(f"заявки: одобрено {len(approved)}/{args.joins}{'' if approved_all else ' (таймаут)'}, "
+                  f"{len(approved) / approve_elapsed if approve_elapsed else 0:.1f} заявок/с")
+    if latencies:
+        report.append(f"задержка одобрения: {_format_latencies(latencies)}")
+    report.append(f"БД: записано {stored}/{args.joins} за {stored_elapsed:.2f} c "
+                  f"({stored / stored_elapsed if stored_elapsed else 0:.1f} записей/с)")
+    if args.channels > 1:
+        report.append(f"участники по каналам: {members_by_channel}")
+    report.append(f"Google Sheets (в памяти): {sheet_rows} строк")
+    admin_latencies = {}
+    for admin in admins:
+        for kind, values in admin.latencies.items():
+            admin_latencies.setdefault(kind, []).extend(values)
+    report.append(f"администраторы: {args.admins} сессий за {admin_elapsed:.2f} c, "
+                  f"без ответа {sum(a.failures for a in admins)}")
+    for kind, values in sorted(admin_latencies.items()):
+        report.append(f"  {kind}: {_format_latencies(values)}")
+    report.append(f"Bot API: {dict(sorted(server.calls.items()))}, ответов 429: {server.rate_limited}")
+    report.append(f"уведомления: {handlers.dispatcher.stats()}")
+    memory = f"память: max RSS {max_rss:.1f} МБ"
+    if tracemalloc.is_tracing():
+        current_mem, peak_mem = tracemalloc.get_traced_memory()
+        memory += f", python пик {peak_mem / 1024 / 1024:.1f} МБ, сейчас {current_mem / 1024 / 1024:.1f} МБ"
+    report.append(memory)
+
+    text = "\n".join(report)
+    print(text)
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(text + "\n\n")
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    return 0 if approved_all else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
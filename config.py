@@ -11,7 +11,114 @@ CREDENTIALS_FILE = "quantum-keep-428613-c3-32dc3787140b.json"
 SPREADSHEET_ID_1 = "1uaHzlpt6A7V3vhJXoa1_EfgSM9CYiN8ViITuAwTyYIk" # id таблиц можно взять из адресной строки таблицы
 SPREADSHEET_ID_2 = "11jihjH1lIJVd7HaHWHjFFzu-jZEB66CYIuDOfJxdcT0" # он там один большой, не ошибетесь
 
+# Закрытые каналы, которые обслуживает бот: id канала -> настройки канала.
+#   title  - название канала в уведомлениях
+#   sheets - таблицы канала: (id таблицы, формат строки); "full" - id, username, имя, фамилия, привилегии,
+#            "short" - id, имя, фамилия
+#   staff  - username сотрудников, которым приходят уведомления о заявках в этот канал
+#            (пустой список - всем сотрудникам с правами)
+# Заявки в каналы, которых здесь нет, бот не одобряет.
+CHANNELS = {
+    CHANNEL_ID: {
+        "title": "Закрытый канал",
+        "sheets": [(SPREADSHEET_ID_1, "full"), (SPREADSHEET_ID_2, "short")],
+        "staff": [],
+    },
+}
+
 # Параметры логирования можно также вынести сюда
 LOG_LEVEL = "INFO"
 # В проекте настроены логи для полного контроля всего происходяшего, можно указать уровень логирования.Абсолютно
-# все действия проделываемые в боте логируются.
\ No newline at end of file
+# все действия проделываемые в боте логируются.
+# Формат логов: "json" (одна JSON-строка на запись, для сбора логов) или "text"
+LOG_FORMAT = "json"
+# Доля сохраняемых записей для частых событий (поле event): 0.01 - сохраняется каждая сотая запись
+LOG_SAMPLING = {
+    "privilege_check": 0.01,
+    "page_render": 0.1,
+}
+# Пакетная запись в Google Sheets: строки копятся в очереди sheets_outbox (в users.db)
+# и уходят одним запросом append_rows на таблицу
+SHEETS_BATCH_SIZE = 50  # отправить пачку, как только набралось столько строк
+SHEETS_FLUSH_INTERVAL = 5  # или не реже чем раз в столько секунд
+OUTBOX_RETRY_BASE_DELAY = 5  # пауза перед повтором неудачной записи в секундах, дальше удваивается
+OUTBOX_RETRY_MAX_DELAY = 600  # максимальная пауза между повторами
+
+# Повторные заявки уже сохранённых участников отсекаются по кэшу недавних (channel_id, user_id)
+RECENT_MEMBERS_CACHE_SIZE = 100000
+
+# Фоновый конвейер обработки заявок: БД (вместе с очередью Google Sheets) -> уведомления
+PIPELINE_QUEUE_SIZE = 1000  # очередь одного канала в каждой стадии
+PIPELINE_SUBMIT_TIMEOUT = 0.5  # сколько поток обработчика ждёт места в очереди канала, дальше заявка откладывается
+PIPELINE_BACKLOG_SIZE = 10000  # отложенных заявок одного канала; сверх этого заявка только одобряется и пишется в лог
+PIPELINE_RETRIES = 3  # число повторов задачи в стадии при ошибке
+PIPELINE_RETRY_DELAY = 1.0  # задержка перед первым повтором в секундах, дальше удваивается
+PIPELINE_DB_WORKERS = 4  # параллельные вставки фиксируются писателем БД одной транзакцией
+PIPELINE_NOTIFY_WORKERS = 2
+
+# Рассылка уведомлений сотрудникам с учётом лимитов Telegram
+NOTIFY_GLOBAL_RATE = 30  # сообщений в секунду на всего бота
+NOTIFY_PER_CHAT_RATE = 1  # сообщений в секунду в один чат
+NOTIFY_WORKERS = 8  # потоков параллельной отправки
+NOTIFY_MAX_RETRIES = 5  # повторов при ответе 429 Too Many Requests
+
+# Сводные уведомления при наплыве заявок: в каждом окне DIGEST_WINDOW секунд первые DIGEST_THRESHOLD
+# новых участников канала приходят сотрудникам по одному, остальные - одной сводкой со ссылкой на список
+DIGEST_ENABLED = True
+DIGEST_WINDOW = 60  # длина окна в секундах
+DIGEST_THRESHOLD = 5  # уведомлений по одному за окно, дальше - сводка
+DIGEST_MAX_USERS = 500  # сводка уходит досрочно, если набралось столько участников
+DIGEST_LIST_LIMIT = 20  # сколько участников перечислять в тексте сводки
+
+# Сессии поиска: найденные id хранятся на сервере, в кнопках передаётся только короткий токен
+SEARCH_SESSION_MAX = 1000  # максимум одновременно хранимых сессий (старые вытесняются)
+SEARCH_SESSION_TTL = 3600  # время жизни сессии в секундах
+SEARCH_MAX_RESULTS = 5000  # сколько найденных id сохранять в одной сессии
+
+# Кэш готовых страниц /list_users (текст и клавиатура); сбрасывается при любом изменении списка
+USERS_PAGE_CACHE_SIZE = 256  # максимум страниц в кэше (давно не открывавшиеся вытесняются)
+USER_CARD_CACHE_SIZE = 5000  # максимум карточек пользователей в кэше
+
+# Состояния диалога (ожидание запроса поиска, username для /grant и /revoke):
+# "memory" - в памяти процесса, "sqlite" - в таблице user_states (переживают перезапуск, общие для процессов)
+STATE_BACKEND = "memory"
+STATE_TTL = 900  # через сколько секунд бездействия состояние забывается
+STATE_MAX_USERS = 10000  # максимум состояний в памяти (для "memory")
+
+# База данных SQLite (режим WAL: чтение не блокируется записью)
+DB_PATH = "users.db"
+DB_GROUP_COMMIT_MAX = 100  # максимум операций записи в одной транзакции писателя
+
+# Способ получения обновлений: "polling" (long polling) или "webhook" (встроенный HTTP-сервер)
+RUN_MODE = "polling"
+WEBHOOK_HOST = "127.0.0.1"  # адрес встроенного сервера; снаружи - через reverse proxy с TLS
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_URL = ""  # публичный HTTPS-адрес (например, за nginx); пусто - webhook в Telegram не регистрируется
+WEBHOOK_SECRET_TOKEN = ""  # секрет из заголовка X-Telegram-Bot-Api-Secret-Token; без него webhook не запускается
+WEBHOOK_WORKERS = 8  # потоков обработки принятых обновлений
+
+# Среда выполнения: "sync" (TeleBot, пул потоков) или "async" (AsyncTeleBot, asyncio, требует aiohttp)
+RUNTIME = "sync"
+ASYNC_BLOCKING_WORKERS = 16  # потоков для обращений к SQLite и Google Sheets в asyncio-режиме
+
+# Источник таблиц: "google" - настоящие Google Sheets, "fake" - таблицы в памяти (локальный запуск, тесты)
+SHEETS_BACKEND = "google"
+SHEETS_RETRIES = 5  # повторов при сетевой ошибке / истёкшем токене
+SHEETS_RETRY_DELAY = 1.0  # пауза перед первым повтором в секундах, дальше удваивается
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics, сводка - команда /stats (директор)
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"  # только локально; наружу - через собственный scrape-прокси
+METRICS_PORT = 9108
+
+# Выгрузка пользователей командой /export_users (CSV в gzip или XLSX, для XLSX нужен openpyxl)
+EXPORT_FETCH_SIZE = 5000  # строк, читаемых из БД за один раз
+EXPORT_WORKERS = 1  # одновременных выгрузок, остальные ждут в очереди
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024  # предел Bot API на отправку документа
+
+# Сверка Google Таблиц с БД: команда /reconcile (директор) и python reconcile.py
+RECONCILE_CHUNK_ROWS = 1000  # строк в одном запросе append_rows / batch_update
+RECONCILE_REQUEST_INTERVAL = 1.1  # пауза между запросами записи, секунды (квота - 60 запросов в минуту)
+RECONCILE_GRACE = 60  # вступивших за последние секунды не трогаем: их строки ещё в очереди sheets_outbox
+RECONCILE_PROGRESS_INTERVAL = 5  # как часто обновлять сообщение с ходом сверки, секунды
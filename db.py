@@ -1,102 +1,471 @@
 # db.py
+import json
+import re
 import sqlite3
 import logging
+import threading
+import time
 
-from config import DIRECTOR_USERNAME
+from config import DIRECTOR_USERNAME, DB_PATH, DB_GROUP_COMMIT_MAX
+from db_pool import ConnectionPool
+from migrations import migrate
+from metrics import timed_call
 
 logger = logging.getLogger(__name__)
 
-conn = sqlite3.connect('users.db', check_same_thread=False)
-cursor = conn.cursor()
+# Чтение - через соединения отдельных потоков, запись - через единственный поток-писатель
+pool = ConnectionPool(DB_PATH, group_commit_max=DB_GROUP_COMMIT_MAX)
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    username TEXT,
-    first_name TEXT,
-    last_name TEXT,
-    is_privileged INTEGER DEFAULT 0
+OUTBOX_INSERT_SQL = ("INSERT INTO sheets_outbox (spreadsheet_id, user_id, row_json, created_at) "
+                     "VALUES (?, ?, ?, ?)")
+
+# Полнотекстовый индекс для поиска: внешнее содержимое берётся из users,
+# синхронизация - триггерами на вставку, удаление и изменение имени
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    username, first_name, last_name,
+    content='users', content_rowid='user_id',
+    tokenize='unicode61 remove_diacritics 2'
 );
-""")
-conn.commit()
+CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+    INSERT INTO users_fts(rowid, username, first_name, last_name)
+    VALUES (new.user_id, new.username, new.first_name, new.last_name);
+END;
+CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+    INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name)
+    VALUES ('delete', old.user_id, old.username, old.first_name, old.last_name);
+END;
+CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, first_name, last_name ON users BEGIN
+    INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name)
+    VALUES ('delete', old.user_id, old.username, old.first_name, old.last_name);
+    INSERT INTO users_fts(rowid, username, first_name, last_name)
+    VALUES (new.user_id, new.username, new.first_name, new.last_name);
+END;
+"""
+
+
+def _init_fts(conn):
+    try:
+        existed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'").fetchone() is not None
+        conn.executescript(FTS_SCHEMA)
+        if not existed:
+            # Разовое заполнение индекса для уже существующей базы
+            logger.info("Построение полнотекстового индекса users_fts по существующим пользователям...")
+            conn.execute("INSERT INTO users_fts(users_fts) VALUES ('rebuild')")
+        return True
+    except sqlite3.OperationalError as e:
+        logger.warning("FTS5 недоступен, поиск будет работать через LIKE: %s", e)
+        return False
+
+
+def _init_schema(conn):
+    migrate(conn)
+    # Индекс поиска - вне версий схемы: FTS5 есть не в каждой сборке SQLite
+    return _init_fts(conn)
+
+
+FTS_ENABLED = pool.setup(_init_schema)
+
+
+def _read():
+    return pool.read()
+
+# Кэш общего числа пользователей: COUNT(*) выполняется один раз, дальше счётчик
+# увеличивается при каждой реальной вставке. После записи другого процесса (импорт рядом
+# с ботом) число пересчитывается заново. И прибавление, и пересчёт выполняет поток-писатель
+# сразу после фиксации, поэтому пересчёт не может ни пропустить вставку, ни учесть её дважды
+_users_count = None
+_users_count_external = None
+_users_count_lock = threading.Lock()
+
+def _count_inserted():
+    global _users_count
+    with _users_count_lock:
+        if _users_count is not None:
+            _users_count += 1
+    _bump_data_version()
+
+# Версия данных списка пользователей: растёт при каждой вставке и смене привилегий.
+# Кэши отрисованных страниц используют её как часть ключа
+_data_version = 0
+_data_version_lock = threading.Lock()
+
+def _bump_data_version():
+    global _data_version
+    with _data_version_lock:
+        _data_version += 1
+
+def get_data_version():
+    # Записи других процессов (dump_data.py рядом с ботом) видны только через БД
+    return _data_version, pool.external_changes()
+
+# Версии отдельных строк users: растут при смене имени или привилегий пользователя.
+# Кэш карточек использует их как часть ключа; у строк, которые не менялись, локальная версия 0
+_user_versions = {}
+
+def _bump_user_versions(user_ids):
+    with _data_version_lock:
+        for user_id in user_ids:
+            _user_versions[user_id] = _user_versions.get(user_id, 0) + 1
+
+def get_user_version(user_id):
+    return _user_versions.get(user_id, 0), pool.external_changes()
+
+def _insert_user(conn, user_id, username, first_name, last_name, joined_at=None):
+    return conn.execute(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, joined_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (user_id, username, first_name, last_name, joined_at, time.time())).rowcount == 1
+
+CHANNEL_MEMBER_INSERT_SQL = "INSERT OR IGNORE INTO channel_members (channel_id, user_id, joined_at) VALUES (?, ?, ?)"
+
+def _insert_member(conn, channel_id, user_id):
+    if channel_id is None:
+        return False
+    return conn.execute(CHANNEL_MEMBER_INSERT_SQL, (channel_id, user_id, time.time())).rowcount == 1
+
+@timed_call("db")
+def add_user_to_db(user_id, username, first_name, last_name, channel_id=None):
+    logger.info("Добавление пользователя в БД: user_id=%s, username=%s, first_name=%s, last_name=%s", user_id, username, first_name, last_name)
+
+    def write(conn):
+        joined_at = time.time() if channel_id is not None else None
+        inserted = _insert_user(conn, user_id, username, first_name, last_name, joined_at)
+        if _insert_member(conn, channel_id, user_id) and not inserted:
+            _set_first_join(conn, user_id, joined_at)
+        if inserted:
+            pool.after_commit(_count_inserted)
+
+    # Параллельные вставки писатель фиксирует одной транзакцией
+    pool.write(write)
+
+def outbox_params(user, build_rows, now=None):
+    """Параметры OUTBOX_INSERT_SQL для строки users; build_rows(user) -> [(spreadsheet_id, values), ...]."""
+    now = now or time.time()
+    return [(spreadsheet_id, user[0], json.dumps(values, ensure_ascii=False), now)
+            for spreadsheet_id, values in build_rows(user)]
+
+def _set_first_join(conn, user_id, joined_at):
+    # Перенесённый из старой базы пользователь впервые вступает в канал при боте
+    conn.execute("UPDATE users SET joined_at = ? WHERE user_id = ? AND joined_at IS NULL", (joined_at, user_id))
+
+# Новый пользователь добавляется, у известного обновляются username и имя (если изменились)
+UPSERT_USER_SQL = """
+INSERT INTO users (user_id, username, first_name, last_name, joined_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    username = excluded.username, first_name = excluded.first_name, last_name = excluded.last_name,
+    updated_at = excluded.updated_at
+WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name
+    OR last_name IS NOT excluded.last_name
+"""
 
-def add_user_to_db(user_id, username, first_name, last_name):
-    logger.info(f"Добавление пользователя в БД: user_id={user_id}, username={username}, first_name={first_name}, last_name={last_name}")
-    cursor.execute("INSERT OR IGNORE INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
-                   (user_id, username, first_name, last_name))
-    conn.commit()
+@timed_call("db")
+def add_user_with_outbox(channel_id, user_id, username, first_name, last_name, build_rows):
+    """
+    Добавляет пользователя и его участие в канале channel_id одной транзакцией.
+    Строки для таблиц канала ставятся в очередь Google Sheets только для нового участника.
+    Повторная заявка (перевступление, повторная доставка обновления) лишь обновляет username и имя.
+    Возвращает (строку пользователя, новый ли это участник канала).
+    """
+    logger.info("Добавление пользователя в БД и очередь Sheets: channel_id=%s, user_id=%s, username=%s", channel_id, user_id, username)
 
+    def write(conn):
+        now = time.time()
+        previous = conn.execute("SELECT username FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        existed = previous is not None
+        changed = conn.execute(UPSERT_USER_SQL, (user_id, username, first_name, last_name, now, now)).rowcount == 1
+        new_member = _insert_member(conn, channel_id, user_id)
+        if new_member and existed:
+            _set_first_join(conn, user_id, now)
+        user = conn.execute("SELECT user_id, username, first_name, last_name, is_privileged FROM users WHERE user_id=?",
+                            (user_id,)).fetchone()
+        if new_member:
+            conn.executemany(OUTBOX_INSERT_SQL, outbox_params(user, build_rows))
+        if not existed:
+            pool.after_commit(_count_inserted)
+        return existed, changed, new_member, user, previous
+
+    existed, changed, new_member, user, previous = pool.write(write)
+    if existed and changed:
+        _bump_data_version()
+        _bump_user_versions((user_id,))
+        if user[4] and previous[0] != user[1]:
+            _rename_staff(previous[0], user[1])
+        logger.info("Данные пользователя обновлены: user_id=%s, username=%s", user_id, username)
+    return user, new_member
+
+@timed_call("db")
+def fetch_due_outbox(limit):
+    """Записи очереди Sheets, время повтора которых наступило: (id, spreadsheet_id, row_json, attempts)."""
+    cursor = _read().execute(
+        "SELECT id, spreadsheet_id, row_json, attempts FROM sheets_outbox WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+        (time.time(), limit))
+    return cursor.fetchall()
+
+@timed_call("db")
+def delete_outbox(ids):
+    placeholders = ",".join("?" * len(ids))
+    pool.write(lambda conn: conn.execute(f"DELETE FROM sheets_outbox WHERE id IN ({placeholders})", tuple(ids)))
+
+@timed_call("db")
+def reschedule_outbox(entries, error):
+    """entries: [(id, attempts, next_attempt_at), ...] - перенос записей на следующую попытку."""
+    pool.write(lambda conn: conn.executemany(
+        "UPDATE sheets_outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+        [(attempts, next_at, str(error), entry_id) for entry_id, attempts, next_at in entries]))
+
+@timed_call("db")
+def count_outbox():
+    return _read().execute("SELECT COUNT(*) FROM sheets_outbox").fetchone()[0]
+
+@timed_call("db")
+def pending_outbox_user_ids(spreadsheet_id):
+    """user_id, строки которых ещё ждут записи в таблицу spreadsheet_id."""
+    cursor = _read().execute("SELECT DISTINCT user_id FROM sheets_outbox WHERE spreadsheet_id = ?", (spreadsheet_id,))
+    return {row[0] for row in cursor}
+
+def iter_channel_users(channel_id, joined_before=None, fetch_size=5000):
+    """
+    Участники канала (user_id, username, first_name, last_name, is_privileged) по возрастанию user_id,
+    читаются курсором пачками. joined_before отсекает вступивших позже (перенесённые без даты проходят всегда).
+    """
+    sql = ("SELECT u.user_id, u.username, u.first_name, u.last_name, u.is_privileged "
+           "FROM channel_members m JOIN users u ON u.user_id = m.user_id WHERE m.channel_id = ?")
+    params = [channel_id]
+    if joined_before is not None:
+        sql += " AND (m.joined_at IS NULL OR m.joined_at < ?)"
+        params.append(joined_before)
+    cursor = _read().execute(sql + " ORDER BY m.user_id", params)
+    try:
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+@timed_call("db")
+def save_join_digest(channel_id, title, user_ids):
+    """Сохраняет список участников сводки; возвращает его id."""
+    return pool.write(lambda conn: conn.execute(
+        "INSERT INTO join_digests (channel_id, title, user_ids, created_at) VALUES (?, ?, ?, ?)",
+        (channel_id, title, json.dumps(list(user_ids)), time.time())).lastrowid)
+
+@timed_call("db")
+def get_join_digest(digest_id):
+    """(title, user_ids) сводки или None."""
+    row = _read().execute("SELECT title, user_ids FROM join_digests WHERE id = ?", (digest_id,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+@timed_call("db")
+def get_user_channels(user_id):
+    """Каналы пользователя: [(channel_id, joined_at), ...]; joined_at - None для перенесённых из старой базы."""
+    cursor = _read().execute("SELECT channel_id, joined_at FROM channel_members WHERE user_id = ? ORDER BY joined_at",
+                             (user_id,))
+    return cursor.fetchall()
+
+@timed_call("db")
+def count_channel_members():
+    """Число участников по каналам: {channel_id: count}."""
+    cursor = _read().execute("SELECT channel_id, COUNT(*) FROM channel_members GROUP BY channel_id")
+    return dict(cursor.fetchall())
+
+@timed_call("db")
 def get_user_by_id(user_id):
-    logger.debug(f"Запрос пользователя по user_id={user_id}")
-    cursor.execute("SELECT user_id, username, first_name, last_name, is_privileged FROM users WHERE user_id=?", (user_id,))
+    logger.debug("Запрос пользователя по user_id=%s", user_id)
+    cursor = _read().execute("SELECT user_id, username, first_name, last_name, is_privileged FROM users WHERE user_id=?", (user_id,))
     result = cursor.fetchone()
-    logger.debug(f"Результат запроса пользователя по id={user_id}: {result}")
+    logger.debug("Результат запроса пользователя по id=%s: %s", user_id, result)
     return result
 
 
+@timed_call("db")
 def get_users_count():
+    external = pool.external_changes()
+    with _users_count_lock:
+        if _users_count is not None and _users_count_external == external:
+            return _users_count
+
+    def recount(conn):
+        count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+        def store():
+            global _users_count, _users_count_external
+            with _users_count_lock:
+                _users_count, _users_count_external = count, external
+        pool.after_commit(store)
+        return count
+
     logger.info("Запрос количества пользователей в БД")
-    cursor.execute("SELECT COUNT(*) FROM users")
-    count = cursor.fetchone()[0]
-    logger.info(f"Общее количество пользователей: {count}")
+    # Через писателя: COUNT(*) видит ровно те вставки, чьи прибавления к счётчику уже выполнены
+    count = pool.write(recount)
+    logger.info("Общее количество пользователей: %s", count)
     return count
 
-def get_users_page(page=1, per_page=10):
-    offset = (page - 1) * per_page
-    logger.info(f"Получение пользователей для страницы {page} с {per_page} записями (offset={offset})")
-    cursor.execute(
-        "SELECT user_id, username, first_name, last_name, is_privileged FROM users ORDER BY user_id LIMIT ? OFFSET ?",
-        (per_page, offset))
-    users = cursor.fetchall()
-    logger.info(f"Получено {len(users)} пользователей на странице {page}")
+@timed_call("db")
+def get_users_page(page=1, per_page=10, after_id=None, before_id=None, from_id=None):
+    """
+    Страница пользователей, отсортированных по user_id.
+    Листание идёт по ключу (keyset): after_id - следующая страница после последнего id,
+    before_id - предыдущая страница перед первым id, from_id - страница, начинающаяся с id.
+    Без ключа страница выбирается через OFFSET (прямой переход /list_users N).
+    """
+    columns = "SELECT user_id, username, first_name, last_name, is_privileged FROM users"
+    if after_id is not None:
+        logger.info("Получение страницы %s после user_id=%s (%s записей)", page, after_id, per_page, extra={"event": "page_render"})
+        cursor = _read().execute(f"{columns} WHERE user_id > ? ORDER BY user_id LIMIT ?", (after_id, per_page))
+        users = cursor.fetchall()
+    elif before_id is not None:
+        logger.info("Получение страницы %s до user_id=%s (%s записей)", page, before_id, per_page, extra={"event": "page_render"})
+        cursor = _read().execute(f"{columns} WHERE user_id < ? ORDER BY user_id DESC LIMIT ?", (before_id, per_page))
+        users = cursor.fetchall()[::-1]
+    elif from_id is not None:
+        logger.info("Получение страницы %s начиная с user_id=%s (%s записей)", page, from_id, per_page, extra={"event": "page_render"})
+        cursor = _read().execute(f"{columns} WHERE user_id >= ? ORDER BY user_id LIMIT ?", (from_id, per_page))
+        users = cursor.fetchall()
+    else:
+        offset = (page - 1) * per_page
+        logger.info("Получение пользователей для страницы %s с %s записями (offset=%s)", page, per_page, offset, extra={"event": "page_render"})
+        cursor = _read().execute(f"{columns} ORDER BY user_id LIMIT ? OFFSET ?", (per_page, offset))
+        users = cursor.fetchall()
+    logger.info("Получено %s пользователей на странице %s", len(users), page, extra={"event": "page_render"})
     return users
 
-def search_users(query):
-    logger.info(f"Поиск пользователей с запросом: {query}")
-    q = f"%{query}%"
+def _fts_match_expression(query):
+    # Каждое слово запроса ищется как префикс: "ива петр" -> "ива"* "петр"*
+    tokens = re.findall(r"\w+", query)
+    return " ".join(f'"{t}"*' for t in tokens)
+
+@timed_call("db")
+def search_user_ids(query, limit=None):
+    """Возвращает только id найденных пользователей в порядке user_id (не больше limit)."""
+    logger.info("Поиск id пользователей с запросом: %s", query)
+    limit_sql = " LIMIT ?" if limit else ""
+    limit_args = (limit,) if limit else ()
     if query.isdigit():
-        cursor.execute(
-            "SELECT user_id, username, first_name, last_name, is_privileged FROM users WHERE user_id = ? OR username LIKE ? OR first_name LIKE ? OR last_name LIKE ?",
-            (int(query), q, q, q))
+        cursor = _read().execute("SELECT user_id FROM users WHERE user_id = ?", (int(query),))
+        row = cursor.fetchone()
+        if row:
+            return [row[0]]
+    if FTS_ENABLED:
+        match = _fts_match_expression(query)
+        if not match:
+            return []
+        cursor = _read().execute(f"SELECT rowid FROM users_fts WHERE users_fts MATCH ? ORDER BY rowid{limit_sql}",
+                       (match,) + limit_args)
     else:
-        cursor.execute(
-            "SELECT user_id, username, first_name, last_name, is_privileged FROM users WHERE username LIKE ? OR first_name LIKE ? OR last_name LIKE ?",
-            (q, q, q))
-    results = cursor.fetchall()
-    logger.info(f"Найдено {len(results)} пользователей по запросу: {query}")
-    return results
+        q = f"%{query}%"
+        cursor = _read().execute(
+            f"SELECT user_id FROM users WHERE username LIKE ? OR first_name LIKE ? OR last_name LIKE ? "
+            f"ORDER BY user_id{limit_sql}",
+            (q, q, q) + limit_args)
+    ids = [row[0] for row in cursor.fetchall()]
+    logger.info("Найдено %s пользователей по запросу: %s", len(ids), query)
+    return ids
+
+def search_users(query):
+    return get_users_by_ids(search_user_ids(query))
+
+@timed_call("db")
+def get_users_by_ids(user_ids):
+    """Выбирает пользователей по списку id, сохраняя порядок списка."""
+    if not user_ids:
+        return []
+    placeholders = ",".join("?" * len(user_ids))
+    cursor = _read().execute(
+        f"SELECT user_id, username, first_name, last_name, is_privileged FROM users WHERE user_id IN ({placeholders})",
+        tuple(user_ids))
+    by_id = {row[0]: row for row in cursor.fetchall()}
+    return [by_id[uid] for uid in user_ids if uid in by_id]
 
+# Кэш привилегий в памяти: id и username (в нижнем регистре) всех сотрудников. Заполняется при старте
+# (или при первой проверке) и синхронно обновляется в set_privilege, поэтому
+# проверка прав не ходит в БД. После записи другого процесса (второй экземпляр бота,
+# dump_data.py) кэш перечитывается при следующей проверке
+_staff_ids = set()
+_staff_usernames = set()
+_privilege_cache_external = None  # pool.external_changes() на момент загрузки; None - не загружен
+_privilege_generation = 0  # растёт при каждом обновлении кэша своими записями
+_privilege_lock = threading.Lock()
+
+@timed_call("db")
+def load_privilege_cache():
+    global _staff_ids, _staff_usernames, _privilege_cache_external
+    external = pool.external_changes()
+    with _privilege_lock:
+        generation = _privilege_generation
+    cursor = _read().execute("SELECT user_id, username FROM users WHERE is_privileged = 1")
+    rows = cursor.fetchall()
+    with _privilege_lock:
+        _staff_ids = {uid for uid, _ in rows}
+        _staff_usernames = {uname.lower() for _, uname in rows if uname}
+        # Выдача или отзыв прав, пришедшие во время чтения, могли не попасть в rows - тогда перечитаем ещё раз
+        _privilege_cache_external = external if generation == _privilege_generation else None
+    logger.info("Кэш привилегий загружен: %s сотрудников", len(rows))
+
+def _rename_staff(old_username, new_username):
+    # Сотрудник сменил username: старый больше не должен давать права до перезагрузки кэша
+    global _privilege_generation
+    with _privilege_lock:
+        _privilege_generation += 1
+        if old_username:
+            _staff_usernames.discard(old_username.lower())
+        if new_username:
+            _staff_usernames.add(new_username.lower())
+    logger.info("Username сотрудника изменён в кэше привилегий: %s -> %s", old_username, new_username)
+
+@timed_call("db")
 def set_privilege(username, value):
-    logger.info(f"Установка привилегий: username={username}, is_privileged={value}")
+    global _privilege_generation
+    logger.info("Установка привилегий: username=%s, is_privileged=%s", username, value)
     username = username.lstrip('@')
-    cursor.execute("UPDATE users SET is_privileged = ? WHERE username = ?", (value, username))
-    conn.commit()
-    updated = cursor.rowcount > 0
-    logger.info(f"Привилегии обновлены: {updated}")
+
+    # Username в Telegram не зависит от регистра; COLLATE NOCASE попадает в индекс idx_users_username_nocase
+    def update(conn):
+        changed = conn.execute("UPDATE users SET is_privileged = ?, updated_at = ? WHERE username = ? COLLATE NOCASE",
+                               (value, time.time(), username)).rowcount
+        rows = conn.execute("SELECT user_id FROM users WHERE username = ? COLLATE NOCASE", (username,)).fetchall()
+        return changed > 0, [row[0] for row in rows]
+
+    updated, user_ids = pool.write(update)
+    if updated:
+        _bump_data_version()
+        _bump_user_versions(user_ids)
+    if updated:
+        with _privilege_lock:
+            _privilege_generation += 1
+            if value:
+                _staff_ids.update(user_ids)
+                _staff_usernames.add(username.lower())
+            else:
+                _staff_ids.difference_update(user_ids)
+                _staff_usernames.discard(username.lower())
+    logger.info("Привилегии обновлены: %s", updated)
     return updated
 
+@timed_call("db")
 def list_staff():
     logger.info("Запрос списка сотрудников (привилегированных пользователей).")
-    cursor.execute("SELECT user_id, username, first_name, last_name FROM users WHERE is_privileged = 1")
+    cursor = _read().execute("SELECT user_id, username, first_name, last_name FROM users WHERE is_privileged = 1")
     staff = cursor.fetchall()
-    logger.info(f"Найдено сотрудников: {len(staff)}")
+    logger.info("Найдено сотрудников: %s", len(staff))
     return staff
 
-def user_has_privileges(username):
-    logger.info(f"Проверка привилегий для пользователя: {username}")
+def user_has_privileges(username, user_id=None):
+    """Проверка прав по кэшу в памяти: сначала по user_id, затем по username."""
     if username == DIRECTOR_USERNAME:
-        logger.info("Пользователь является директором, доступ разрешён.")
+        logger.debug("Пользователь является директором, доступ разрешён.", extra={"event": "privilege_check"})
         return True
-    username = username.lstrip('@')
-    cursor.execute("SELECT is_privileged FROM users WHERE username = ?", (username,))
-    res = cursor.fetchone()
-    has_privileges = res is not None and res[0] == 1
-    logger.info(f"Пользователь {'имеет' if has_privileges else 'не имеет'} привилегии.")
+    if _privilege_cache_external != pool.external_changes():
+        load_privilege_cache()
+    with _privilege_lock:
+        has_privileges = (user_id is not None and user_id in _staff_ids) or \
+                         (bool(username) and username.lstrip('@').lower() in _staff_usernames)
+    logger.debug("Пользователь %s %s привилегии.", username, 'имеет' if has_privileges else 'не имеет', extra={"event": "privilege_check"})
     return has_privileges
 
 def is_director(username):
-    from config import DIRECTOR_USERNAME
-    logger.info(f"Проверка, является ли пользователь директором: {username}")
     is_dir = username == DIRECTOR_USERNAME
-    logger.info(f"Пользователь {'является' if is_dir else 'не является'} директором.")
+    logger.debug("Пользователь %s %s директором.", username, 'является' if is_dir else 'не является', extra={"event": "privilege_check"})
     return is_dir
@@ -0,0 +1,187 @@
+# db_pool.py
+import logging
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ConnectionPool:
+    """
+    Доступ к SQLite из многих потоков.
+    Чтение: у каждого потока своё соединение, в режиме WAL чтение не ждёт записи.
+    Запись: все изменения выполняет один поток-писатель. Он забирает из очереди
+    все накопившиеся операции и фиксирует их одной транзакцией (group commit),
+    каждая операция при этом изолирована своим SAVEPOINT.
+    Фиксации других процессов (dump_data.py, второй экземпляр бота) замечаются
+    по PRAGMA data_version, см. external_changes().
+    """
+
+    def __init__(self, path, group_commit_max=100):
+        self.path = path
+        self.group_commit_max = group_commit_max
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer_conn = None
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        # Отдельное соединение только для PRAGMA data_version: значение меняется при каждой
+        # фиксации любого другого соединения, в том числе нашего писателя
+        self._watch_conn = None
+        self._watch_lock = threading.Lock()
+        self._seen_version = None
+        self._external_changes = 0
+        # Действия после фиксации текущего пакета; трогает только поток-писатель
+        self._after_commit = []
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def setup(self, func):
+        """Выполняет func(conn) на отдельном соединении вне очереди записи (создание схемы при старте)."""
+        conn = self._connect()
+        try:
+            return func(conn)
+        finally:
+            conn.close()
+
+    def _check_version(self):
+        """Сверяет data_version с последним известным; вызывается под _watch_lock. Возвращает текущее значение."""
+        if self._watch_conn is None:
+            self._watch_conn = self._connect()
+        version = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._seen_version is not None and version != self._seen_version:
+            self._external_changes += 1
+        self._seen_version = version
+        return version
+
+    def external_changes(self):
+        """
+        Счётчик изменений БД, сделанных не писателем этого пула. Растёт - всё, что закэшировано
+        по данным БД, могло устареть. Свои фиксации писатель учитывает сам и счётчик не двигают
+        (кроме редкой гонки, когда лишний раз сбрасываются кэши).
+        """
+        with self._watch_lock:
+            self._check_version()
+            return self._external_changes
+
+    def read(self):
+        """Соединение для чтения, привязанное к текущему потоку."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def submit_write(self, func):
+        """Ставит func(conn) в очередь писателя и возвращает Future с результатом."""
+        self._ensure_writer()
+        future = Future()
+        self._queue.put((func, future))
+        return future
+
+    def write(self, func):
+        """Выполняет func(conn) в потоке-писателе и ждёт фиксации транзакции."""
+        return self.submit_write(func).result()
+
+    def after_commit(self, callback):
+        """
+        Вызывается из func внутри write(): callback() выполнится в потоке-писателе сразу после
+        фиксации транзакции, до следующего пакета и до возврата результата. Если операция
+        откатилась, callback не вызывается.
+        """
+        self._after_commit.append(callback)
+
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer_conn = self._connect()
+                self._writer = threading.Thread(target=self._run_writer, name="sqlite-writer", daemon=True)
+                self._writer.start()
+
+    def _run_writer(self):
+        conn = self._writer_conn
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.group_commit_max:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in batch)
+            batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._commit_batch(conn, batch)
+            if stop:
+                conn.close()
+                return
+
+    def _commit_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Блокировка записи уже у нас: всё, что зафиксировано до этой точки, - чужие изменения
+            with self._watch_lock:
+                before = self._check_version()
+            for func, future in batch:
+                conn.execute("SAVEPOINT op")
+                callbacks = len(self._after_commit)
+                try:
+                    results.append((future, func(conn), None))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    del self._after_commit[callbacks:]
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+            with self._watch_lock:
+                # Ровно одна фиксация с начала транзакции - наша; если успел кто-то ещё или
+                # читатель уже увидел нашу, сверка засчитает её как чужую, что лишь сбросит кэши
+                if self._seen_version == before:
+                    version = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+                    if version == before + 1:
+                        self._seen_version = version
+        except Exception as e:
+            logger.error("Ошибка фиксации пакета из %s операций записи: %s", len(batch), e)
+            self._after_commit.clear()
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Ошибка действия после фиксации: %s", e)
+        if len(batch) > 1:
+            logger.debug("Зафиксировано %s операций записи одной транзакцией", len(batch))
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._writer = None
+        with self._watch_lock:
+            if self._watch_conn is not None:
+                self._watch_conn.close()
+                self._watch_conn = None
+                self._seen_version = None
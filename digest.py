@@ -0,0 +1,106 @@
+# digest.py
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _ChannelWindow:
+    def __init__(self, now):
+        self.started = now
+        self.single_sent = 0
+        self.pending = []
+        self.pending_since = None
+
+
+class JoinDigest:
+    """
+    Сводные уведомления о новых участниках при наплыве заявок.
+    В каждом окне window секунд первые threshold участников канала уведомляются по одному
+    (при обычном трафике всё остаётся как раньше). Остальные копятся и уходят одной сводкой
+    через window секунд после первого отложенного или сразу при наборе max_users.
+    send_single(channel_id, user) и send_digest(channel_id, users) выполняют саму рассылку.
+    """
+
+    def __init__(self, send_single, send_digest, window=60, threshold=5, max_users=500):
+        self.send_single = send_single
+        self.send_digest = send_digest
+        self.window = window
+        self.threshold = threshold
+        self.max_users = max_users
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def add(self, channel_id, user):
+        now = time.monotonic()
+        batch = None
+        with self._lock:
+            state = self._channels.get(channel_id)
+            if state is None:
+                state = self._channels[channel_id] = _ChannelWindow(now)
+            elif now - state.started >= self.window:
+                state.started = now
+                state.single_sent = 0
+            if not state.pending and state.single_sent < self.threshold:
+                state.single_sent += 1
+                single = True
+            else:
+                single = False
+                if not state.pending:
+                    state.pending_since = now
+                state.pending.append(user)
+                if len(state.pending) >= self.max_users:
+                    batch, state.pending, state.pending_since = state.pending, [], None
+        if single:
+            self.send_single(channel_id, user)
+        elif batch:
+            self._send(channel_id, batch)
+
+    def _send(self, channel_id, users):
+        try:
+            self.send_digest(channel_id, users)
+            logger.info("Сводка о %s новых участниках канала %s поставлена в очередь", len(users), channel_id)
+        except Exception as e:
+            logger.error("Не удалось отправить сводку о %s участниках канала %s: %s", len(users), channel_id, e)
+
+    def flush(self, force=False):
+        """Отправляет сводки, окно которых истекло (с force - все накопленные). Возвращает число сводок."""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for channel_id, state in self._channels.items():
+                if state.pending and (force or now - state.pending_since >= self.window):
+                    due.append((channel_id, state.pending))
+                    state.pending, state.pending_since = [], None
+        for channel_id, users in due:
+            self._send(channel_id, users)
+        return len(due)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="join-digest", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает поток и отправляет всё, что накоплено."""
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush(force=True)
+
+    def _run(self):
+        # Точность окна - секунда, чаще проверять незачем
+        while not self._stopping:
+            self._wake.wait(min(1.0, self.window))
+            self._wake.clear()
+            if self._stopping:
+                return
+            self.flush()
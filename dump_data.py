@@ -1,33 +1,168 @@
+# dump_data.py
+# Потоковый импорт пользователей в БД из выгрузок CSV/JSONL.
+#
+#   python dump_data.py members.csv
+#   python dump_data.py members.jsonl --chunk-size 20000 --sheets
+#   python dump_data.py other.csv --channel -1001234567890
+#
+# Ожидаемые поля: user_id, username, first_name, last_name и необязательное is_privileged
+# (в CSV - строка заголовка с этими именами). Файл читается построчно, записи вставляются
+# пачками, каждая пачка - одна транзакция. После каждой пачки пишется контрольная точка,
+# поэтому прерванный импорт при повторном запуске продолжается с места остановки.
+# Все импортированные пользователи записываются участниками канала --channel.
+import argparse
+import csv
+import functools
+import json
+import logging
+import os
 import sqlite3
+import time
 
+from config import DB_PATH, CHANNEL_ID, CHANNELS
+from log_setup import setup_logging
+import db  # доводит схему БД до текущей версии (migrations.py) и создаёт индекс поиска
 
-conn = sqlite3.connect('users.db')
-cursor = conn.cursor()
+logger = logging.getLogger(__name__)
 
-# Создание таблицы
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    username TEXT,
-    first_name TEXT,
-    last_name TEXT
-)
-''')
+INSERT_SQL = ("INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, is_privileged, joined_at, updated_at) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?)")
 
-# Данные пользователей
-# По необходимости можно задампить пользоваетей в БД для теста
-users_data = [
-    (7321932241, None, 'Yahaya', 'Isyaku'),
-]
 
-# Заполнение таблицы данными
-cursor.executemany('''
-INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-VALUES (?, ?, ?, ?)
-''', users_data)
+def read_records(path, fmt):
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
 
 
-conn.commit()
-conn.close()
+def to_row(record):
+    def text(key):
+        value = record.get(key)
+        return value if value not in (None, '') else None
 
-print("Данные успешно добавлены в базу данных")
+    return (int(record['user_id']), text('username'), text('first_name'), text('last_name'),
+            int(record.get('is_privileged') or 0))
+
+
+def load_checkpoint(path, source):
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('source') != os.path.abspath(source):
+        logger.warning("Контрольная точка %s относится к другому файлу, начинаем сначала", path)
+        return 0
+    return data['records']
+
+
+def save_checkpoint(path, source, records):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'source': os.path.abspath(source), 'records': records}, f)
+    os.replace(tmp, path)
+
+
+def connect_for_import():
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    # Настройки для массовой вставки: WAL, без fsync на каждую транзакцию, большой кэш страниц
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-200000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def import_chunk(conn, rows, to_sheets, channel_id):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        new_rows = rows
+        if to_sheets:
+            placeholders = ",".join("?" * len(rows))
+            existing = {r[0] for r in conn.execute(
+                f"SELECT user_id FROM channel_members WHERE channel_id = ? AND user_id IN ({placeholders})",
+                [channel_id] + [r[0] for r in rows])}
+            new_rows = [r for r in rows if r[0] not in existing]
+        now = time.time()
+        # Дата вступления у импортированных неизвестна - как у перенесённых из старой базы;
+        # иначе весь импорт выглядел бы свежими заявками для /export_users и сверки таблиц
+        inserted = conn.executemany(INSERT_SQL, [r + (None, now) for r in rows]).rowcount
+        conn.executemany(db.CHANNEL_MEMBER_INSERT_SQL, [(channel_id, r[0], None) for r in rows])
+        if to_sheets:
+            # Строки для таблиц канала попадают в очередь sheets_outbox той же транзакцией,
+            # запущенный бот отправит их в Google Sheets
+            from google_sheets import sheet_rows
+            build_rows = functools.partial(sheet_rows, channel_id=channel_id)
+            conn.executemany(db.OUTBOX_INSERT_SQL,
+                             [p for r in new_rows for p in db.outbox_params(r, build_rows, now)])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return inserted
+
+
+def run_import(source, fmt, chunk_size, checkpoint_path, to_sheets, channel_id=CHANNEL_ID):
+    skip = load_checkpoint(checkpoint_path, source)
+    if skip:
+        logger.info("Продолжаем импорт с записи %s (контрольная точка %s)", skip, checkpoint_path)
+
+    conn = connect_for_import()
+    started = time.monotonic()
+    processed = skip
+    inserted_total = 0
+    chunk = []
+
+    def flush():
+        nonlocal processed, inserted_total, chunk
+        inserted_total += import_chunk(conn, chunk, to_sheets, channel_id)
+        processed += len(chunk)
+        chunk = []
+        save_checkpoint(checkpoint_path, source, processed)
+        elapsed = time.monotonic() - started
+        rate = (processed - skip) / elapsed if elapsed else 0
+        logger.info("Обработано %s записей, добавлено %s, %.0f зап/с", processed, inserted_total, rate)
+
+    try:
+        for i, record in enumerate(read_records(source, fmt)):
+            if i < skip:
+                continue
+            chunk.append(to_row(record))
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+    finally:
+        conn.close()
+
+    elapsed = time.monotonic() - started
+    logger.info("Импорт завершён: обработано %s записей за %.1f c, добавлено новых %s", processed - skip, elapsed, inserted_total)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Потоковый импорт пользователей в БД из CSV/JSONL")
+    parser.add_argument('source', help="путь к файлу выгрузки")
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help="формат файла (по умолчанию - по расширению)")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="записей в одной транзакции")
+    parser.add_argument('--checkpoint', help="файл контрольной точки (по умолчанию <source>.checkpoint)")
+    parser.add_argument('--sheets', action='store_true', help="поставить новых участников в очередь записи в таблицы канала")
+    parser.add_argument('--channel', type=int, default=CHANNEL_ID, help="id канала из config.CHANNELS (по умолчанию CHANNEL_ID)")
+    args = parser.parse_args()
+
+    setup_logging()
+    fmt = args.format or ('jsonl' if args.source.endswith(('.jsonl', '.json')) else 'csv')
+    checkpoint = args.checkpoint or f"{args.source}.checkpoint"
+    if args.channel not in CHANNELS:
+        parser.error(f"канала {args.channel} нет в config.CHANNELS")
+    run_import(args.source, fmt, args.chunk_size, checkpoint, args.sheets, args.channel)
+
+
+if __name__ == "__main__":
+    main()
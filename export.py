@@ -0,0 +1,135 @@
+# export.py
+# Выгрузка пользователей в файл для команды /export_users: gzip-сжатый CSV или XLSX.
+# Строки читаются курсором пачками по EXPORT_FETCH_SIZE и сразу пишутся в файл,
+# поэтому память не зависит от размера таблицы.
+import csv
+import gzip
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from config import EXPORT_FETCH_SIZE
+from db import pool
+
+logger = logging.getLogger(__name__)
+
+HEADER = ["user_id", "username", "first_name", "last_name", "is_privileged", "joined_at"]
+
+
+class ExportOptions:
+    """Параметры выгрузки: формат ("csv" или "xlsx"), только сотрудники, вступившие не раньше joined_after."""
+
+    def __init__(self, fmt="csv", privileged_only=False, joined_after=None):
+        self.fmt = fmt
+        self.privileged_only = privileged_only
+        self.joined_after = joined_after
+
+    def describe(self):
+        parts = [self.fmt.upper()]
+        if self.privileged_only:
+            parts.append("только сотрудники")
+        if self.joined_after is not None:
+            parts.append(f"вступившие с {datetime.fromtimestamp(self.joined_after):%Y-%m-%d}")
+        return ", ".join(parts)
+
+
+def parse_export_args(text):
+    """
+    Разбирает аргументы команды: /export_users [csv|xlsx] [staff] [ГГГГ-ММ-ДД].
+    При неизвестном аргументе - ValueError.
+    """
+    options = ExportOptions()
+    for arg in text.split()[1:]:
+        arg = arg.lower()
+        if arg in ("csv", "xlsx"):
+            options.fmt = arg
+        elif arg in ("staff", "privileged"):
+            options.privileged_only = True
+        else:
+            try:
+                options.joined_after = datetime.strptime(arg, "%Y-%m-%d").timestamp()
+            except ValueError:
+                raise ValueError(f"Неизвестный аргумент: {arg}")
+    return options
+
+
+def _query(options):
+    # users.joined_at - первое вступление в любой из каналов; у перенесённых из старой базы его нет.
+    # Форматирует сама SQLite: на миллионах строк это заметно быстрее, чем datetime в Python
+    sql = ("SELECT u.user_id, COALESCE(u.username, ''), COALESCE(u.first_name, ''), COALESCE(u.last_name, ''), "
+           "u.is_privileged, COALESCE(datetime(u.joined_at, 'unixepoch', 'localtime'), '') "
+           "FROM users u")
+    conditions, params = [], []
+    if options.privileged_only:
+        conditions.append("u.is_privileged = 1")
+    if options.joined_after is not None:
+        conditions.append("u.joined_at >= ?")
+        params.append(options.joined_after)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql + " ORDER BY u.user_id", params
+
+
+def _iter_rows(options):
+    sql, params = _query(options)
+    cursor = pool.read().execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def _write_csv(path, rows):
+    count = 0
+    # Уровень 6 почти не уступает 9 по размеру и сжимает в разы быстрее
+    with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _write_xlsx(path, rows):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("Для выгрузки в XLSX установите openpyxl (pip install openpyxl)")
+    # write_only: строки сразу сбрасываются во временный XML, а не держатся в памяти
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("users")
+    sheet.append(HEADER)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def export_users(options):
+    """
+    Выгружает пользователей во временный файл. Возвращает (путь, имя файла для отправки, число строк).
+    Файл удаляет вызывающий.
+    """
+    started = time.monotonic()
+    suffix = ".xlsx" if options.fmt == "xlsx" else ".csv.gz"
+    fd, path = tempfile.mkstemp(prefix="users-export-", suffix=suffix)
+    os.close(fd)
+    try:
+        writer = _write_xlsx if options.fmt == "xlsx" else _write_csv
+        count = writer(path, _iter_rows(options))
+    except Exception:
+        os.remove(path)
+        raise
+    filename = f"users-{datetime.now():%Y%m%d-%H%M%S}{suffix}"
+    logger.info("Выгрузка пользователей (%s): %s строк, %s байт за %.1f c",
+                options.describe(), count, os.path.getsize(path), time.monotonic() - started)
+    return path, filename, count
@@ -0,0 +1,78 @@
+# fake_sheets.py
+# Таблицы в памяти вместо Google Sheets: для локального запуска, тестов и нагрузочных прогонов.
+# Включается через config.SHEETS_BACKEND = "fake" или google_sheets.set_backend(FakeSheetsBackend()).
+import re
+import threading
+
+
+def _a1_to_index(cell):
+    """'B3' -> (row=3, col=2), нумерация с единицы, как в Google Sheets."""
+    match = re.fullmatch(r"([A-Z]+)(\d+)", cell)
+    letters, row = match.groups()
+    col = 0
+    for ch in letters:
+        col = col * 26 + (ord(ch) - ord('A') + 1)
+    return int(row), col
+
+
+class FakeWorksheet:
+    """Подмножество методов gspread.Worksheet, которое использует бот."""
+
+    def __init__(self, title="Sheet1"):
+        self.title = title
+        self.rows = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def append_row(self, values, **kwargs):
+        self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.rows.extend([list(row) for row in values])
+
+    def get_all_values(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            return [[str(v) for v in row] for row in self.rows]
+
+    def update(self, values, range_name, **kwargs):
+        self.batch_update([{'range': range_name, 'values': values}], **kwargs)
+
+    def batch_update(self, data, **kwargs):
+        with self._lock:
+            self.calls += 1
+            for item in data:
+                start = item['range'].split(':')[0]
+                row, col = _a1_to_index(start)
+                for r_offset, values in enumerate(item['values']):
+                    r = row - 1 + r_offset
+                    while len(self.rows) <= r:
+                        self.rows.append([])
+                    target = self.rows[r]
+                    for c_offset, value in enumerate(values):
+                        c = col - 1 + c_offset
+                        while len(target) <= c:
+                            target.append('')
+                        target[c] = value
+
+
+class FakeSheetsBackend:
+    """По одной FakeWorksheet на каждый spreadsheet id; создаются при первом обращении."""
+
+    def __init__(self):
+        self.worksheets = {}
+        self._lock = threading.Lock()
+
+    def connect(self):
+        pass
+
+    def open_worksheet(self, spreadsheet_id):
+        with self._lock:
+            if spreadsheet_id not in self.worksheets:
+                self.worksheets[spreadsheet_id] = FakeWorksheet()
+            return self.worksheets[spreadsheet_id]
+
+    def classify_error(self, error):
+        return None
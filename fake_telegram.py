@@ -0,0 +1,234 @@
+# fake_telegram.py
+# Локальная замена Telegram Bot API для нагрузочных прогонов (bench.py) без настоящего токена и канала.
+# Бот подключается к ней через telebot.apihelper.API_URL = server.api_url.
+#
+# Поддерживаются getUpdates (long polling), approveChatJoinRequest, sendMessage, editMessageText,
+# answerCallbackQuery; остальные методы отвечают ok/true. Можно добавить задержку ответа
+# и случайные 429 Too Many Requests для методов рассылки.
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Методы, для которых имитируются лимиты Telegram (429)
+RATE_LIMITED_METHODS = ('sendMessage', 'editMessageText')
+
+
+class FakeTelegramServer:
+    """
+    Очередь обновлений для getUpdates и журнал исходящих вызовов бота.
+    latency и jitter - задержка ответа на каждый метод, кроме getUpdates (секунды);
+    rate_limit - доля вызовов sendMessage/editMessageText, получающих 429 с retry_after.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, rate_limit=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._cond = threading.Condition()
+        # Время постановки заявки в очередь и время ответа на approveChatJoinRequest по user_id
+        self.join_enqueued = {}
+        self.join_approved = {}
+        # Исходящие сообщения по chat_id: [(время, метод, параметры, message_id), ...]
+        self.outgoing = {}
+        self.calls = {}
+        self.rate_limited = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        with self._cond:
+            self._cond.notify_all()
+
+    # --- Входящие обновления -------------------------------------------------
+
+    def push_update(self, update):
+        with self._cond:
+            update = dict(update, update_id=self._next_update_id)
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._cond.notify_all()
+        return update['update_id']
+
+    def push_join_request(self, chat_id, user_id, username=None, first_name="User", last_name=None):
+        user = {"id": user_id, "is_bot": False, "first_name": first_name}
+        if username:
+            user["username"] = username
+        if last_name:
+            user["last_name"] = last_name
+        with self._cond:
+            self.join_enqueued[user_id] = time.perf_counter()
+        return self.push_update({"chat_join_request": {
+            "chat": {"id": chat_id, "type": "channel", "title": "bench"},
+            "from": user, "user_chat_id": user_id, "date": int(time.time()),
+        }})
+
+    def _private_message(self, chat_id, username, text, message_id=None):
+        return {
+            "message_id": message_id or self._new_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Admin", "username": username},
+            "text": text,
+        }
+
+    def push_message(self, chat_id, username, text):
+        message = self._private_message(chat_id, username, text)
+        if text.startswith('/'):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return self.push_update({"message": message})
+
+    def push_callback(self, chat_id, username, data, message_id):
+        return self.push_update({"callback_query": {
+            "id": str(self._new_message_id()),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Admin", "username": username},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": self._private_message(chat_id, username, "", message_id=message_id),
+        }})
+
+    def _new_message_id(self):
+        with self._cond:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            return message_id
+
+    # --- Ожидание ответов бота -----------------------------------------------
+
+    def outgoing_count(self, chat_id):
+        with self._cond:
+            return len(self.outgoing.get(chat_id, ()))
+
+    def wait_outgoing(self, chat_id, since, methods, timeout=30.0):
+        """Ждёт исходящий вызов одного из methods в чат chat_id с номером >= since. Возвращает запись или None."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                entries = self.outgoing.get(chat_id, [])
+                for entry in entries[since:]:
+                    if entry[1] in methods:
+                        return entry
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def wait_approved(self, count, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.join_approved) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    # --- Обработка запросов бота ---------------------------------------------
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            # Подтверждённые обновления (id < offset) больше не отдаются
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._updates[:limit]
+
+    def _record(self, chat_id, method, params, message_id=None):
+        with self._cond:
+            self.outgoing.setdefault(chat_id, []).append((time.perf_counter(), method, params, message_id))
+            self._cond.notify_all()
+
+    def handle(self, method, params):
+        """Возвращает (HTTP-статус, JSON-ответ) для вызова method."""
+        with self._cond:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getUpdates':
+            return 200, {"ok": True, "result": self._get_updates(params)}
+
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if method in RATE_LIMITED_METHODS and self.rate_limit and random.random() < self.rate_limit:
+            with self._cond:
+                self.rate_limited += 1
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+
+        if method == 'getMe':
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+        if method == 'approveChatJoinRequest':
+            with self._cond:
+                self.join_approved[int(params['user_id'])] = time.perf_counter()
+                self._cond.notify_all()
+            return 200, {"ok": True, "result": True}
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            message_id = int(params['message_id']) if method == 'editMessageText' else self._new_message_id()
+            self._record(chat_id, method, params, message_id)
+            message = {"message_id": message_id, "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private"}, "text": params.get('text', '')}
+            return 200, {"ok": True, "result": message}
+        return 200, {"ok": True, "result": True}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Заголовки и тело уходят отдельными записями: с алгоритмом Нейгла и отложенным ACK клиента
+            # каждый ответ по keep-alive задерживался на ~40 мс, и бенчмарк мерил стенд, а не бота
+            disable_nagle_algorithm = True
+
+            def _dispatch(self):
+                parts = urlsplit(self.path)
+                method = parts.path.rstrip('/').rsplit('/', 1)[-1]
+                params = dict(parse_qsl(parts.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body))
+                    else:
+                        params.update(parse_qsl(body.decode('utf-8')))
+                status, payload = server.handle(method, params)
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
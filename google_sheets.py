@@ -1,23 +1,136 @@
 # google_sheets.py
 import logging
-import gspread
-from google.oauth2.service_account import Credentials
+import threading
+import time
 
-from config import CREDENTIALS_FILE, SPREADSHEET_ID_1, SPREADSHEET_ID_2
+from config import CREDENTIALS_FILE, CHANNEL_ID, CHANNELS, SHEETS_BACKEND, SHEETS_RETRIES, SHEETS_RETRY_DELAY
+from metrics import track_call
 
 logger = logging.getLogger(__name__)
 
-scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-creds = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=scopes)
-gc = gspread.authorize(creds)
 
-sh1 = gc.open_by_key(SPREADSHEET_ID_1)
-worksheet1 = sh1.sheet1
+class GoogleSheetsBackend:
+    """Настоящие Google Таблицы через gspread и сервисный аккаунт."""
 
-sh2 = gc.open_by_key(SPREADSHEET_ID_2)
-worksheet2 = sh2.sheet1
+    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
 
-def add_user_to_sheets(user_id, username, first_name, last_name, is_privileged):
-    logger.info(f"Запись данных пользователя в Google Sheets: user_id={user_id}")
-    worksheet1.append_row([user_id, username if username else '', first_name if first_name else '', last_name if last_name else '', is_privileged])
-    worksheet2.append_row([user_id, first_name if first_name else '', last_name if last_name else ''])
+    def __init__(self, credentials_file=CREDENTIALS_FILE):
+        self.credentials_file = credentials_file
+        self._gc = None
+
+    def connect(self):
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        logger.info("Авторизация в Google Sheets...")
+        creds = Credentials.from_service_account_file(self.credentials_file, scopes=self.scopes)
+        self._gc = gspread.authorize(creds)
+
+    def open_worksheet(self, spreadsheet_id):
+        return self._gc.open_by_key(spreadsheet_id).sheet1
+
+    def classify_error(self, error):
+        """'reauth' - переподключиться и повторить, 'retry' - просто повторить, None - не повторять."""
+        import gspread
+        import requests
+        from google.auth import exceptions as auth_exceptions
+
+        if isinstance(error, (auth_exceptions.RefreshError, auth_exceptions.TransportError,
+                              requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return 'reauth'
+        if isinstance(error, gspread.exceptions.APIError):
+            code = error.response.status_code
+            if code == 401:
+                return 'reauth'
+            if code == 429 or code >= 500:
+                return 'retry'
+        return None
+
+
+def create_backend(name=SHEETS_BACKEND):
+    if name == "fake":
+        from fake_sheets import FakeSheetsBackend
+        return FakeSheetsBackend()
+    return GoogleSheetsBackend()
+
+
+class SheetsClient:
+    """
+    Ленивый клиент таблиц: подключается при первом обращении, кэширует листы
+    и при истёкшем токене или сетевой ошибке переподключается с экспоненциальной паузой.
+    Запуск бота от доступности Google не зависит.
+    """
+
+    def __init__(self, backend, retries=SHEETS_RETRIES, retry_delay=SHEETS_RETRY_DELAY):
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._backend = backend
+        self._connected = False
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return self._backend
+
+    def set_backend(self, backend):
+        """Подменяет источник таблиц (например, на FakeSheetsBackend в тестах)."""
+        with self._lock:
+            self._backend = backend
+            self._connected = False
+            self._worksheets = {}
+
+    def _reset(self):
+        with self._lock:
+            self._connected = False
+            self._worksheets = {}
+
+    def worksheet(self, spreadsheet_id):
+        with self._lock:
+            if not self._connected:
+                self._backend.connect()
+                self._connected = True
+            ws = self._worksheets.get(spreadsheet_id)
+            if ws is None:
+                ws = self._backend.open_worksheet(spreadsheet_id)
+                self._worksheets[spreadsheet_id] = ws
+            return ws
+
+    def call(self, spreadsheet_id, method, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                with track_call("sheets", method):
+                    return getattr(self.worksheet(spreadsheet_id), method)(*args, **kwargs)
+            except Exception as e:
+                kind = self._backend.classify_error(e)
+                if kind is None or attempt >= self.retries:
+                    raise
+                attempt += 1
+                delay = self.retry_delay * (2 ** (attempt - 1))
+                action = "переподключение и повтор" if kind == 'reauth' else "повтор"
+                logger.warning("Google Sheets: %s не выполнен (%s), %s через %s c (попытка %s/%s)",
+                               method, e, action, delay, attempt, self.retries)
+                if kind == 'reauth':
+                    self._reset()
+                time.sleep(delay)
+
+    def append_rows(self, spreadsheet_id, rows):
+        return self.call(spreadsheet_id, 'append_rows', rows)
+
+
+sheets = SheetsClient(create_backend())
+
+
+def set_backend(backend):
+    sheets.set_backend(backend)
+
+
+def sheet_rows(user, channel_id=CHANNEL_ID):
+    """Строки пользователя для таблиц канала (config.CHANNELS): [(spreadsheet_id, values), ...]."""
+    user_id, username, first_name, last_name, is_privileged = user
+    formats = {
+        "full": [user_id, username if username else '', first_name if first_name else '', last_name if last_name else '', is_privileged],
+        "short": [user_id, first_name if first_name else '', last_name if last_name else ''],
+    }
+    return [(spreadsheet_id, formats[row_format]) for spreadsheet_id, row_format in CHANNELS[channel_id]["sheets"]]
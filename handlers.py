@@ -1,31 +1,94 @@
 # handlers.py
+import functools
+import html
 import logging
 import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import telebot
+from cachetools import LRUCache
 from telebot import types
 
-from config import TOKEN
-from db import (add_user_to_db, get_user_by_id, get_users_count, get_users_page,
-                search_users, list_staff)
-from google_sheets import add_user_to_sheets
+from config import (TOKEN, CHANNELS, PIPELINE_QUEUE_SIZE, PIPELINE_RETRIES, PIPELINE_RETRY_DELAY,
+                    PIPELINE_DB_WORKERS, PIPELINE_NOTIFY_WORKERS, PIPELINE_SUBMIT_TIMEOUT, PIPELINE_BACKLOG_SIZE,
+                    NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_RATE, NOTIFY_WORKERS, NOTIFY_MAX_RETRIES,
+                    SEARCH_SESSION_MAX, SEARCH_SESSION_TTL, SEARCH_MAX_RESULTS, USERS_PAGE_CACHE_SIZE, USER_CARD_CACHE_SIZE,
+                    RECENT_MEMBERS_CACHE_SIZE, DIGEST_ENABLED, DIGEST_WINDOW, DIGEST_THRESHOLD,
+                    DIGEST_MAX_USERS, DIGEST_LIST_LIMIT, EXPORT_WORKERS, EXPORT_MAX_FILE_SIZE,
+                    RECONCILE_PROGRESS_INTERVAL)
+from db import (pool as db_pool, load_privilege_cache, add_user_with_outbox, get_users_count, get_users_page,
+                search_user_ids, get_users_by_ids, list_staff, count_outbox, get_data_version, get_user_by_id,
+                get_user_version, save_join_digest, get_join_digest)
+from digest import JoinDigest
+from export import export_users
+from google_sheets import sheet_rows
+import metrics
+from metrics import timed_handler
+from notifier import NotificationDispatcher
+from outbox import outbox_worker
+from pipeline import Backlog, IngestionPipeline
+from reconcile import reconcile
+from search_sessions import SearchSessions
 
 logger = logging.getLogger(__name__)
 
 bot = telebot.TeleBot(TOKEN, parse_mode='HTML')
 
+search_sessions = SearchSessions(maxsize=SEARCH_SESSION_MAX, ttl=SEARCH_SESSION_TTL)
+
+dispatcher = NotificationDispatcher(bot.send_message, global_rate=NOTIFY_GLOBAL_RATE,
+                                    per_chat_rate=NOTIFY_PER_CHAT_RATE, workers=NOTIFY_WORKERS,
+                                    max_retries=NOTIFY_MAX_RETRIES)
+
+
+START_TEXT = ("Привет! 👋\n\n"
+              "Это служебный бот, который помогает администрировать закрытый канал. Я автоматически принимаю заявки на вступление от пользователей, сохраняю их данные в базу,"
+              "добавляю запись в гугл таблицы, а также отправляю уведомление всем сотрудникам о новом пользователе и позволяю просматривать список участников. "
+              "Кроме того, для уполномоченных лиц доступно управление правами пользователей.\n\n"
+              "Чтобы узнать о моих возможностях, используй команду /help.")
+
+HELP_TEXT = (
+    "<b>Доступные команды:</b>\n\n"
+    "/start - Старт / Рестарт\n"
+    "/help - Список команд и функционала.\n\n"
+    "<b>Для директора и сотрудников:</b>\n"
+    "/list_users [номер страницы] - Просмотреть список пользователей по страницам (по 10 записей на странице).\n"
+    "/search_users - Поиск пользователя по username, имени, фамилии или ID.\n"
+    "/list_staff - Показать список сотрудников (пользователей с правами).\n"
+    "/export_users [csv|xlsx] [staff] [ГГГГ-ММ-ДД] - Выгрузить пользователей файлом: "
+    "только сотрудников (staff), вступивших не раньше даты.\n\n"
+    "<b>Только для директора:</b>\n"
+    "/grant - Выдать права пользователю.\n"
+    "/revoke - Забрать права у пользователя.\n"
+    "/stats - Время работы обработчиков, обращений к БД, Google Sheets и Telegram, очереди.\n"
+    "/reconcile [dry] - Сверить Google Таблицы с БД и дописать недостающее (dry - только отчёт).\n"
+)
+
 
 def insufficient_rights(message):
-    logger.warning(f"Недостаточно прав у пользователя: {message.from_user.username}")
+    logger.warning("Недостаточно прав у пользователя: %s", message.from_user.username)
     bot.reply_to(message, "У вас недостаточно прав, обратитесь к директору для получения прав.")
 
 
-def notify_staff_about_new_user(user_id, username, first_name, last_name):
-    staff_members = list_staff()
+def channel_staff(channel_id):
+    """Сотрудники, получающие уведомления о заявках в канал: все с правами или только из CHANNELS[...]["staff"]."""
+    staff = list_staff()
+    # Username в Telegram не зависит от регистра
+    allowed = {name.lstrip('@').lower() for name in CHANNELS[channel_id].get("staff") or ()}
+    if allowed:
+        staff = [s for s in staff if s[1] and s[1].lower() in allowed]
+    return staff
+
+
+def notify_staff_about_new_user(channel_id, user_id, username, first_name, last_name):
+    staff_members = channel_staff(channel_id)
 
     display_username = f"@{username}" if username else ''
     text = (
-        "<b>Новый пользователь!</b>\n\n"
+        f"<b>Новый пользователь в канале «{CHANNELS[channel_id]['title']}»!</b>\n\n"
         f"ID: {user_id}\n"
         f"Username: {display_username or 'нет'}\n"
         f"Имя: {first_name or 'нет'}\n"
@@ -33,94 +96,275 @@ def notify_staff_about_new_user(user_id, username, first_name, last_name):
         "Пользователь был добавлен в БД и Google Sheets."
     )
 
+    # Рассылка идёт параллельно через диспетчер с учётом лимитов Telegram
     for s in staff_members:
         s_uid, s_uname, s_fname, s_lname = s
-        try:
-            bot.send_message(s_uid, text)
-            logger.info(f"Отправлено уведомление сотруднику: user_id={s_uid}")
-        except Exception as e:
-            logger.error(f"Не удалось отправить сообщение сотруднику user_id={s_uid}: {e}")
+        dispatcher.send(s_uid, text)
+    logger.info("Уведомление о user_id=%s (канал %s) поставлено в очередь для %s сотрудников", user_id, channel_id, len(staff_members))
+
+
+# Токены сводок в callback_data search_page: '#' + id в join_digests. Токены сессий поиска
+# (secrets.token_urlsafe) этот символ не содержат
+DIGEST_TOKEN_PREFIX = "#"
+
+
+def notify_staff_about_new_users(channel_id, users):
+    """Одна сводка о нескольких новых участниках канала с кнопкой перехода к их списку."""
+    staff_members = channel_staff(channel_id)
+    if not staff_members:
+        return
+    title = CHANNELS[channel_id]['title']
+
+    lines = []
+    for uid, uname, fname, lname, priv in users[:DIGEST_LIST_LIMIT]:
+        parts = [str(uid)]
+        if uname:
+            parts.append(f"@{uname}")
+        name = f"{fname or ''} {lname or ''}".strip()
+        if name:
+            parts.append(name)
+        lines.append(html.escape(" ".join(parts)))
+    text = (f"<b>Новые пользователи в канале «{title}»: {len(users)}</b>\n\n" + "\n".join(lines))
+    if len(users) > DIGEST_LIST_LIMIT:
+        text += f"\n… и ещё {len(users) - DIGEST_LIST_LIMIT}"
+    text += "\n\nВсе пользователи добавлены в БД и Google Sheets."
+
+    # Список новых участников открывается как результаты поиска: кнопки листания и карточки уже есть.
+    # Он хранится в БД, чтобы кнопка не протухла вместе с сессиями поиска
+    query, user_ids = f"новые в «{title}»", [u[0] for u in users]
+    try:
+        token = f"{DIGEST_TOKEN_PREFIX}{save_join_digest(channel_id, query, user_ids)}"
+    except Exception as e:
+        logger.error("Не удалось сохранить список сводки, кнопка будет работать час: %s", e)
+        token = search_sessions.create(query, user_ids)
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(types.InlineKeyboardButton("📄 Открыть список", callback_data=f"search_page:{token}:1"))
+
+    for s in staff_members:
+        dispatcher.send(s[0], text, reply_markup=keyboard)
+    logger.info("Сводка о %s участниках (канал %s) поставлена в очередь для %s сотрудников", len(users), channel_id, len(staff_members))
+
+
+def _notify_single(channel_id, user):
+    uid, uname, fname, lname, priv = user
+    notify_staff_about_new_user(channel_id, uid, uname, fname, lname)
+
+
+digest = JoinDigest(_notify_single, notify_staff_about_new_users, window=DIGEST_WINDOW,
+                    threshold=DIGEST_THRESHOLD, max_users=DIGEST_MAX_USERS)
+
+
+# Недавно сохранённые участники: (channel_id, user_id) -> (username, first_name, last_name).
+# Повторная заявка с теми же данными отбрасывается без обращения к БД; промах кэша
+# проверяется по первичному ключу в _store_user_stage
+_recent_members = LRUCache(maxsize=RECENT_MEMBERS_CACHE_SIZE)
+_recent_members_lock = threading.Lock()
+
+
+def _store_user_stage(item):
+    channel_id, user_id, username, first_name, last_name = item
+    # Пользователь, его участие в канале и строки для таблиц канала фиксируются одной транзакцией,
+    # дальше таблицы заполняет outbox_worker
+    row, new_member = add_user_with_outbox(channel_id, user_id, username, first_name, last_name,
+                                           functools.partial(sheet_rows, channel_id=channel_id))
+    with _recent_members_lock:
+        _recent_members[(channel_id, user_id)] = (username, first_name, last_name)
+    if not new_member:
+        # Уже участник канала: без строк в таблицах и без уведомлений
+        logger.info("Повторная заявка: user_id=%s уже в канале %s", user_id, channel_id)
+        return None
+    outbox_worker.notify_enqueued(len(CHANNELS[channel_id]["sheets"]))
+    return channel_id, row
 
 
-def add_user(user_id, username, first_name, last_name):
-    add_user_to_db(user_id, username, first_name, last_name)
-    user = get_user_by_id(user_id)
-    if user:
-        uid, uname, fname, lname, priv = user
-        # Записываем в Google Sheets
-        add_user_to_sheets(uid, uname, fname, lname, priv)
-        # Отправляем уведомление сотрудникам и директору
-        notify_staff_about_new_user(uid, uname, fname, lname)
+def _notify_stage(item):
+    channel_id, user = item
+    if DIGEST_ENABLED:
+        digest.add(channel_id, user)
+    else:
+        _notify_single(channel_id, user)
+
+
+def _channel_key(item):
+    return item[0]
+
+
+# Всё, что не нужно для одобрения заявки, выполняется в фоне:
+# запись в БД (вместе с очередью Google Sheets) -> уведомления сотрудникам.
+# У каждого канала своя подочередь в каждой стадии, каналы обслуживаются по кругу,
+# поэтому поток заявок в один канал не задерживает остальные
+ingestion = IngestionPipeline("ingestion")
+ingestion.add_stage("db", _store_user_stage, workers=PIPELINE_DB_WORKERS, queue_size=PIPELINE_QUEUE_SIZE,
+                    retries=PIPELINE_RETRIES, retry_delay=PIPELINE_RETRY_DELAY, next_stages=("notify",),
+                    key=_channel_key)
+ingestion.add_stage("notify", _notify_stage, workers=PIPELINE_NOTIFY_WORKERS, queue_size=PIPELINE_QUEUE_SIZE,
+                    retries=PIPELINE_RETRIES, retry_delay=PIPELINE_RETRY_DELAY, key=_channel_key)
+# Потоки обработчиков общие для всех каналов: переполненный канал не должен их занимать,
+# поэтому заявка, не принятая за PIPELINE_SUBMIT_TIMEOUT, дописывается в конвейер потоком своего канала
+ingestion_backlog = Backlog(ingestion, _channel_key, timeout=PIPELINE_SUBMIT_TIMEOUT, maxsize=PIPELINE_BACKLOG_SIZE)
+
+
+def queue_depths():
+    """Глубина очередей: стадии конвейера, очередь Google Sheets в БД, неотправленные уведомления."""
+    depths = {f"ingestion_{name}": size for name, size in ingestion.queue_sizes().items()}
+    depths["ingestion_backlog"] = sum(ingestion_backlog.sizes().values())
+    depths["sheets_outbox"] = count_outbox()
+    depths["notifications"] = dispatcher.pending()
+    return depths
+
+
+metrics.gauge("bot_queue_depth", "Глубина очередей бота", ("queue",),
+              lambda: {(name,): size for name, size in queue_depths().items()})
+metrics.gauge("bot_channel_queue_depth", "Заявки в очередях конвейера по каналам", ("stage", "channel"),
+              lambda: {(name, str(channel)): size for name, stage in ingestion.stages.items()
+                       for channel, size in stage.queue.sizes().items()})
+metrics.gauge("bot_notifications_total", "Результаты рассылки уведомлений сотрудникам", ("result",),
+              lambda: {(result,): count for result, count in dispatcher.stats().items()}, kind="counter")
+
+
+def start_background():
+    """Запуск фоновых частей бота; общий для синхронного и asyncio-режима."""
+    metrics.instrument_telegram()
+    metrics.start_server()
+    load_privilege_cache()
+    outbox_worker.start()
+    digest.start()
+    ingestion.start()
+
+
+def stop_background():
+    # Дообрабатываем принятые заявки, затем отправляем в Google Sheets всё, что накопилось в очереди
+    ingestion_backlog.stop()
+    ingestion.stop()
+    digest.stop()
+    export_executor.shutdown(wait=True)
+    outbox_worker.stop()
+    dispatcher.shutdown()
+    db_pool.close()
+    metrics.stop_server()
+    logger.info("Статистика уведомлений: %s", dispatcher.stats())
+
 
+def is_known_channel(chat_id):
+    return chat_id in CHANNELS
 
-def send_users_page(chat_id, page=1, per_page=10, message_id=None):
-    logger.info(f"Загрузка страницы пользователей: page={page}, per_page={per_page}")
+
+def add_user(channel_id, user_id, username, first_name, last_name):
+    with _recent_members_lock:
+        known = _recent_members.get((channel_id, user_id))
+    if known == (username, first_name, last_name):
+        logger.info("Повторная заявка без изменений пропущена: user_id=%s, канал %s", user_id, channel_id)
+        return
+    # Ставим пользователя в очередь канала: БД, Google Sheets и уведомления обработаются в фоне
+    if not ingestion_backlog.submit((channel_id, user_id, username, first_name, last_name)):
+        logger.error("Заявка user_id=%s в канал %s одобрена, но не сохранена: очередь канала переполнена",
+                     user_id, channel_id)
+
+
+# Готовые страницы списка по (страница, размер, курсор, версия данных). Любая вставка или смена
+# привилегий меняет версию, и старые страницы просто перестают запрашиваться и вытесняются по LRU
+_users_page_cache = LRUCache(maxsize=USERS_PAGE_CACHE_SIZE)
+_users_page_cache_lock = threading.Lock()
+
+
+def render_users_page(page=1, per_page=10, after_id=None, before_id=None, from_id=None):
+    """Формирует текст и клавиатуру страницы списка пользователей. Для пустой страницы клавиатура - None."""
+    # Версия читается до запроса в БД: страница, собранная во время записи, останется под старой версией
+    key = (page, per_page, after_id, before_id, from_id, get_data_version())
+    with _users_page_cache_lock:
+        cached = _users_page_cache.get(key)
+    if cached is not None:
+        logger.debug("Страница %s взята из кэша", page, extra={"event": "page_render"})
+        return cached
+    result = _build_users_page(page, per_page, after_id, before_id, from_id)
+    with _users_page_cache_lock:
+        _users_page_cache[key] = result
+    return result
+
+
+def _build_users_page(page, per_page, after_id, before_id, from_id):
+    logger.info("Загрузка страницы пользователей: page=%s, per_page=%s", page, per_page, extra={"event": "page_render"})
     total_users = get_users_count()
-    users = get_users_page(page, per_page)
+    users = get_users_page(page, per_page, after_id=after_id, before_id=before_id, from_id=from_id)
 
     if not users:
-        logger.warning(f"Пользователи не найдены на странице: page={page}")
-        if message_id is not None:
-            bot.edit_message_text(f"Нет пользователей на странице {page}.", chat_id, message_id)
-        else:
-            bot.send_message(chat_id, f"Нет пользователей на странице {page}.")
-        return
+        logger.warning("Пользователи не найдены на странице: page=%s", page)
+        return f"Нет пользователей на странице {page}.", None
 
     text = f"📄 <b>Список пользователей</b> (Страница {page} из {math.ceil(total_users / per_page)}):\n\n"
-    logger.info(f"На странице {page} найдено {len(users)} пользователей из {total_users}")
+    logger.info("На странице %s найдено %s пользователей из %s", page, len(users), total_users, extra={"event": "page_render"})
     keyboard = types.InlineKeyboardMarkup()
+    # Граничные id страницы: по ним строятся кнопки листания и возврат из карточки
+    first_id, last_id = users[0][0], users[-1][0]
 
     for u in users:
         uid, uname, fname, lname, priv = u
         display_name = f"{fname or ''} {lname or ''}".strip()
         if not display_name:
             display_name = str(uid)
-        logger.debug(f"Добавление пользователя в список: user_id={uid}, display_name={display_name}")
+        logger.debug("Добавление пользователя в список: user_id=%s, display_name=%s", uid, display_name, extra={"event": "page_render"})
         keyboard.add(types.InlineKeyboardButton(
             text=f"{display_name}",
-            callback_data=f"user_details:{uid}:{page}"
+            callback_data=f"user_details:{uid}:{page}:{first_id}"
         ))
 
     buttons = []
     if page > 1:
-        buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"users_page:{page - 1}"))
+        buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"users_page:{page - 1}:p:{first_id}"))
     if page * per_page < total_users:
-        buttons.append(types.InlineKeyboardButton("Вперёд ➡️", callback_data=f"users_page:{page + 1}"))
+        buttons.append(types.InlineKeyboardButton("Вперёд ➡️", callback_data=f"users_page:{page + 1}:n:{last_id}"))
     if buttons:
         keyboard.add(*buttons)
+    return text, keyboard
 
-    if message_id is not None:
+
+def parse_users_page_data(data):
+    """Разбирает users_page:<страница>[:<n|p|a>:<граничный user_id>] -> (page, аргументы для get_users_page)."""
+    parts = data.split(':')
+    page = int(parts[1])
+    cursor_kwargs = {}
+    if len(parts) == 4 and parts[3]:
+        key = int(parts[3])
+        cursor_kwargs = {'n': {'after_id': key}, 'p': {'before_id': key}, 'a': {'from_id': key}}.get(parts[2], {})
+    return page, cursor_kwargs
+
+
+def start_search(query):
+    """Выполняет поиск и сохраняет найденные id в сессию. Возвращает токен сессии или None."""
+    user_ids = search_user_ids(query, limit=SEARCH_MAX_RESULTS)
+    if not user_ids:
+        return None
+    return search_sessions.create(query, user_ids)
+
+
+def _get_search_session(token):
+    if token.startswith(DIGEST_TOKEN_PREFIX):
         try:
-            bot.edit_message_text(text, chat_id, message_id, reply_markup=keyboard, parse_mode='HTML')
-        except telebot.apihelper.ApiTelegramException as e:
-            if "message is not modified" in str(e):
-                logger.warning(
-                    f"Попытка отредактировать сообщение без изменений: chat_id={chat_id}, message_id={message_id}")
-            else:
-                logger.error(f"Ошибка при редактировании сообщения: {e}")
-    else:
-        bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='HTML')
-        logger.info(f"Сообщение отправлено: page={page}")
+            return get_join_digest(int(token[len(DIGEST_TOKEN_PREFIX):]))
+        except ValueError:
+            return None
+    return search_sessions.get(token)
 
 
-def send_search_page(chat_id, query, page=1, per_page=10, message_id=None):
-    results = search_users(query)
-    total = len(results)
+def render_search_page(token, page=1, per_page=10):
+    """Формирует текст и клавиатуру страницы результатов поиска. Без результатов клавиатура - None."""
+    session = _get_search_session(token)
+    if session is None:
+        return "⌛ Результаты поиска устарели. Выполните /search_users заново.", None
+
+    query, user_ids = session
+    total = len(user_ids)
 
     if total == 0:
-        if message_id is not None:
-            bot.edit_message_text("❌ Ничего не найдено.", chat_id, message_id)
-        else:
-            bot.send_message(chat_id, "❌ Ничего не найдено.")
-        return
+        return "❌ Ничего не найдено.", None
 
     start_idx = (page - 1) * per_page
     end_idx = start_idx + per_page
-    page_results = results[start_idx:end_idx]
+    # Из БД берём только строки текущей страницы
+    page_results = get_users_by_ids(user_ids[start_idx:end_idx])
 
     text = f"🔍 <b>Результаты поиска</b> по запросу: <i>{query}</i>\nСтраница {page} из {math.ceil(total / per_page)} (Показано {len(page_results)} из {total})\n\n"
     keyboard = types.InlineKeyboardMarkup()
-    enc_query = query.replace(' ', '%20')
 
     for u in page_results:
         uid, uname, fname, lname, priv = u
@@ -130,28 +374,216 @@ def send_search_page(chat_id, query, page=1, per_page=10, message_id=None):
         keyboard.add(
             types.InlineKeyboardButton(
                 text=display_name,
-                callback_data=f"search_user_details:{uid}:{page}:{enc_query}"
+                callback_data=f"search_user_details:{uid}:{token}:{page}"
             )
         )
 
     buttons = []
     if page > 1:
-        buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"search_page:{page - 1}:{enc_query}"))
+        buttons.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=f"search_page:{token}:{page - 1}"))
     if end_idx < total:
-        buttons.append(types.InlineKeyboardButton("Вперёд ➡️", callback_data=f"search_page:{page + 1}:{enc_query}"))
+        buttons.append(types.InlineKeyboardButton("Вперёд ➡️", callback_data=f"search_page:{token}:{page + 1}"))
 
     if buttons:
         keyboard.add(*buttons)
+    return text, keyboard
+
+
+def _render_card_body(user):
+    uid, uname, fname, lname, priv = user
+    pmark = "✅" if priv == 1 else "❌"
+    text = (f"<b>Профиль пользователя</b>\n\n"
+            f"ID: {uid}\n"
+            f"Имя: {fname or 'не указано'} {lname or 'не указано'}\n"
+            f"Username: @{uname if uname else 'нет'}\n"
+            f"Привилегии: {pmark}\n\n"
+            "Вы можете написать этому пользователю, нажав на кнопку ниже.")
+    url = f"https://t.me/{uname}" if uname else f"tg://user?id={uid}"
+    return text, types.InlineKeyboardButton("✉️ Написать пользователю", url=url)
+
+
+def _card_keyboard(write_button, back_data):
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.add(write_button)
+    keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data=back_data))
+    return keyboard
+
+
+# Готовые карточки по (user_id, версия строки): смена имени или привилегий меняет версию
+_user_card_cache = LRUCache(maxsize=USER_CARD_CACHE_SIZE)
+_user_card_cache_lock = threading.Lock()
+
+
+def user_card(user_id, back_data):
+    """
+    Карточка пользователя по id: (text, keyboard) или None, если пользователя нет.
+    Повторные открытия берутся из кэша без запроса в БД; кнопка «Назад» добавляется к готовой карточке.
+    """
+    key = (user_id, get_user_version(user_id))
+    with _user_card_cache_lock:
+        cached = _user_card_cache.get(key)
+    if cached is None:
+        user = get_user_by_id(user_id)
+        if not user:
+            return None
+        cached = _render_card_body(user)
+        with _user_card_cache_lock:
+            _user_card_cache[key] = cached
+    text, write_button = cached
+    return text, _card_keyboard(write_button, back_data)
+
+
+def parse_user_details_data(data):
+    """
+    Разбирает callback карточки -> (user_id, back_data):
+    user_details:<id>:<страница>[:<первый id страницы>] или search_user_details:<id>:<токен>:<страница>.
+    При неверном формате - ValueError.
+    """
+    if data.startswith('search_user_details:'):
+        _, uid_str, token, page_str = data.split(':')
+        int(page_str)
+        return int(uid_str), f"search_page:{token}:{page_str}"
+    _, uid_str, page_str, *rest = data.split(':')
+    page = int(page_str)
+    back_data = f"users_page:{page}:a:{rest[0]}" if rest and rest[0] else f"users_page:{page}"
+    return int(uid_str), back_data
+
+
+def render_staff_list(staff):
+    text = "📋 <b>Сотрудники:</b>\n\n"
+    for u in staff:
+        uid, uname, fname, lname = u
+        # Форматирование: ID, @username, Имя Фамилия
+        user_info = f"ID: {uid}"
+        if uname:
+            user_info += f", @{uname}"
+        if fname or lname:
+            user_info += f", {fname or ''} {lname or ''}".strip()
+        text += f"{user_info}\n"
+    return text
+
+
+def render_stats():
+    """Сводка метрик для команды /stats."""
+    data = metrics.summary()
+    text = "📊 <b>Статистика</b>\n"
+    for title, key in (("Обработчики", "handlers"), ("Внешние вызовы", "calls")):
+        text += f"\n<b>{title}</b> (вызовов, среднее / p50 / p99 мс, ошибок):\n"
+        rows = data[key]
+        if not rows:
+            text += "нет данных\n"
+        for name, count, avg, p50, p99, errors in rows:
+            text += f"{name}: {count}, {avg * 1000:.1f} / {p50 * 1000:.1f} / {p99 * 1000:.1f}, {errors}\n"
+    text += "\n<b>Очереди:</b>\n"
+    for name, size in queue_depths().items():
+        text += f"{name}: {size}\n"
+    stats = dispatcher.stats()
+    text += (f"\n<b>Уведомления:</b> доставлено {stats['delivered']}, "
+             f"повторов {stats['retried']}, потеряно {stats['dropped']}\n")
+    return text
+
 
-    # Добавляем HTML-разметку
+# Выгрузки идут в отдельном потоке: обработчик сразу отвечает, а пул обработчиков не занят на время чтения таблицы
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+EXPORT_TOO_LARGE_TEXT = ("❌ Файл выгрузки больше 50 МБ, Telegram не примет его от бота. "
+                         "Сузьте выборку: /export_users staff или /export_users ГГГГ-ММ-ДД.")
+
+
+def export_caption(options, count):
+    return f"📄 Пользователей: {count} ({options.describe()})"
+
+
+def run_user_export(chat_id, options):
+    """Выгружает пользователей и отправляет файл в чат; временный файл удаляется в любом случае."""
+    try:
+        path, filename, count = export_users(options)
+    except Exception as e:
+        logger.error("Ошибка выгрузки пользователей для chat_id=%s: %s", chat_id, e)
+        bot.send_message(chat_id, f"❌ Не удалось выгрузить пользователей: {html.escape(str(e))}")
+        return
+    try:
+        if os.path.getsize(path) > EXPORT_MAX_FILE_SIZE:
+            bot.send_message(chat_id, EXPORT_TOO_LARGE_TEXT)
+            return
+        with open(path, 'rb') as f:
+            bot.send_document(chat_id, f, visible_file_name=filename, caption=export_caption(options, count))
+    except Exception as e:
+        logger.error("Ошибка при отправке выгрузки в chat_id=%s: %s", chat_id, e)
+    finally:
+        os.remove(path)
+
+
+def submit_user_export(chat_id, options):
+    export_executor.submit(run_user_export, chat_id, options)
+
+
+class ReconcileProgress:
+    """Ход сверки в сообщении со статусом: edit(text) вызывается не чаще раза в interval секунд."""
+
+    def __init__(self, edit, interval=RECONCILE_PROGRESS_INTERVAL):
+        self.edit = edit
+        self.interval = interval
+        self._last = time.monotonic()
+
+    def __call__(self, text):
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        try:
+            self.edit(f"🔄 Сверка таблиц...\n{html.escape(text)}")
+        except Exception as e:
+            logger.warning("Не удалось обновить ход сверки: %s", e)
+
+
+def render_reconcile_report(reports, dry_run):
+    text = "📋 <b>Сверка таблиц</b>" + (" (без изменений)" if dry_run else "") + "\n"
+    for r in reports:
+        text += (f"\n<code>{html.escape(r.spreadsheet_id)}</code>: в таблице {r.sheet_rows}, в БД {r.db_rows}\n"
+                 f"не хватало {r.missing}, дописано {r.appended}; устарело {r.changed}, исправлено {r.updated}; "
+                 f"лишних {r.extra}, дублей {r.duplicates}\n")
+    return text
+
+
+def run_reconcile(chat_id, message_id, dry_run):
+    progress = ReconcileProgress(lambda text: bot.edit_message_text(text, chat_id, message_id))
+    try:
+        reports = reconcile(dry_run=dry_run, progress=progress)
+    except Exception as e:
+        logger.error("Ошибка сверки таблиц: %s", e)
+        bot.send_message(chat_id, f"❌ Сверка не выполнена: {html.escape(str(e))}")
+        return
+    bot.send_message(chat_id, render_reconcile_report(reports, dry_run))
+
+
+def submit_reconcile(chat_id, message_id, dry_run):
+    # Сверка идёт минутами; повторный запуск во время работы reconcile() отклоняет сам
+    threading.Thread(target=run_reconcile, args=(chat_id, message_id, dry_run), name="reconcile", daemon=True).start()
+
+
+def _show(chat_id, text, keyboard, message_id=None):
+    # Новое сообщение или редактирование существующего (при листании)
     if message_id is not None:
         try:
             bot.edit_message_text(text, chat_id, message_id, reply_markup=keyboard, parse_mode='HTML')
         except telebot.apihelper.ApiTelegramException as e:
             if "message is not modified" in str(e):
                 logger.warning(
-                    f"Попытка отредактировать сообщение без изменений: chat_id={chat_id}, message_id={message_id}")
+                    "Попытка отредактировать сообщение без изменений: chat_id=%s, message_id=%s", chat_id, message_id)
             else:
-                logger.error(f"Ошибка при редактировании сообщения: {e}")
+                logger.error("Ошибка при редактировании сообщения: %s", e)
     else:
         bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode='HTML')
+
+
+@timed_handler
+def send_users_page(chat_id, page=1, per_page=10, message_id=None, after_id=None, before_id=None, from_id=None):
+    text, keyboard = render_users_page(page, per_page, after_id=after_id, before_id=before_id, from_id=from_id)
+    _show(chat_id, text, keyboard, message_id)
+
+
+@timed_handler
+def send_search_page(chat_id, token, page=1, per_page=10, message_id=None):
+    text, keyboard = render_search_page(token, page, per_page)
+    _show(chat_id, text, keyboard, message_id)
@@ -0,0 +1,97 @@
+# log_setup.py
+# Настройка логирования: запись логов вынесена в отдельный поток (QueueHandler/QueueListener),
+# чтобы обработчики бота не ждали форматирования и вывода в поток.
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поле event, если оно задано."""
+
+    def format(self, record):
+        data = {
+            "ts": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            data["event"] = event
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только долю записей частых событий: rates - {event: доля от 0 до 1}.
+    Записи без поля event и события, которых нет в rates, проходят всегда.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, 'event', None))
+        if rate is None:
+            return True
+        return random.random() < rate
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который кладёт запись в очередь как есть: стандартный prepare()
+    форматирует сообщение в вызывающем потоке, а здесь это делает поток QueueListener.
+    Аргументы сообщения должны быть неизменяемыми к моменту записи (id, строки, числа).
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, sampling=LOG_SAMPLING):
+    """Настраивает корневой логгер. Повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = _DeferredQueueHandler(queue.SimpleQueue())
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+
+    _listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает накопленные записи и останавливает поток логирования."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
@@ -1,16 +1,24 @@
 # main.py
 import logging
-from config import LOG_LEVEL
-from handlers import bot, add_user, send_users_page, send_search_page, insufficient_rights
-from db import user_has_privileges, is_director, set_privilege, list_staff, search_users, get_user_by_id
-from telebot import types
+from config import (RUNTIME, RUN_MODE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL,
+                    WEBHOOK_SECRET_TOKEN, WEBHOOK_WORKERS)
+from handlers import (bot, start_background, stop_background, add_user, is_known_channel, send_users_page,
+                      send_search_page, start_search, insufficient_rights, render_staff_list, render_stats,
+                      parse_users_page_data, parse_user_details_data, user_card, submit_user_export,
+                      submit_reconcile,
+                      START_TEXT, HELP_TEXT)
+from db import user_has_privileges, is_director, set_privilege, list_staff
+from export import parse_export_args
+from log_setup import setup_logging
+from metrics import timed_handler
+from state_store import create_state_store
 
 # Настройка логирования
-logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Словарь для хранения состояний пользователей
-user_states = {}
+# Состояния диалога пользователей (хранилище и TTL задаются в config.py)
+user_states = create_state_store()
 
 # Возможные состояния
 STATE_NONE = None
@@ -20,55 +28,46 @@ STATE_REVOKE = 'revoke'
 
 
 @bot.chat_join_request_handler()
+@timed_handler
 def handle_chat_join_request(chat_join_request):
+    channel_id = chat_join_request.chat.id
     logger.info(
-        f"Обработка запроса на вступление: user_id={chat_join_request.from_user.id}, username={chat_join_request.from_user.username}")
-    bot.approve_chat_join_request(chat_join_request.chat.id, chat_join_request.from_user.id)
+        "Обработка запроса на вступление: channel_id=%s, user_id=%s, username=%s", channel_id, chat_join_request.from_user.id, chat_join_request.from_user.username)
+    if not is_known_channel(channel_id):
+        logger.warning("Заявка в канал, которого нет в CHANNELS, пропущена: channel_id=%s", channel_id)
+        return
+    bot.approve_chat_join_request(channel_id, chat_join_request.from_user.id)
     user = chat_join_request.from_user
-    add_user(user.id, user.username, user.first_name, user.last_name)
+    add_user(channel_id, user.id, user.username, user.first_name, user.last_name)
     logger.info(
-        f"Пользователь добавлен: user_id={user.id}, username={user.username}, first_name={user.first_name}, last_name={user.last_name}")
+        "Пользователь поставлен в очередь на добавление: user_id=%s, username=%s, first_name=%s, last_name=%s", user.id, user.username, user.first_name, user.last_name)
 
 
 @bot.message_handler(commands=['start'])
+@timed_handler
 def start_cmd(message):
     logger.info(
-        f"Команда /start от пользователя: user_id={message.from_user.id}, username={message.from_user.username}")
+        "Команда /start от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
     # Сброс состояния пользователя
     user_states.pop(message.from_user.id, None)
-    text = ("Привет! 👋\n\n"
-            "Это служебный бот, который помогает администрировать закрытый канал. Я автоматически принимаю заявки на вступление от пользователей, сохраняю их данные в базу,"
-            "добавляю запись в гугл таблицы, а также отправляю уведомление всем сотрудникам о новом пользователе и позволяю просматривать список участников. "
-            "Кроме того, для уполномоченных лиц доступно управление правами пользователей.\n\n"
-            "Чтобы узнать о моих возможностях, используй команду /help.")
-    bot.reply_to(message, text)
+    bot.reply_to(message, START_TEXT)
 
 
 @bot.message_handler(commands=['help'])
+@timed_handler
 def help_cmd(message):
-    logger.info(f"Команда /help от пользователя: user_id={message.from_user.id}, username={message.from_user.username}")
-    text = (
-        "<b>Доступные команды:</b>\n\n"
-        "/start - Старт / Рестарт\n"
-        "/help - Список команд и функционала.\n\n"
-        "<b>Для директора и сотрудников:</b>\n"
-        "/list_users [номер страницы] - Просмотреть список пользователей по страницам (по 10 записей на странице).\n"
-        "/search_users - Поиск пользователя по username, имени, фамилии или ID.\n"
-        "/list_staff - Показать список сотрудников (пользователей с правами).\n\n"
-        "<b>Только для директора:</b>\n"
-        "/grant - Выдать права пользователю.\n"
-        "/revoke - Забрать права у пользователя.\n"
-    )
-    bot.reply_to(message, text, parse_mode='HTML')
+    logger.info("Команда /help от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+    bot.reply_to(message, HELP_TEXT, parse_mode='HTML')
 
 
 @bot.message_handler(commands=['list_users'])
+@timed_handler
 def list_users_cmd(message):
     logger.info(
-        f"Команда /list_users от пользователя: user_id={message.from_user.id}, username={message.from_user.username}")
-    if not user_has_privileges(message.from_user.username):
+        "Команда /list_users от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+    if not user_has_privileges(message.from_user.username, message.from_user.id):
         logger.warning(
-            f"У пользователя недостаточно прав: user_id={message.from_user.id}, username={message.from_user.username}")
+            "У пользователя недостаточно прав: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
         insufficient_rights(message)
         return
 
@@ -76,18 +75,19 @@ def list_users_cmd(message):
     page = 1
     if len(parts) > 1 and parts[1].isdigit():
         page = int(parts[1])
-        logger.info(f"Пользователь запросил страницу: {page}")
+        logger.info("Пользователь запросил страницу: %s", page)
 
     send_users_page(message.chat.id, page=page)
 
 
 @bot.message_handler(commands=['list_staff'])
+@timed_handler
 def list_staff_cmd(message):
     logger.info(
-        f"Команда /list_staff от пользователя: user_id={message.from_user.id}, username={message.from_user.username}")
-    if not user_has_privileges(message.from_user.username):
+        "Команда /list_staff от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+    if not user_has_privileges(message.from_user.username, message.from_user.id):
         logger.warning(
-            f"У пользователя недостаточно прав: user_id={message.from_user.id}, username={message.from_user.username}")
+            "У пользователя недостаточно прав: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
         insufficient_rights(message)
         return
 
@@ -97,105 +97,78 @@ def list_staff_cmd(message):
         bot.reply_to(message, "Нет сотрудников.")
         return
 
-    logger.info(f"Список сотрудников запрошен. Найдено: {len(staff)} сотрудников.")
-    text = "📋 <b>Сотрудники:</b>\n\n"
-    for u in staff:
-        uid, uname, fname, lname = u
-        logger.debug(f"Сотрудник: ID={uid}, username={uname}, first_name={fname}, last_name={lname}")
-        # Форматирование: ID, @username, Имя Фамилия
-        user_info = f"ID: {uid}"
-        if uname:
-            user_info += f", @{uname}"
-        if fname or lname:
-            user_info += f", {fname or ''} {lname or ''}".strip()
-        text += f"{user_info}\n"
-
+    logger.info("Список сотрудников запрошен. Найдено: %s сотрудников.", len(staff))
+    text = render_staff_list(staff)
     bot.reply_to(message, text, parse_mode='HTML')
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('users_page:'))
+@timed_handler
 def callback_users_page(call):
     logger.info(
-        f"Обратный вызов 'users_page': user_id={call.from_user.id}, username={call.from_user.username}, data={call.data}")
-    if not user_has_privileges(call.from_user.username):
+        "Обратный вызов 'users_page': user_id=%s, username=%s, data=%s", call.from_user.id, call.from_user.username, call.data)
+    if not user_has_privileges(call.from_user.username, call.from_user.id):
         logger.warning(
-            f"Недостаточно прав у пользователя: user_id={call.from_user.id}, username={call.from_user.username}")
+            "Недостаточно прав у пользователя: user_id=%s, username=%s", call.from_user.id, call.from_user.username)
         bot.answer_callback_query(call.id, "У вас недостаточно прав!")
         return
-    page = int(call.data.split(':')[1])
-    logger.info(f"Пользователь переключился на страницу: {page}")
+    page, cursor_kwargs = parse_users_page_data(call.data)
+    logger.info("Пользователь переключился на страницу: %s", page)
 
-    send_users_page(call.message.chat.id, page=page, message_id=call.message.message_id)
+    send_users_page(call.message.chat.id, page=page, message_id=call.message.message_id, **cursor_kwargs)
     bot.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('user_details:'))
+@bot.callback_query_handler(func=lambda call: call.data.startswith(('user_details:', 'search_user_details:')))
+@timed_handler
 def callback_user_details(call):
     logger.info(
-        f"Обратный вызов 'user_details': user_id={call.from_user.id}, username={call.from_user.username}, data={call.data}")
-    if not user_has_privileges(call.from_user.username):
+        "Обратный вызов карточки пользователя: user_id=%s, username=%s, data=%s", call.from_user.id, call.from_user.username, call.data)
+    if not user_has_privileges(call.from_user.username, call.from_user.id):
         logger.warning(
-            f"Недостаточно прав у пользователя: user_id={call.from_user.id}, username={call.from_user.username}")
-        bot.answer_callback_query(call.id, "У вас недостаточно прав!")
+            "Недостаточно прав у пользователя: user_id=%s, username=%s", call.from_user.id, call.from_user.username)
+        bot.answer_callback_query(call.id, "❌ У вас недостаточно прав!")
         return
 
-    _, user_id_str, page_str = call.data.split(':')
-    user_id = int(user_id_str)
-    page = int(page_str)
-    logger.info(f"Получение деталей пользователя: user_id={user_id}, страница возврата={page}")
-
-    user = get_user_by_id(user_id)
-    if not user:
-        logger.warning(f"Пользователь с ID {user_id} не найден в БД.")
-        bot.answer_callback_query(call.id, "Пользователь не найден.")
+    try:
+        user_id, back_data = parse_user_details_data(call.data)
+    except ValueError as e:
+        logger.error("Некорректный формат callback_data: %s. Ошибка: %s", call.data, e)
+        bot.answer_callback_query(call.id, "❌ Некорректный запрос.")
         return
 
-    uid, uname, fname, lname, priv = user
-    pmark = "✅" if priv == 1 else "❌"
-    logger.info(
-        f"Детали пользователя получены: user_id={uid}, username={uname}, имя={fname}, фамилия={lname}, привилегии={pmark}")
-
-    text = (f"<b>Профиль пользователя</b>\n\n"
-            f"ID: {uid}\n"
-            f"Username: @{uname if uname else 'нет'}\n"
-            f"Имя: {fname or 'нет'}\n"
-            f"Фамилия: {lname or 'нет'}\n"
-            f"Привилегии: {pmark}\n\n"
-            "Вы можете написать этому пользователю, нажав на кнопку ниже.")
-
-    keyboard = types.InlineKeyboardMarkup()
-    if uname:
-        logger.debug("Формируем кнопку для отправки сообщения по username.")
-        keyboard.add(types.InlineKeyboardButton("✉️ Написать пользователю", url=f"https://t.me/{uname}"))
-    else:
-        logger.debug("Формируем кнопку для отправки сообщения по user_id.")
-        keyboard.add(types.InlineKeyboardButton("✉️ Написать пользователю", url=f"tg://user?id={uid}"))
-
-    keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data=f"users_page:{page}"))
+    logger.info("Получение карточки пользователя: user_id=%s, возврат=%s", user_id, back_data)
+    card = user_card(user_id, back_data)
+    if card is None:
+        logger.warning("Пользователь с ID %s не найден в БД.", user_id)
+        bot.answer_callback_query(call.id, "❌ Пользователь не найден.")
+        return
 
+    text, keyboard = card
     try:
         bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=keyboard,
                               parse_mode='HTML')
         logger.info("Сообщение с деталями пользователя успешно отредактировано.")
     except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения с деталями пользователя: {e}")
+        logger.error("Ошибка при редактировании сообщения с деталями пользователя: %s", e)
 
     bot.answer_callback_query(call.id)
 
 
 @bot.message_handler(commands=['search_users'])
+@timed_handler
 def search_users_cmd(message):
     logger.info(
-        f"Команда /search_users от пользователя: user_id={message.from_user.id}, username={message.from_user.username}")
-    if not user_has_privileges(message.from_user.username):
+        "Команда /search_users от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+    if not user_has_privileges(message.from_user.username, message.from_user.id):
         logger.warning(
-            f"Недостаточно прав у пользователя: user_id={message.from_user.id}, username={message.from_user.username}")
+            "Недостаточно прав у пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
         insufficient_rights(message)
         return
 
     # Устанавливаем состояние пользователя
-    user_states[message.from_user.id] = STATE_SEARCH_USERS
-    logger.debug(f"Устанавливаем состояние STATE_SEARCH_USERS для user_id={message.from_user.id}")
+    user_states.set(message.from_user.id, STATE_SEARCH_USERS)
+    logger.debug("Устанавливаем состояние STATE_SEARCH_USERS для user_id=%s", message.from_user.id)
     bot.reply_to(
         message,
         "🔍 Поиск пользователя...\nВведите `username`, `first_name`, `last_name` или `ID` пользователя:",
@@ -204,18 +177,19 @@ def search_users_cmd(message):
 
 
 @bot.message_handler(commands=['grant'])
+@timed_handler
 def grant_cmd(message):
     logger.info(
-        f"Команда /grant от пользователя: user_id={message.from_user.id}, username={message.from_user.username}")
+        "Команда /grant от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
     if not is_director(message.from_user.username):
         logger.warning(
-            f"Недостаточно прав для выполнения команды /grant: user_id={message.from_user.id}, username={message.from_user.username}")
+            "Недостаточно прав для выполнения команды /grant: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
         insufficient_rights(message)
         return
 
     # Устанавливаем состояние пользователя
-    user_states[message.from_user.id] = STATE_GRANT
-    logger.debug(f"Устанавливаем состояние STATE_GRANT для user_id={message.from_user.id}")
+    user_states.set(message.from_user.id, STATE_GRANT)
+    logger.debug("Устанавливаем состояние STATE_GRANT для user_id=%s", message.from_user.id)
     bot.reply_to(
         message,
         "🛠 Назначение сотрудника...\nУкажите `@username` пользователя:",
@@ -224,18 +198,19 @@ def grant_cmd(message):
 
 
 @bot.message_handler(commands=['revoke'])
+@timed_handler
 def revoke_cmd(message):
     logger.info(
-        f"Команда /revoke от пользователя: user_id={message.from_user.id}, username={message.from_user.username}")
+        "Команда /revoke от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
     if not is_director(message.from_user.username):
         logger.warning(
-            f"Недостаточно прав для выполнения команды /revoke: user_id={message.from_user.id}, username={message.from_user.username}")
+            "Недостаточно прав для выполнения команды /revoke: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
         insufficient_rights(message)
         return
 
     # Устанавливаем состояние пользователя
-    user_states[message.from_user.id] = STATE_REVOKE
-    logger.debug(f"Устанавливаем состояние STATE_REVOKE для user_id={message.from_user.id}")
+    user_states.set(message.from_user.id, STATE_REVOKE)
+    logger.debug("Устанавливаем состояние STATE_REVOKE для user_id=%s", message.from_user.id)
     bot.reply_to(
         message,
         "🗑 Удаление сотрудника...\nУкажите `@username` пользователя:",
@@ -243,17 +218,70 @@ def revoke_cmd(message):
     )
 
 
+@bot.message_handler(commands=['stats'])
+@timed_handler
+def stats_cmd(message):
+    logger.info(
+        "Команда /stats от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+    if not is_director(message.from_user.username):
+        logger.warning(
+            "Недостаточно прав для выполнения команды /stats: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+        insufficient_rights(message)
+        return
+
+    bot.reply_to(message, render_stats(), parse_mode='HTML')
+
+
+@bot.message_handler(commands=['export_users'])
+@timed_handler
+def export_users_cmd(message):
+    logger.info(
+        "Команда /export_users от пользователя: user_id=%s, username=%s, text=%s",
+        message.from_user.id, message.from_user.username, message.text)
+    if not user_has_privileges(message.from_user.username, message.from_user.id):
+        logger.warning(
+            "Недостаточно прав у пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+        insufficient_rights(message)
+        return
+
+    try:
+        options = parse_export_args(message.text)
+    except ValueError as e:
+        bot.reply_to(message, f"❌ {e}. Формат: /export_users [csv|xlsx] [staff] [ГГГГ-ММ-ДД]")
+        return
+
+    bot.reply_to(message, f"⏳ Готовлю выгрузку ({options.describe()}), файл придёт отдельным сообщением.")
+    submit_user_export(message.chat.id, options)
+
+
+@bot.message_handler(commands=['reconcile'])
+@timed_handler
+def reconcile_cmd(message):
+    logger.info(
+        "Команда /reconcile от пользователя: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+    if not is_director(message.from_user.username):
+        logger.warning(
+            "Недостаточно прав для выполнения команды /reconcile: user_id=%s, username=%s", message.from_user.id, message.from_user.username)
+        insufficient_rights(message)
+        return
+
+    dry_run = 'dry' in message.text.split()[1:]
+    status = bot.reply_to(message, "🔄 Сверка таблиц...")
+    submit_reconcile(message.chat.id, status.message_id, dry_run)
+
+
 @bot.message_handler(func=lambda message: True)
+@timed_handler
 def handle_message(message):
     user_id = message.from_user.id
     state = user_states.get(user_id, STATE_NONE)
-    logger.debug(f"Получено сообщение от user_id={user_id} в состоянии {state}")
+    logger.debug("Получено сообщение от user_id=%s в состоянии %s", user_id, state)
 
     # Проверка на команду
     if message.text.startswith('/'):
         # Обработка команды
         command = message.text.split()[0]
-        logger.debug(f"Обнаружена команда '{command}' во время состояния {state}")
+        logger.debug("Обнаружена команда '%s' во время состояния %s", command, state)
         # Вызов соответствующего обработчика команды
         if command == '/start':
             start_cmd(message)
@@ -269,9 +297,15 @@ def handle_message(message):
             grant_cmd(message)
         elif command == '/revoke':
             revoke_cmd(message)
+        elif command == '/stats':
+            stats_cmd(message)
+        elif command == '/export_users':
+            export_users_cmd(message)
+        elif command == '/reconcile':
+            reconcile_cmd(message)
         else:
             logger.warning(
-                f"Неизвестная команда от пользователя: user_id={user_id}, username={message.from_user.username}, text={message.text}")
+                "Неизвестная команда от пользователя: user_id=%s, username=%s, text=%s", user_id, message.from_user.username, message.text)
             bot.reply_to(message,
                          "❌ Я не знаю такой команды. Попробуй /help, чтобы увидеть список доступных команд и функционал.")
         return  # Завершаем обработку, команда уже обработана
@@ -286,7 +320,7 @@ def handle_message(message):
     else:
         # Неизвестная команда или сообщение
         logger.warning(
-            f"Неизвестное сообщение от пользователя: user_id={user_id}, username={message.from_user.username}, text={message.text}")
+            "Неизвестное сообщение от пользователя: user_id=%s, username=%s, text=%s", user_id, message.from_user.username, message.text)
         bot.reply_to(message,
                      "❓ Я не знаю, что с этим делать. Попробуй /help.")
 
@@ -295,32 +329,32 @@ def handle_search_users(message):
     query = message.text.strip()
     user_id = message.from_user.id
     logger.info(
-        f"Поиск пользователей по запросу: '{query}' от user_id={user_id}, username={message.from_user.username}")
+        "Поиск пользователей по запросу: '%s' от user_id=%s, username=%s", query, user_id, message.from_user.username)
 
     # Сбрасываем состояние
     user_states.pop(user_id, None)
 
-    # Выполняем поиск
-    results = search_users(query)
-    if not results:
-        logger.info(f"По запросу '{query}' не найдено пользователей.")
+    # Выполняем поиск и сохраняем результаты в сессию
+    token = start_search(query)
+    if token is None:
+        logger.info("По запросу '%s' не найдено пользователей.", query)
         bot.reply_to(message, "❌ По вашему запросу ничего не найдено.")
         return
 
     # Отправляем результаты с пагинацией
-    send_search_page(message.chat.id, query, page=1)
-    logger.info(f"Отправлены результаты поиска по запросу '{query}' пользователю user_id={user_id}")
+    send_search_page(message.chat.id, token, page=1)
+    logger.info("Отправлены результаты поиска по запросу '%s' пользователю user_id=%s", query, user_id)
 
 
 def handle_grant(message):
     username = message.text.strip()
     user_id = message.from_user.id
     logger.info(
-        f"Назначение прав пользователю: '{username}' от user_id={user_id}, username={message.from_user.username}")
+        "Назначение прав пользователю: '%s' от user_id=%s, username=%s", username, user_id, message.from_user.username)
 
     # Валидация ввода
     if not username.startswith('@') or len(username) < 2:
-        logger.warning(f"Неверный формат username: '{username}'")
+        logger.warning("Неверный формат username: '%s'", username)
         bot.reply_to(
             message,
             "❌ Неверный формат username. Пожалуйста, укажите в формате `@username`.",
@@ -332,10 +366,10 @@ def handle_grant(message):
     # Убираем @ из username
     clean_username = username[1:]
     if set_privilege(clean_username, 1):
-        logger.info(f"Права успешно выданы пользователю: @{clean_username}")
+        logger.info("Права успешно выданы пользователю: @%s", clean_username)
         bot.reply_to(message, f"✅ Права выданы пользователю @{clean_username}.")
     else:
-        logger.warning(f"Не удалось выдать права пользователю: @{clean_username}")
+        logger.warning("Не удалось выдать права пользователю: @%s", clean_username)
         bot.reply_to(
             message,
             f"❌ Не удалось выдать права пользователю @{clean_username}. Убедитесь, что пользователь является "
@@ -351,11 +385,11 @@ def handle_grant(message):
 def handle_revoke(message):
     username = message.text.strip()
     user_id = message.from_user.id
-    logger.info(f"Отзыв прав у пользователя: '{username}' от user_id={user_id}, username={message.from_user.username}")
+    logger.info("Отзыв прав у пользователя: '%s' от user_id=%s, username=%s", username, user_id, message.from_user.username)
 
     # Валидация ввода
     if not username.startswith('@') or len(username) < 2:
-        logger.warning(f"Неверный формат username: '{username}'")
+        logger.warning("Неверный формат username: '%s'", username)
         bot.reply_to(
             message,
             "❌ Неверный формат username. Пожалуйста, укажите в формате `@username`.",
@@ -367,10 +401,10 @@ def handle_revoke(message):
     # Убираем @ из username
     clean_username = username[1:]
     if set_privilege(clean_username, 0):
-        logger.info(f"Права успешно отозваны у пользователя: @{clean_username}")
+        logger.info("Права успешно отозваны у пользователя: @%s", clean_username)
         bot.reply_to(message, f"✅ Права отозваны у пользователя @{clean_username}.")
     else:
-        logger.warning(f"Не удалось отозвать права у пользователя: @{clean_username}")
+        logger.warning("Не удалось отозвать права у пользователя: @%s", clean_username)
         bot.reply_to(
             message,
             f"❌ Не удалось отозвать права у пользователя @{clean_username}. Возможно, пользователь не найден."
@@ -382,152 +416,66 @@ def handle_revoke(message):
     user_states.pop(user_id, None)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('search_user_details:'))
-def callback_search_user_details(call):
+@bot.callback_query_handler(func=lambda call: call.data.startswith('search_page:'))
+@timed_handler
+def callback_search_page(call):
     logger.info(
-        f"Обратный вызов 'search_user_details': user_id={call.from_user.id}, username={call.from_user.username}, data={call.data}")
-    if not user_has_privileges(call.from_user.username):
+        "Обратный вызов 'search_page': user_id=%s, username=%s, data=%s", call.from_user.id, call.from_user.username, call.data)
+    if not user_has_privileges(call.from_user.username, call.from_user.id):
         logger.warning(
-            f"Недостаточно прав у пользователя: user_id={call.from_user.id}, username={call.from_user.username}")
+            "Недостаточно прав у пользователя: user_id=%s, username=%s", call.from_user.id, call.from_user.username)
         bot.answer_callback_query(call.id, "❌ У вас недостаточно прав!")
         return
-
     try:
-        _, uid_str, page_str, enc_query = call.data.split(':', 3)
-        user_id = int(uid_str)
+        _, token, page_str = call.data.split(':')
         page = int(page_str)
-        query = enc_query.replace('%20', ' ')
     except ValueError as e:
-        logger.error(f"Некорректный формат callback_data: {call.data}. Ошибка: {e}")
+        logger.error("Некорректный формат callback_data: %s. Ошибка: %s", call.data, e)
         bot.answer_callback_query(call.id, "❌ Некорректный запрос.")
         return
+    logger.info("Пользователь переключился на страницу поиска: page=%s, сессия=%s", page, token)
 
-    logger.info(f"Получение деталей пользователя: user_id={user_id}, страница возврата={page}, запрос='{query}'")
-
-    user = get_user_by_id(user_id)
-    if not user:
-        logger.warning(f"Пользователь с ID {user_id} не найден в БД.")
-        bot.answer_callback_query(call.id, "❌ Пользователь не найден.")
-        return
-
-    uid, uname, fname, lname, priv = user
-    pmark = "✅" if priv == 1 else "❌"
-    logger.info(
-        f"Детали пользователя получены: user_id={uid}, username={uname}, имя={fname}, фамилия={lname}, привилегии={pmark}")
-
-    text = (f"<b>Профиль пользователя</b>\n\n"
-            f"ID: {uid}\n"
-            f"Имя: {fname or 'не указано'} {lname or 'не указано'}\n"
-            f"Username: @{uname if uname else 'нет'}\n"
-            f"Привилегии: {pmark}\n\n"
-            "Вы можете написать этому пользователю, нажав на кнопку ниже.")
-
-    keyboard = types.InlineKeyboardMarkup()
-    if uname:
-        logger.debug("Формируем кнопку для отправки сообщения по username.")
-        keyboard.add(types.InlineKeyboardButton("✉️ Написать пользователю", url=f"https://t.me/{uname}"))
-    else:
-        logger.debug("Формируем кнопку для отправки сообщения по user_id.")
-        keyboard.add(types.InlineKeyboardButton("✉️ Написать пользователю", url=f"tg://user?id={uid}"))
-
-    keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data=f"search_page:{page}:{enc_query}"))
-
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=keyboard,
-                              parse_mode='HTML')
-        logger.info("Сообщение с деталями пользователя успешно отредактировано.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения с деталями пользователя: {e}")
-
+    send_search_page(call.message.chat.id, token, page=page, message_id=call.message.message_id)
     bot.answer_callback_query(call.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('user_details:'))
-def callback_user_details(call):
-    logger.info(
-        f"Обратный вызов 'user_details': user_id={call.from_user.id}, username={call.from_user.username}, data={call.data}")
-    if not user_has_privileges(call.from_user.username):
-        logger.warning(
-            f"Недостаточно прав у пользователя: user_id={call.from_user.id}, username={call.from_user.username}")
-        bot.answer_callback_query(call.id, "❌ У вас недостаточно прав!")
-        return
-
-    try:
-        _, uid_str, page_str = call.data.split(':')
-        user_id = int(uid_str)
-        page = int(page_str)
-    except ValueError as e:
-        logger.error(f"Некорректный формат callback_data: {call.data}. Ошибка: {e}")
-        bot.answer_callback_query(call.id, "❌ Некорректный запрос.")
-        return
-
-    logger.info(f"Получение деталей пользователя: user_id={user_id}, страница возврата={page}")
+def run_polling():
+    logger.info("Бот успешно запущен в режиме polling. Ожидаем входящие команды...")
+    bot.infinity_polling()
 
-    user = get_user_by_id(user_id)
-    if not user:
-        logger.warning(f"Пользователь с ID {user_id} не найден в БД.")
-        bot.answer_callback_query(call.id, "❌ Пользователь не найден.")
-        return
 
-    uid, uname, fname, lname, priv = user
-    pmark = "✅" if priv == 1 else "❌"
-    logger.info(
-        f"Детали пользователя получены: user_id={uid}, username={uname}, имя={fname}, фамилия={lname}, привилегии={pmark}")
-
-    text = (f"<b>Профиль пользователя</b>\n\n"
-            f"ID: {uid}\n"
-            f"Имя: {fname or 'не указано'} {lname or 'не указано'}\n"
-            f"Username: @{uname if uname else 'нет'}\n"
-            f"Привилегии: {pmark}\n\n"
-            "Вы можете написать этому пользователю, нажав на кнопку ниже.")
-
-    keyboard = types.InlineKeyboardMarkup()
-    if uname:
-        logger.debug("Формируем кнопку для отправки сообщения по username.")
-        keyboard.add(types.InlineKeyboardButton("✉️ Написать пользователю", url=f"https://t.me/{uname}"))
+def run_webhook():
+    from webhook import WebhookServer
+    server = WebhookServer(bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN,
+                           workers=WEBHOOK_WORKERS)
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET_TOKEN)
+        logger.info("Webhook зарегистрирован в Telegram: %s", WEBHOOK_URL)
     else:
-        logger.debug("Формируем кнопку для отправки сообщения по user_id.")
-        keyboard.add(types.InlineKeyboardButton("✉️ Написать пользователю", url=f"tg://user?id={uid}"))
-
-    keyboard.add(types.InlineKeyboardButton("🔙 Назад", callback_data=f"users_page:{page}:"))
-
+        # Без публичного адреса сервер работает только локально, например для отправки записанных обновлений
+        logger.warning("WEBHOOK_URL не задан, webhook в Telegram не регистрируется.")
+    logger.info("Бот успешно запущен в режиме webhook. Ожидаем входящие обновления...")
     try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=keyboard,
-                              parse_mode='HTML')
-        logger.info("Сообщение с деталями пользователя успешно отредактировано.")
-    except Exception as e:
-        logger.error(f"Ошибка при редактировании сообщения с деталями пользователя: {e}")
-
-    bot.answer_callback_query(call.id)
-
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith('search_page:'))
-def callback_search_page(call):
-    logger.info(
-        f"Обратный вызов 'search_page': user_id={call.from_user.id}, username={call.from_user.username}, data={call.data}")
-    if not user_has_privileges(call.from_user.username):
-        logger.warning(
-            f"Недостаточно прав у пользователя: user_id={call.from_user.id}, username={call.from_user.username}")
-        bot.answer_callback_query(call.id, "❌ У вас недостаточно прав!")
-        return
-    try:
-        _, page_str, enc_query = call.data.split(':', 2)
-        page = int(page_str)
-        query = enc_query.replace('%20', ' ')
-    except ValueError as e:
-        logger.error(f"Некорректный формат callback_data: {call.data}. Ошибка: {e}")
-        bot.answer_callback_query(call.id, "❌ Некорректный запрос.")
-        return
-    logger.info(f"Пользователь переключился на страницу поиска: page={page}, query='{query}'")
-
-    send_search_page(call.message.chat.id, query=query, page=page, message_id=call.message.message_id)
-    bot.answer_callback_query(call.id)
+        server.serve_forever()
+    finally:
+        server.shutdown()
 
 
 if __name__ == "__main__":
-    logger.info("Инициализация бота...")
-    try:
-        logger.info("Бот успешно запущен. Ожидаем входящие команды...")
-        bot.infinity_polling()
-    except Exception as e:
-        logger.error(f"Ошибка при запуске бота: {e}")
+    if RUNTIME == "async":
+        # Асинхронный режим на AsyncTeleBot: обработчики из async_main.py
+        import async_main
+        async_main.run()
+    else:
+        logger.info("Инициализация бота...")
+        start_background()
+        try:
+            if RUN_MODE == "webhook":
+                run_webhook()
+            else:
+                run_polling()
+        except Exception as e:
+            logger.error("Ошибка при запуске бота: %s", e)
+        finally:
+            stop_background()
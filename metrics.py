@@ -0,0 +1,314 @@
+# metrics.py
+# Метрики бота в формате Prometheus: время работы обработчиков, время обращений к SQLite,
+# Google Sheets и Telegram API, число ошибок и глубина очередей.
+# Снимаются по HTTP (config.METRICS_PORT, путь /metrics), краткая сводка - командой /stats.
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels_text(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (последняя - +Inf), сумма, максимум]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0.0]
+                self._series[labels] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] = max(series[2], value)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total, peak) for labels, (counts, total, peak) in self._series.items()}
+
+    def quantile(self, counts, q):
+        """Оценка квантиля по корзинам с линейной интерполяцией внутри корзины."""
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if seen + count >= rank and count:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, _) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames + ('le',), labels + (le,))} {cumulative}")
+            label_text = _labels_text(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Значение снимается в момент запроса: func возвращает {метки (tuple): значение}."""
+
+    def __init__(self, name, help_text, labelnames, func, kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.func = func
+        self.kind = kind
+
+    def values(self):
+        try:
+            return self.func()
+        except Exception as e:
+            logger.error("Не удалось получить значение метрики %s: %s", self.name, e)
+            return {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HANDLER_SECONDS = registry.register(Histogram(
+    "bot_handler_seconds", "Время работы обработчиков бота", ("handler",)))
+HANDLER_ERRORS = registry.register(Counter(
+    "bot_handler_errors_total", "Необработанные исключения в обработчиках бота", ("handler",)))
+CALL_SECONDS = registry.register(Histogram(
+    "bot_external_call_seconds", "Время обращений к SQLite, Google Sheets и Telegram API", ("service", "method")))
+CALL_ERRORS = registry.register(Counter(
+    "bot_external_call_errors_total", "Ошибки обращений к SQLite, Google Sheets и Telegram API", ("service", "method")))
+
+
+def gauge(name, help_text, labelnames, func, kind="gauge"):
+    """Регистрирует метрику, значение которой вычисляется при каждом запросе."""
+    return registry.register(Gauge(name, help_text, labelnames, func, kind=kind))
+
+
+def _timed(func, histogram, errors, labels):
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(*labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc(*labels)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, *labels)
+    return wrapper
+
+
+def timed_handler(func):
+    """Декоратор обработчика бота (обычного или async): время работы и ошибки по имени функции."""
+    return _timed(func, HANDLER_SECONDS, HANDLER_ERRORS, (func.__name__,))
+
+
+def timed_call(service, method=None):
+    """Декоратор обращения к внешнему сервису; method по умолчанию - имя функции."""
+    def decorator(func):
+        return _timed(func, CALL_SECONDS, CALL_ERRORS, (service, method or func.__name__))
+    return decorator
+
+
+@contextmanager
+def track_call(service, method):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        CALL_ERRORS.inc(service, method)
+        raise
+    finally:
+        CALL_SECONDS.observe(time.perf_counter() - started, service, method)
+
+
+_telegram_instrumented = False
+
+
+def instrument_telegram():
+    """
+    Оборачивает низкоуровневые функции запросов pyTelegramBotAPI, через которые проходят
+    все методы Bot API, - и синхронного TeleBot, и AsyncTeleBot (если установлен aiohttp).
+    """
+    global _telegram_instrumented
+    if _telegram_instrumented:
+        return
+    from telebot import apihelper
+
+    make_request = apihelper._make_request
+
+    @functools.wraps(make_request)
+    def _make_request(token, method_name, *args, **kwargs):
+        with track_call("telegram", method_name):
+            return make_request(token, method_name, *args, **kwargs)
+
+    apihelper._make_request = _make_request
+
+    try:
+        from telebot import asyncio_helper
+    except ImportError:
+        asyncio_helper = None
+    if asyncio_helper is not None:
+        process_request = asyncio_helper._process_request
+
+        @functools.wraps(process_request)
+        async def _process_request(token, url, *args, **kwargs):
+            with track_call("telegram", url):
+                return await process_request(token, url, *args, **kwargs)
+
+        asyncio_helper._process_request = _process_request
+    _telegram_instrumented = True
+
+
+def summary():
+    """Сводка для команды /stats: {раздел: [(имя, число, среднее, p50, p99, ошибки), ...]}."""
+    def rows(histogram, errors):
+        error_counts = errors.values()
+        result = []
+        for labels, (counts, total, _) in sorted(histogram.snapshot().items()):
+            count = sum(counts)
+            result.append((":".join(labels), count, total / count if count else 0.0,
+                           histogram.quantile(counts, 0.5), histogram.quantile(counts, 0.99),
+                           error_counts.get(labels, 0)))
+        return result
+
+    return {"handlers": rows(HANDLER_SECONDS, HANDLER_ERRORS), "calls": rows(CALL_SECONDS, CALL_ERRORS)}
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics HTTP: " + format, *args)
+
+
+_server = None
+
+
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Запускает HTTP-сервер метрик в фоновом потоке (если METRICS_ENABLED)."""
+    global _server
+    if not METRICS_ENABLED or _server is not None:
+        return
+    _server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Метрики доступны по адресу http://%s:%s/metrics", host, port)
+
+
+def stop_server():
+    global _server
+    if _server is None:
+        return
+    _server.shutdown()
+    _server.server_close()
+    _server = None
@@ -0,0 +1,168 @@
+# migrations.py
+# Версии схемы БД. Номер применённой версии хранится в PRAGMA user_version; при подключении
+# недостающие миграции выполняются по порядку, каждая - одной транзакцией вместе с новым номером,
+# поэтому прерванное обновление не оставляет базу в промежуточном состоянии.
+#
+# Новая миграция - функция, добавленная в конец MIGRATIONS. Уже выпущенные миграции не меняются.
+import logging
+import sqlite3
+import time
+
+from config import CHANNEL_ID
+
+logger = logging.getLogger(__name__)
+
+
+def _execute_script(conn, script):
+    """Выполняет SQL-скрипт по одному оператору (executescript зафиксировал бы открытую транзакцию)."""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+    if statement.strip():
+        conn.execute(statement)
+
+
+def _table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def _base_schema(conn):
+    # Базы, созданные до появления миграций, уже содержат часть таблиц - отсюда IF NOT EXISTS
+    members_existed = _table_exists(conn, "channel_members")
+    _execute_script(conn, """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        is_privileged INTEGER DEFAULT 0
+    );
+
+    -- Участие пользователей в каналах: один пользователь может состоять в нескольких каналах бота.
+    -- Ключ (channel_id, user_id) хранится прямо в B-дереве (WITHOUT ROWID), выборка каналов
+    -- пользователя идёт по индексу user_id
+    CREATE TABLE IF NOT EXISTS channel_members (
+        channel_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        joined_at REAL,
+        PRIMARY KEY (channel_id, user_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_channel_members_user ON channel_members(user_id);
+
+    -- Очередь на запись в Google Sheets. Строка добавляется в той же транзакции, что и пользователь,
+    -- и удаляется только после успешной записи в таблицу, поэтому сбой Sheets или перезапуск
+    -- процесса не теряют данные
+    CREATE TABLE IF NOT EXISTS sheets_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        spreadsheet_id TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        row_json TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_sheets_outbox_due ON sheets_outbox (next_attempt_at, id);
+
+    -- Состояния диалога для STATE_BACKEND = "sqlite"
+    CREATE TABLE IF NOT EXISTS user_states (
+        user_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_user_states_expires ON user_states(expires_at);
+    """)
+    # В users.db старого dump_data.py таблица users создана без is_privileged
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if "is_privileged" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN is_privileged INTEGER DEFAULT 0")
+    if not members_existed:
+        # База одноканальной версии: все пользователи - участники основного канала, дата вступления неизвестна
+        conn.execute("INSERT OR IGNORE INTO channel_members (channel_id, user_id) SELECT ?, user_id FROM users",
+                     (CHANNEL_ID,))
+
+
+def _filter_indexes(conn):
+    # Username в Telegram не зависит от регистра: поиск по нему идёт с COLLATE NOCASE и попадает в индекс.
+    # Сотрудников единицы, поэтому индекс по is_privileged частичный - только строки с правами
+    _execute_script(conn, """
+    CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_users_privileged ON users(is_privileged) WHERE is_privileged = 1;
+    """)
+
+
+def _user_timestamps(conn):
+    # joined_at - первое вступление в любой из каналов бота, updated_at - последнее изменение строки.
+    # Для уже существующих пользователей joined_at берётся из channel_members (у перенесённых - NULL)
+    _execute_script(conn, """
+    ALTER TABLE users ADD COLUMN joined_at REAL;
+    ALTER TABLE users ADD COLUMN updated_at REAL;
+    UPDATE users SET joined_at = (SELECT MIN(m.joined_at) FROM channel_members m WHERE m.user_id = users.user_id);
+    UPDATE users SET updated_at = joined_at;
+    CREATE INDEX IF NOT EXISTS idx_users_joined_at ON users(joined_at);
+    """)
+
+
+def _join_digests(conn):
+    # Списки участников из сводных уведомлений: кнопка «Открыть список» должна работать
+    # и через дни после сводки, а сессии поиска живут час
+    _execute_script(conn, """
+    CREATE TABLE IF NOT EXISTS join_digests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        user_ids TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    """)
+
+
+# (версия, описание, функция); версия - позиция в списке, начиная с 1
+MIGRATIONS = [
+    (1, "базовая схема: users, channel_members, sheets_outbox, user_states", _base_schema),
+    (2, "индексы по username (NOCASE) и is_privileged", _filter_indexes),
+    (3, "users.joined_at и users.updated_at", _user_timestamps),
+    (4, "списки участников сводных уведомлений", _join_digests),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=SCHEMA_VERSION):
+    """
+    Доводит схему до версии target. conn - соединение в режиме autocommit (isolation_level=None).
+    Возвращает номер версии после обновления.
+    """
+    version = get_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Версия схемы БД {version} новее, чем поддерживает бот ({SCHEMA_VERSION})")
+    for number, description, func in MIGRATIONS:
+        if number > target:
+            break
+        if number <= version:
+            continue
+        started = time.monotonic()
+        # BEGIN IMMEDIATE сериализует обновление между процессами (бот и dump_data.py);
+        # после получения блокировки версия перечитывается - её мог поднять другой процесс
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = get_version(conn)
+            if number <= version:
+                conn.execute("COMMIT")
+                continue
+            func(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        version = number
+        logger.info("Схема БД обновлена до версии %s (%s) за %.2f c", number, description, time.monotonic() - started)
+    return version
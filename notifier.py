@@ -0,0 +1,215 @@
+# notifier.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Через сколько секунд появится свободный токен (0 - уже есть). Не блокирует."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._refill(now)
+            return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        """Забирает токен; вызывать после delay() == 0."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+
+    def block(self, seconds):
+        """Запрещает выдачу токенов на seconds секунд (например, после ответа 429)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            # После паузы можно отправить одно сообщение сразу, остальные - в обычном темпе
+            self._tokens = min(self.capacity, 1)
+            self._updated = self._blocked_until
+
+
+class _Message:
+    __slots__ = ('chat_id', 'text', 'kwargs', 'future', 'attempt')
+
+    def __init__(self, chat_id, text, kwargs):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempt = 0
+
+
+class NotificationDispatcher:
+    """
+    Параллельная рассылка сообщений с ограничением скорости.
+    Общий bucket держит лимит бота (global_rate сообщений в секунду),
+    отдельный bucket на каждый чат - лимит на один чат (per_chat_rate).
+    Токены раздаёт один поток-планировщик: сообщение, которому пока нельзя уйти, возвращается
+    в очередь со сроком, когда освободится его чат, поэтому занятый чат не держит потоки отправки
+    и не задерживает остальные. При ответе 429 Telegram ограничивает весь бот, поэтому на retry_after
+    блокируются и чат, и общий bucket, а сообщение повторяется после этого срока.
+    В один чат сообщения уходят по одному в порядке send(): в планировщике только первое
+    неотправленное сообщение каждого чата, следующее встаёт в очередь после его доставки или отказа.
+    """
+
+    def __init__(self, send_func, global_rate=30, per_chat_rate=1, workers=8, max_retries=5):
+        self.send_func = send_func
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="notifier")
+        self._stats_lock = threading.Lock()
+        self._stats = {"delivered": 0, "retried": 0, "dropped": 0}
+        self._pending = 0
+        # Очередь планировщика: (когда можно отправлять, порядковый номер, сообщение)
+        self._heap = []
+        self._chat_queues = {}  # chat_id -> сообщения чата в порядке send(), первое - в планировщике
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._scheduler = None
+
+    def _chat_bucket(self, chat_id):
+        # Вызывается только из потока-планировщика
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, capacity=1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def pending(self):
+        """Сколько сообщений ещё ждут отправки (в очереди и в процессе повторов)."""
+        with self._stats_lock:
+            return self._pending
+
+    def send(self, chat_id, text, **kwargs):
+        """Ставит сообщение в очередь на отправку и сразу возвращает Future."""
+        message = _Message(chat_id, text, kwargs)
+        with self._stats_lock:
+            self._pending += 1
+        self._ensure_scheduler()
+        with self._cond:
+            messages = self._chat_queues.setdefault(chat_id, deque())
+            messages.append(message)
+            if len(messages) == 1:
+                self._schedule(message, time.monotonic())
+        return message.future
+
+    def _ensure_scheduler(self):
+        with self._cond:
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._run_scheduler, name="notifier-scheduler", daemon=True)
+                self._scheduler.start()
+
+    def _schedule(self, message, ready_at):
+        with self._cond:
+            heapq.heappush(self._heap, (ready_at, next(self._seq), message))
+            self._cond.notify()
+
+    def _finish(self, message, delivered):
+        self._count("delivered" if delivered else "dropped")
+        with self._stats_lock:
+            self._pending -= 1
+        with self._cond:
+            messages = self._chat_queues[message.chat_id]
+            messages.popleft()
+            if messages:
+                self._schedule(messages[0], time.monotonic())
+            else:
+                del self._chat_queues[message.chat_id]
+            self._cond.notify()
+        message.future.set_result(delivered)
+
+    def _run_scheduler(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, message = heapq.heappop(self._heap)
+                        break
+                    if self._closing and not self._heap and self.pending() == 0:
+                        return
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            chat_bucket = self._chat_bucket(message.chat_id)
+            wait = max(chat_bucket.delay(), self._global_bucket.delay())
+            if wait > 0:
+                self._schedule(message, time.monotonic() + wait)
+                continue
+            chat_bucket.take()
+            self._global_bucket.take()
+            self._executor.submit(self._send_once, message)
+
+    def _send_once(self, message):
+        chat_id = message.chat_id
+        try:
+            self.send_func(chat_id, message.text, **message.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and message.attempt < self.max_retries:
+                message.attempt += 1
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                logger.warning("Telegram вернул 429 для chat_id=%s, повтор через %s c (попытка %s/%s)",
+                               chat_id, retry_after, message.attempt, self.max_retries)
+                self._count("retried")
+                # Лимит Telegram общий для бота: пауза нужна всем чатам, не только этому
+                self._chat_bucket_block(chat_id, retry_after)
+                self._global_bucket.block(retry_after)
+                self._schedule(message, time.monotonic() + retry_after)
+                return
+            logger.error("Не удалось отправить сообщение chat_id=%s: %s", chat_id, e)
+            self._finish(message, False)
+            return
+        except Exception as e:
+            logger.error("Не удалось отправить сообщение chat_id=%s: %s", chat_id, e)
+            self._finish(message, False)
+            return
+        logger.info("Сообщение доставлено: chat_id=%s", chat_id)
+        self._finish(message, True)
+
+    def _chat_bucket_block(self, chat_id, seconds):
+        with self._cond:
+            bucket = self._chat_buckets.get(chat_id)
+        if bucket is not None:
+            bucket.block(seconds)
+
+    def shutdown(self, wait=True):
+        """Дожидается отправки всего, что уже в очереди (с wait), и останавливает потоки."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+            scheduler = self._scheduler
+        if scheduler is not None and wait:
+            scheduler.join()
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,109 @@
+# outbox.py
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from config import SHEETS_BATCH_SIZE, SHEETS_FLUSH_INTERVAL, OUTBOX_RETRY_BASE_DELAY, OUTBOX_RETRY_MAX_DELAY
+from db import fetch_due_outbox, delete_outbox, reschedule_outbox
+from google_sheets import sheets
+
+logger = logging.getLogger(__name__)
+
+
+class SheetsOutboxWorker:
+    """
+    Фоновая запись очереди sheets_outbox в Google Sheets.
+    Записи отправляются пачками через append_rows (один запрос на таблицу), как только
+    в очереди набралось batch_size новых строк или прошло flush_interval секунд.
+    При ошибке записи пачки переносятся с экспоненциальной паузой; после перезапуска
+    процесса очередь продолжает разбираться из БД.
+    """
+
+    def __init__(self, batch_size=SHEETS_BATCH_SIZE, flush_interval=SHEETS_FLUSH_INTERVAL,
+                 base_delay=OUTBOX_RETRY_BASE_DELAY, max_delay=OUTBOX_RETRY_MAX_DELAY):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def notify_enqueued(self, count=1):
+        """Сообщает о новых строках в очереди; при наборе пачки будит поток записи."""
+        with self._lock:
+            self._pending += count
+            if self._pending >= self.batch_size:
+                self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="sheets-outbox", daemon=True)
+        self._thread.start()
+        logger.info("Запись очереди Google Sheets запущена.")
+
+    def stop(self):
+        """Останавливает поток и синхронно отправляет всё, что уже можно отправить."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.drain()
+        logger.info("Запись очереди Google Sheets остановлена.")
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                self.drain()
+            except Exception as e:
+                logger.error("Ошибка при разборе очереди Google Sheets: %s", e)
+
+    def drain(self):
+        """Отправляет все записи, время которых наступило. Возвращает число отправленных строк."""
+        with self._lock:
+            self._pending = 0
+        sent = 0
+        while True:
+            entries = fetch_due_outbox(self.batch_size)
+            if not entries:
+                return sent
+            sent_now = self._send_batch(entries)
+            sent += sent_now
+            if len(entries) < self.batch_size or sent_now == 0:
+                return sent
+
+    def _send_batch(self, entries):
+        by_sheet = defaultdict(list)
+        for entry in entries:
+            by_sheet[entry[1]].append(entry)
+
+        sent = 0
+        for spreadsheet_id, group in by_sheet.items():
+            try:
+                sheets.append_rows(spreadsheet_id, [json.loads(row_json) for _, _, row_json, _ in group])
+            except Exception as e:
+                now = time.time()
+                retries = [(entry_id, attempts + 1, now + min(self.max_delay, self.base_delay * (2 ** attempts)))
+                           for entry_id, _, _, attempts in group]
+                reschedule_outbox(retries, e)
+                logger.error("Не удалось записать %s строк в таблицу %s, повтор отложен: %s", len(group), spreadsheet_id, e)
+                continue
+            delete_outbox([entry_id for entry_id, _, _, _ in group])
+            sent += len(group)
+            logger.info("Записано в таблицу %s: %s строк", spreadsheet_id, len(group))
+        return sent
+
+
+outbox_worker = SheetsOutboxWorker()
@@ -0,0 +1,273 @@
+# pipeline.py
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class FairQueue:
+    """
+    Очередь с отдельной подочередью на каждый ключ (например, канал) и выдачей по кругу.
+    Ограничение maxsize действует на каждый ключ: переполненный ключ задерживает только
+    своих отправителей, а задачи остальных ключей продолжают выдаваться по очереди.
+    Стоп-сигналы выдаются после всех задач.
+    """
+
+    def __init__(self, key, maxsize=1000):
+        self.key = key
+        self.maxsize = maxsize
+        self._queues = {}
+        self._ready = deque()  # ключи с задачами в порядке обслуживания
+        self._control = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def put(self, item, timeout=None):
+        with self._cond:
+            if item is _STOP:
+                self._control.append(item)
+                self._cond.notify_all()
+                return
+            key = self.key(item)
+            # Подочередь перечитывается по ключу: пока отправитель ждал, get() мог опустошить и удалить её
+            if not self._cond.wait_for(lambda: len(self._queues.get(key, ())) < self.maxsize, timeout):
+                raise queue.Full
+            items = self._queues.get(key)
+            if items is None:
+                items = self._queues[key] = deque()
+            if not items:
+                self._ready.append(key)
+            items.append(item)
+            self._size += 1
+            self._cond.notify_all()
+
+    def get(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._ready or self._control)
+            if not self._ready:
+                return self._control.popleft()
+            key = self._ready.popleft()
+            items = self._queues[key]
+            item = items.popleft()
+            self._size -= 1
+            if items:
+                self._ready.append(key)
+            else:
+                del self._queues[key]
+            self._cond.notify_all()
+            return item
+
+    def task_done(self):
+        pass
+
+    def qsize(self):
+        with self._cond:
+            return self._size
+
+    def sizes(self):
+        """Число задач по ключам."""
+        with self._cond:
+            return {key: len(items) for key, items in self._queues.items()}
+
+
+class Stage:
+    """
+    Одна стадия конвейера: своя ограниченная очередь, свои воркеры и свои повторы.
+    Результат функции стадии (если не None) передаётся во все следующие стадии.
+    С key задачи раскладываются по подочередям FairQueue и обслуживаются по кругу.
+    """
+
+    def __init__(self, pipeline, name, func, workers=1, queue_size=1000, retries=3, retry_delay=1.0, next_stages=(),
+                 key=None):
+        self.pipeline = pipeline
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.next_stages = tuple(next_stages)
+        self.queue = FairQueue(key, maxsize=queue_size) if key else queue.Queue(maxsize=queue_size)
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.pipeline.name}-{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        for _ in self._threads:
+            # Блокирующий put: стоп-сигнал встаёт в очередь после всех накопленных задач
+            self.queue.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def put(self, item, timeout=None):
+        # Если очередь заполнена, вызывающий поток ждёт - это и есть обратное давление
+        self.queue.put(item, timeout=timeout)
+
+    def _process(self, item):
+        attempt = 0
+        while True:
+            try:
+                return self.func(item)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.retries:
+                    logger.error("Стадия '%s': задача отброшена после %s попыток: %s", self.name, attempt, e)
+                    raise
+                delay = self.retry_delay * (2 ** (attempt - 1))
+                logger.warning("Стадия '%s': ошибка (попытка %s/%s), повтор через %s c: %s", self.name, attempt, self.retries, delay, e)
+                time.sleep(delay)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                try:
+                    result = self._process(item)
+                except Exception:
+                    continue
+                if result is None:
+                    continue
+                for next_name in self.next_stages:
+                    self.pipeline.stages[next_name].put(result)
+            finally:
+                self.queue.task_done()
+
+
+class IngestionPipeline:
+    """
+    Конвейер фоновой обработки: задачи проходят цепочку стадий, каждая в своих потоках.
+    Стадии добавляются в порядке следования, первая добавленная принимает задачи из submit().
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self._order = []
+        self._started = False
+
+    def add_stage(self, name, func, workers=1, queue_size=1000, retries=3, retry_delay=1.0, next_stages=(), key=None):
+        stage = Stage(self, name, func, workers=workers, queue_size=queue_size, retries=retries,
+                      retry_delay=retry_delay, next_stages=next_stages, key=key)
+        self.stages[name] = stage
+        self._order.append(name)
+        return stage
+
+    def put(self, item, timeout=None):
+        """Ставит задачу в первую стадию; queue.Full, если очередь не освободилась за timeout."""
+        self.stages[self._order[0]].put(item, timeout=timeout)
+
+    def submit(self, item, timeout=None):
+        """Ставит задачу в первую стадию. Возвращает False, если очередь не освободилась за timeout."""
+        try:
+            self.put(item, timeout=timeout)
+        except queue.Full:
+            logger.error("Конвейер '%s' переполнен, задача не принята: %s", self.name, item)
+            return False
+        return True
+
+    def queue_sizes(self):
+        return {name: self.stages[name].queue.qsize() for name in self._order}
+
+    def start(self):
+        if self._started:
+            return
+        for name in self._order:
+            self.stages[name].start()
+        self._started = True
+        logger.info("Конвейер '%s' запущен: стадии %s", self.name, ', '.join(self._order))
+
+    def stop(self):
+        """Дожидается обработки всех поставленных задач и останавливает воркеры стадия за стадией."""
+        if not self._started:
+            return
+        for name in self._order:
+            self.stages[name].stop()
+        self._started = False
+        logger.info("Конвейер '%s' остановлен.", self.name)
+
+
+class Backlog:
+    """
+    Приём задач в конвейер без блокировки вызывающих потоков дольше timeout.
+    Задача, которую переполненная подочередь конвейера не приняла за timeout, откладывается
+    в очередь своего ключа (канала) и дописывается в конвейер отдельным потоком этого ключа.
+    Так переполненный канал занимает только свой поток, а не общие потоки обработчиков бота.
+    Пока у ключа есть отложенные задачи, новые встают за ними - порядок внутри ключа сохраняется.
+    """
+
+    def __init__(self, pipeline, key, timeout=0.5, maxsize=10000):
+        self.pipeline = pipeline
+        self.key = key
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._items = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Возвращает False, только если отложенная очередь ключа переполнена и задача отброшена."""
+        key = self.key(item)
+        with self._lock:
+            if key in self._items:
+                return self._defer(key, item)
+        try:
+            self.pipeline.put(item, timeout=self.timeout)
+            return True
+        except queue.Full:
+            pass
+        with self._lock:
+            return self._defer(key, item)
+
+    def _defer(self, key, item):
+        items = self._items.setdefault(key, deque())
+        if len(items) >= self.maxsize:
+            logger.error("Отложенная очередь '%s' (ключ %s) переполнена, задача отброшена: %s",
+                         self.pipeline.name, key, item)
+            return False
+        items.append(item)
+        if key not in self._threads:
+            logger.warning("Конвейер '%s' не успевает за ключом %s, задачи откладываются", self.pipeline.name, key)
+            t = threading.Thread(target=self._drain, args=(key,), name=f"{self.pipeline.name}-backlog-{key}", daemon=True)
+            self._threads[key] = t
+            t.start()
+        return True
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                items = self._items[key]
+                if not items:
+                    del self._items[key]
+                    del self._threads[key]
+                    return
+                item = items[0]
+            # Задача остаётся в очереди, пока конвейер её не примет: новые задачи ключа встают за ней
+            self.pipeline.put(item)
+            with self._lock:
+                items.popleft()
+
+    def sizes(self):
+        """Число отложенных задач по ключам."""
+        with self._lock:
+            return {key: len(items) for key, items in self._items.items()}
+
+    def stop(self):
+        """Дожидается передачи всех отложенных задач в конвейер (конвейер должен ещё работать)."""
+        while True:
+            with self._lock:
+                threads = list(self._threads.values())
+            if not threads:
+                return
+            for t in threads:
+                t.join()
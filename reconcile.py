@@ -0,0 +1,189 @@
+# reconcile.py
+# Сверка Google Таблиц с БД и досылка расхождений.
+#
+#   python reconcile.py
+#   python reconcile.py --channel -1001234567890 --dry-run
+#
+# Каждая таблица канала читается одним запросом get_all_values и сравнивается с участниками
+# канала в БД по user_id. Недостающие строки дописываются append_rows, устаревшие (имя, username,
+# is_privileged после /grant и /revoke) перезаписываются batch_update. Запросы идут пачками
+# по RECONCILE_CHUNK_ROWS строк не чаще раза в RECONCILE_REQUEST_INTERVAL секунд, чтобы
+# оставаться в квоте Google Sheets API. Лишние строки и дубли только попадают в отчёт - не удаляются.
+import argparse
+import logging
+import threading
+import time
+
+from config import CHANNELS, RECONCILE_CHUNK_ROWS, RECONCILE_REQUEST_INTERVAL, RECONCILE_GRACE
+from db import iter_channel_users, pending_outbox_user_ids
+from google_sheets import sheets, sheet_rows
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+_running = threading.Lock()
+
+
+class SheetReport:
+    """Итог сверки одной таблицы."""
+
+    def __init__(self, channel_id, spreadsheet_id):
+        self.channel_id = channel_id
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_rows = 0
+        self.db_rows = 0
+        self.missing = 0
+        self.changed = 0
+        self.extra = 0
+        self.duplicates = 0
+        self.appended = 0
+        self.updated = 0
+
+    def describe(self):
+        return (f"таблица {self.spreadsheet_id} (канал {self.channel_id}): в таблице {self.sheet_rows}, в БД {self.db_rows}, "
+                f"не хватало {self.missing} (дописано {self.appended}), устарело {self.changed} (исправлено {self.updated}), "
+                f"лишних {self.extra}, дублей {self.duplicates}")
+
+
+def _column_letter(index):
+    """1 -> 'A', 27 -> 'AA'."""
+    letters = ""
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def _merge_ranges(updates):
+    """[(номер строки, values), ...] -> диапазоны batch_update; соседние строки одной ширины идут одним диапазоном."""
+    data = []
+    start = prev = width = None
+    block = []
+    for row_number, values in sorted(updates, key=lambda u: u[0]):
+        if block and (row_number != prev + 1 or len(values) != width):
+            data.append({'range': f"A{start}:{_column_letter(width)}{prev}", 'values': block})
+            block = []
+        if not block:
+            start, width = row_number, len(values)
+        block.append(values)
+        prev = row_number
+    if block:
+        data.append({'range': f"A{start}:{_column_letter(width)}{prev}", 'values': block})
+    return data
+
+
+def _index_sheet(values, report):
+    """{user_id: (номер строки, значения)} по первой строке каждого user_id; заголовок и чужие строки пропускаются."""
+    index = {}
+    for row_number, row in enumerate(values, start=1):
+        if not row or not row[0].strip().lstrip('-').isdigit():
+            continue
+        user_id = int(row[0])
+        if user_id in index:
+            report.duplicates += 1
+            continue
+        index[user_id] = (row_number, row)
+    report.sheet_rows = len(index) + report.duplicates
+    return index
+
+
+class _Throttle:
+    """Не чаще одного запроса на запись в interval секунд."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last = 0.0
+
+    def wait(self):
+        pause = self._last + self.interval - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+        self._last = time.monotonic()
+
+
+def reconcile_sheet(channel_id, spreadsheet_id, dry_run=False, progress=None, throttle=None):
+    report = SheetReport(channel_id, spreadsheet_id)
+    throttle = throttle or _Throttle(RECONCILE_REQUEST_INTERVAL)
+    # Недавно вступивших и ещё не записанных дошлёт очередь sheets_outbox - иначе строки задвоятся.
+    # Очередь читается до таблицы: что ушло из неё позже, уже попадёт в get_all_values
+    joined_before = time.time() - RECONCILE_GRACE
+    pending = pending_outbox_user_ids(spreadsheet_id)
+    index = _index_sheet(sheets.call(spreadsheet_id, 'get_all_values'), report)
+
+    missing, updates, seen = [], [], set()
+    for user in iter_channel_users(channel_id, joined_before=joined_before):
+        report.db_rows += 1
+        user_id = user[0]
+        seen.add(user_id)
+        values = dict(sheet_rows(user, channel_id))[spreadsheet_id]
+        found = index.get(user_id)
+        if found is None:
+            if user_id not in pending:
+                missing.append(values)
+            continue
+        row_number, row = found
+        current = row[:len(values)] + [''] * (len(values) - len(row))
+        if current != [str(v) for v in values]:
+            updates.append((row_number, values))
+    report.extra = sum(1 for user_id in index if user_id not in seen)
+    report.missing, report.changed = len(missing), len(updates)
+    if progress:
+        progress(f"{report.spreadsheet_id}: не хватает {report.missing}, устарело {report.changed}")
+    if dry_run:
+        return report
+
+    for start in range(0, len(updates), RECONCILE_CHUNK_ROWS):
+        chunk = updates[start:start + RECONCILE_CHUNK_ROWS]
+        throttle.wait()
+        sheets.call(spreadsheet_id, 'batch_update', _merge_ranges(chunk))
+        report.updated += len(chunk)
+        if progress:
+            progress(f"{report.spreadsheet_id}: исправлено {report.updated}/{report.changed}")
+    for start in range(0, len(missing), RECONCILE_CHUNK_ROWS):
+        chunk = missing[start:start + RECONCILE_CHUNK_ROWS]
+        throttle.wait()
+        sheets.call(spreadsheet_id, 'append_rows', chunk)
+        report.appended += len(chunk)
+        if progress:
+            progress(f"{report.spreadsheet_id}: дописано {report.appended}/{report.missing}")
+    return report
+
+
+def reconcile(channel_ids=None, dry_run=False, progress=None):
+    """
+    Сверяет таблицы каналов (по умолчанию - всех из CHANNELS). Возвращает [SheetReport, ...].
+    progress(text) вызывается после чтения каждой таблицы и каждой отправленной пачки.
+    Одновременно выполняется только одна сверка, повторный вызов - RuntimeError.
+    """
+    if not _running.acquire(blocking=False):
+        raise RuntimeError("Сверка таблиц уже выполняется")
+    try:
+        started = time.monotonic()
+        throttle = _Throttle(RECONCILE_REQUEST_INTERVAL)
+        reports = []
+        for channel_id in channel_ids or list(CHANNELS):
+            for spreadsheet_id, _ in CHANNELS[channel_id]["sheets"]:
+                report = reconcile_sheet(channel_id, spreadsheet_id, dry_run, progress, throttle)
+                logger.info("Сверка: %s", report.describe())
+                reports.append(report)
+        logger.info("Сверка таблиц завершена за %.1f c%s", time.monotonic() - started, " (без изменений)" if dry_run else "")
+        return reports
+    finally:
+        _running.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сверка Google Таблиц с БД и досылка расхождений")
+    parser.add_argument('--channel', type=int, action='append', help="id канала из config.CHANNELS (по умолчанию - все)")
+    parser.add_argument('--dry-run', action='store_true', help="только отчёт, без записи в таблицы")
+    args = parser.parse_args()
+
+    setup_logging()
+    for channel_id in args.channel or ():
+        if channel_id not in CHANNELS:
+            parser.error(f"канала {channel_id} нет в config.CHANNELS")
+    reconcile(args.channel, args.dry_run, progress=lambda text: logger.info("Сверка: %s", text))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# search_sessions.py
+import logging
+import secrets
+import threading
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SearchSessions:
+    """
+    Хранилище результатов поиска: запрос и упорядоченный список найденных id лежат
+    под коротким токеном. В callback_data передаётся только токен и номер страницы,
+    поэтому длина запроса не упирается в лимит Telegram в 64 байта.
+    Старые сессии вытесняются по TTL и по LRU при переполнении.
+    """
+
+    def __init__(self, maxsize=1000, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def create(self, query, user_ids):
+        token = secrets.token_urlsafe(6)
+        with self._lock:
+            self._cache[token] = (query, list(user_ids))
+        logger.info("Создана сессия поиска %s: запрос='%s', найдено %s", token, query, len(user_ids))
+        return token
+
+    def get(self, token):
+        """Возвращает (query, user_ids) или None, если сессия истекла или вытеснена."""
+        with self._lock:
+            return self._cache.get(token)
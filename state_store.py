@@ -0,0 +1,83 @@
+# state_store.py
+# Хранилища состояний диалога (ожидание запроса поиска, username для /grant и /revoke).
+# Оба хранилища поддерживают get / set / pop и забывают состояние через ttl секунд бездействия.
+import logging
+import threading
+import time
+
+from cachetools import TTLCache
+
+from config import STATE_BACKEND, STATE_TTL, STATE_MAX_USERS
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStateStore:
+    """Состояния в памяти процесса: не больше maxsize пользователей, старые вытесняются по TTL и LRU."""
+
+    def __init__(self, maxsize=STATE_MAX_USERS, ttl=STATE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, user_id, default=None):
+        with self._lock:
+            return self._cache.get(user_id, default)
+
+    def set(self, user_id, state):
+        with self._lock:
+            self._cache[user_id] = state
+
+    def pop(self, user_id, default=None):
+        with self._lock:
+            return self._cache.pop(user_id, default)
+
+
+class SQLiteStateStore:
+    """
+    Состояния в таблице user_states (создаётся миграциями db.py): переживают перезапуск и общие для всех процессов бота,
+    работающих с одной базой. Истёкшие записи не возвращаются и удаляются не чаще раза в purge_interval.
+    """
+
+    def __init__(self, pool, ttl=STATE_TTL, purge_interval=60):
+        self.pool = pool
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    def get(self, user_id, default=None):
+        row = self.pool.read().execute(
+            "SELECT state FROM user_states WHERE user_id = ? AND expires_at > ?", (user_id, time.time())).fetchone()
+        return row[0] if row else default
+
+    def set(self, user_id, state):
+        now = time.time()
+        purge = now - self._last_purge >= self.purge_interval
+        if purge:
+            self._last_purge = now
+
+        def write(conn):
+            conn.execute("INSERT OR REPLACE INTO user_states (user_id, state, expires_at) VALUES (?, ?, ?)",
+                         (user_id, state, now + self.ttl))
+            if purge:
+                removed = conn.execute("DELETE FROM user_states WHERE expires_at <= ?", (now,)).rowcount
+                if removed:
+                    logger.debug("Удалено истёкших состояний: %s", removed)
+
+        self.pool.write(write)
+
+    def pop(self, user_id, default=None):
+        state = self.get(user_id)
+        if state is None:
+            # Сброс состояния на каждом /start не должен превращаться в запись в БД
+            return default
+        self.pool.write(lambda conn: conn.execute("DELETE FROM user_states WHERE user_id = ?", (user_id,)))
+        return state
+
+
+def create_state_store(name=STATE_BACKEND):
+    if name == "memory":
+        return MemoryStateStore()
+    if name == "sqlite":
+        from db import pool
+        return SQLiteStateStore(pool)
+    raise ValueError(f"Неизвестное хранилище состояний: {name}")
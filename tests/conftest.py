@@ -0,0 +1,14 @@
+# Общие настройки тестов: модули бота лежат в корне репозитория, а db.py открывает
+# базу config.DB_PATH при импорте, поэтому путь подменяется до первого импорта db.
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+
+config.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bot-tests-"), "users.db")
+config.METRICS_ENABLED = False
@@ -0,0 +1,102 @@
+import os
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(os.path.join(tmp_path, "pool.db"))
+    pool.setup(lambda conn: conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT)"))
+    yield pool
+    pool.close()
+
+
+def _values(pool):
+    return [row[0] for row in pool.read().execute("SELECT value FROM t ORDER BY id")]
+
+
+def test_failed_operation_does_not_roll_back_its_batch(pool):
+    # Пока писатель занят blocker, три операции копятся в очереди и фиксируются одним пакетом
+    gate = threading.Event()
+    blocker = pool.submit_write(lambda conn: gate.wait())
+
+    def fail(conn):
+        conn.execute("INSERT INTO t (id, value) VALUES (2, 'failed')")
+        raise RuntimeError("ошибка операции")
+
+    futures = [pool.submit_write(lambda conn: conn.execute("INSERT INTO t (id, value) VALUES (1, 'a')").rowcount),
+               pool.submit_write(fail),
+               pool.submit_write(lambda conn: conn.execute("INSERT INTO t (id, value) VALUES (3, 'b')").rowcount)]
+    gate.set()
+    blocker.result()
+    assert futures[0].result() == 1
+    with pytest.raises(RuntimeError):
+        futures[1].result()
+    assert futures[2].result() == 1
+    assert _values(pool) == ["a", "b"]
+
+
+def test_concurrent_writes_are_group_committed(pool, monkeypatch):
+    commits = []
+    original = pool._commit_batch
+    monkeypatch.setattr(pool, "_commit_batch", lambda conn, batch: (commits.append(len(batch)), original(conn, batch)))
+
+    def insert(start):
+        for i in range(start, start + 50):
+            pool.write(lambda conn, i=i: conn.execute("INSERT INTO t (id, value) VALUES (?, 'x')", (i,)))
+
+    threads = [threading.Thread(target=insert, args=(i * 100,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert pool.read().execute("SELECT COUNT(*) FROM t").fetchone()[0] == 400
+    assert sum(commits) == 400 and len(commits) < 400
+
+
+def test_after_commit_skipped_for_rolled_back_operation(pool):
+    called = []
+
+    def ok(conn):
+        conn.execute("INSERT INTO t (value) VALUES ('ok')")
+        pool.after_commit(lambda: called.append("ok"))
+
+    def fail(conn):
+        pool.after_commit(lambda: called.append("fail"))
+        raise RuntimeError("ошибка операции")
+
+    pool.write(ok)
+    with pytest.raises(RuntimeError):
+        pool.write(fail)
+    assert called == ["ok"]
+
+
+def test_readers_see_committed_writes_only(pool):
+    in_write = threading.Event()
+    release = threading.Event()
+
+    def slow(conn):
+        conn.execute("INSERT INTO t (value) VALUES ('slow')")
+        in_write.set()
+        release.wait()
+
+    future = pool.submit_write(slow)
+    in_write.wait()
+    assert _values(pool) == []
+    release.set()
+    future.result()
+    assert _values(pool) == ["slow"]
+
+
+def test_external_changes_ignore_own_commits(pool):
+    pool.write(lambda conn: conn.execute("INSERT INTO t (value) VALUES ('own')"))
+    before = pool.external_changes()
+    pool.write(lambda conn: conn.execute("INSERT INTO t (value) VALUES ('own')"))
+    assert pool.external_changes() == before
+    other = ConnectionPool(pool.path)
+    other.write(lambda conn: conn.execute("INSERT INTO t (value) VALUES ('other')"))
+    other.close()
+    assert pool.external_changes() == before + 1
@@ -0,0 +1,10 @@
+import db
+
+
+def test_join_digest_survives_as_db_row():
+    digest_id = db.save_join_digest(-100, "новые в «Канал»", [3, 1, 2])
+    assert db.get_join_digest(digest_id) == ("новые в «Канал»", [3, 1, 2])
+
+
+def test_missing_join_digest():
+    assert db.get_join_digest(10 ** 9) is None
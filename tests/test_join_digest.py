@@ -0,0 +1,72 @@
+import types
+
+import pytest
+
+import digest as digest_module
+from digest import JoinDigest
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(digest_module, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def _digest(**kwargs):
+    sent = []
+    digest = JoinDigest(lambda channel_id, user: sent.append(("single", channel_id, user)),
+                        lambda channel_id, users: sent.append(("digest", channel_id, list(users))), **kwargs)
+    return digest, sent
+
+
+def test_first_users_in_window_go_one_by_one(clock):
+    digest, sent = _digest(window=60, threshold=2)
+    for user in (1, 2, 3, 4):
+        digest.add(-1, user)
+    assert sent == [("single", -1, 1), ("single", -1, 2)]
+    clock[0] += 30
+    assert digest.flush() == 0
+    clock[0] += 30
+    assert digest.flush() == 1
+    assert sent[-1] == ("digest", -1, [3, 4])
+
+
+def test_user_after_pending_waits_for_digest_even_in_new_window(clock):
+    digest, sent = _digest(window=60, threshold=1)
+    digest.add(-1, 1)
+    digest.add(-1, 2)
+    clock[0] += 61
+    # Окно истекло, но отложенная сводка ещё не ушла: новый участник встаёт за ней, а не обгоняет
+    digest.add(-1, 3)
+    assert digest.flush() == 1
+    assert sent == [("single", -1, 1), ("digest", -1, [2, 3])]
+    clock[0] += 61
+    digest.add(-1, 4)
+    assert sent[-1] == ("single", -1, 4)
+
+
+def test_max_users_sends_digest_immediately(clock):
+    digest, sent = _digest(window=60, threshold=0, max_users=3)
+    for user in (1, 2, 3, 4):
+        digest.add(-1, user)
+    assert sent == [("digest", -1, [1, 2, 3])]
+    digest.stop()
+    assert sent[-1] == ("digest", -1, [4])
+
+
+def test_channels_have_separate_windows(clock):
+    digest, sent = _digest(window=60, threshold=1)
+    digest.add(-1, 1)
+    digest.add(-1, 2)
+    digest.add(-2, 3)
+    assert ("single", -2, 3) in sent
+    assert digest.flush(force=True) == 1
+
+
+def test_failed_digest_is_logged_not_raised(clock):
+    def fail(channel_id, users):
+        raise RuntimeError("Telegram недоступен")
+
+    digest = JoinDigest(lambda channel_id, user: None, fail, window=60, threshold=0, max_users=1)
+    digest.add(-1, 1)
@@ -0,0 +1,41 @@
+import sqlite3
+
+import migrations
+
+# Схема users.db, которую создавал dump_data.py до появления миграций
+LEGACY_DUMP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT
+);
+INSERT INTO users VALUES (1, 'Alice', 'A', NULL), (2, 'bob', 'B', NULL);
+"""
+
+
+def _connect(path):
+    return sqlite3.connect(str(path), isolation_level=None)
+
+
+def test_migrates_legacy_dump_schema(tmp_path):
+    conn = _connect(tmp_path / "legacy.db")
+    conn.executescript(LEGACY_DUMP_SCHEMA)
+
+    assert migrations.migrate(conn) == migrations.SCHEMA_VERSION
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    assert {"is_privileged", "joined_at", "updated_at"} <= columns
+    assert conn.execute("SELECT user_id, is_privileged, joined_at FROM users ORDER BY user_id").fetchall() == \
+        [(1, 0, None), (2, 0, None)]
+    # Все пользователи старой базы - участники основного канала без даты вступления
+    assert conn.execute("SELECT COUNT(*) FROM channel_members WHERE joined_at IS NULL").fetchone()[0] == 2
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_users_username_nocase", "idx_users_privileged", "idx_users_joined_at"} <= indexes
+
+
+def test_migrate_is_idempotent(tmp_path):
+    conn = _connect(tmp_path / "new.db")
+    migrations.migrate(conn)
+    assert migrations.migrate(conn) == migrations.SCHEMA_VERSION
+    assert migrations.get_version(conn) == migrations.SCHEMA_VERSION
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("telebot")
+
+from telebot.apihelper import ApiTelegramException  # noqa: E402
+
+from notifier import NotificationDispatcher  # noqa: E402
+
+
+def _too_many_requests(retry_after):
+    return ApiTelegramException("sendMessage", None, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                                      "parameters": {"retry_after": retry_after}})
+
+
+class FakeSend:
+    def __init__(self, errors=None):
+        self.calls = []
+        self.errors = errors or {}
+        self.first_call = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, chat_id, text, **kwargs):
+        with self._lock:
+            self.calls.append((time.monotonic(), chat_id, text))
+            errors = self.errors.get(chat_id)
+            error = errors.pop(0) if errors else None
+        self.first_call.set()
+        if error is not None:
+            raise error
+
+    def times(self, chat_id):
+        return [t for t, c, _ in self.calls if c == chat_id]
+
+
+def test_429_is_retried_after_retry_after():
+    send = FakeSend({1: [_too_many_requests(0.3)]})
+    dispatcher = NotificationDispatcher(send, per_chat_rate=100)
+    assert dispatcher.send(1, "текст").result(timeout=5) is True
+    first, second = send.times(1)
+    assert second - first >= 0.3
+    assert dispatcher.stats() == {"delivered": 1, "retried": 1, "dropped": 0}
+    dispatcher.shutdown()
+
+
+def test_429_pauses_other_chats_too():
+    send = FakeSend({1: [_too_many_requests(0.3)]})
+    dispatcher = NotificationDispatcher(send, per_chat_rate=100)
+    limited = dispatcher.send(1, "текст")
+    send.first_call.wait(1)
+    time.sleep(0.05)
+    assert dispatcher.send(2, "текст").result(timeout=5) is True
+    assert send.times(2)[0] - send.times(1)[0] >= 0.3
+    assert limited.result(timeout=5) is True
+    dispatcher.shutdown()
+
+
+def test_per_chat_rate_spaces_messages_to_one_chat_only():
+    send = FakeSend()
+    dispatcher = NotificationDispatcher(send, global_rate=1000, per_chat_rate=10)
+    futures = [dispatcher.send(1, str(i)) for i in range(3)] + [dispatcher.send(chat_id, "x") for chat_id in range(2, 6)]
+    assert all(f.result(timeout=5) for f in futures)
+    times = send.times(1)
+    assert all(b - a >= 0.09 for a, b in zip(times, times[1:]))
+    assert [text for _, chat_id, text in send.calls if chat_id == 1] == ["0", "1", "2"]
+    others = [t for t, chat_id, _ in send.calls if chat_id != 1]
+    assert max(others) - min(others) < 0.09
+    dispatcher.shutdown()
+
+
+def test_other_errors_and_exhausted_retries_are_dropped():
+    send = FakeSend({1: [RuntimeError("сеть")], 2: [_too_many_requests(0.01) for _ in range(3)]})
+    dispatcher = NotificationDispatcher(send, per_chat_rate=100, max_retries=2)
+    assert dispatcher.send(1, "текст").result(timeout=5) is False
+    assert dispatcher.send(2, "текст").result(timeout=5) is False
+    assert len(send.times(2)) == 3
+    assert dispatcher.stats() == {"delivered": 0, "retried": 2, "dropped": 2}
+    dispatcher.shutdown()
+
+
+def test_shutdown_waits_for_queued_messages():
+    send = FakeSend()
+    dispatcher = NotificationDispatcher(send, per_chat_rate=20)
+    for i in range(5):
+        dispatcher.send(1, str(i))
+    assert dispatcher.pending() > 0
+    dispatcher.shutdown()
+    assert dispatcher.pending() == 0
+    assert len(send.calls) == 5
@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from pipeline import Backlog, FairQueue, IngestionPipeline
+
+
+def test_put_waiting_on_full_key_survives_drain():
+    # Отправитель ждёт места в подочереди 'a', а получатель тем временем опустошает и удаляет её
+    q = FairQueue(key=lambda item: item[0], maxsize=1)
+    q.put(("a", 1))
+    producer = threading.Thread(target=q.put, args=(("a", 2),))
+    producer.start()
+    time.sleep(0.05)
+    assert q.get() == ("a", 1)
+    producer.join(timeout=1)
+    assert not producer.is_alive()
+    assert q.get() == ("a", 2)
+    assert q.qsize() == 0 and q.sizes() == {}
+
+
+def test_round_robin_between_keys():
+    q = FairQueue(key=lambda item: item[0])
+    for item in [("a", 1), ("a", 2), ("a", 3), ("b", 1), ("b", 2)]:
+        q.put(item)
+    assert [q.get() for _ in range(5)] == [("a", 1), ("b", 1), ("a", 2), ("b", 2), ("a", 3)]
+
+
+def test_full_key_does_not_block_other_keys():
+    q = FairQueue(key=lambda item: item[0], maxsize=1)
+    q.put(("a", 1))
+    with pytest.raises(queue.Full):
+        q.put(("a", 2), timeout=0.01)
+    q.put(("b", 1), timeout=0.01)
+    assert q.sizes() == {"a": 1, "b": 1}
+
+
+def test_pipeline_passes_results_and_retries():
+    results, attempts = [], []
+    done = threading.Event()
+
+    def flaky(item):
+        attempts.append(item)
+        if len(attempts) == 1:
+            raise RuntimeError("сбой")
+        return item * 10
+
+    def collect(item):
+        results.append(item)
+        done.set()
+
+    pipeline = IngestionPipeline("test")
+    pipeline.add_stage("store", flaky, retries=2, retry_delay=0, next_stages=("collect",))
+    pipeline.add_stage("collect", collect)
+    pipeline.start()
+    assert pipeline.submit(7)
+    assert done.wait(1)
+    pipeline.stop()
+    assert attempts == [7, 7] and results == [70]
+
+
+def test_backlog_keeps_callers_free_while_key_is_full():
+    gate = threading.Event()
+    stored = []
+    all_stored = threading.Event()
+
+    def store(item):
+        if item[0] == "a":
+            gate.wait()
+        stored.append(item)
+        if len(stored) == 5:
+            all_stored.set()
+
+    pipeline = IngestionPipeline("test")
+    pipeline.add_stage("store", store, queue_size=1, key=lambda item: item[0])
+    pipeline.start()
+    backlog = Backlog(pipeline, key=lambda item: item[0], timeout=0.01)
+    # Первая 'a' занимает воркер, вторая - подочередь, остальные откладываются без ожидания
+    started = time.monotonic()
+    for i in range(4):
+        assert backlog.submit(("a", i))
+    assert time.monotonic() - started < 1
+    assert backlog.sizes().get("a", 0) >= 2
+    gate.set()
+    assert backlog.submit(("b", 0))
+    assert all_stored.wait(1)
+    backlog.stop()
+    pipeline.stop()
+    assert [item for item in stored if item[0] == "a"] == [("a", i) for i in range(4)]
+    assert backlog.sizes() == {}
+
+
+def test_backlog_drops_over_maxsize():
+    gate = threading.Event()
+    pipeline = IngestionPipeline("test")
+    pipeline.add_stage("store", lambda item: gate.wait(), queue_size=1, key=lambda item: item[0])
+    pipeline.start()
+    backlog = Backlog(pipeline, key=lambda item: item[0], timeout=0.01, maxsize=1)
+    results = [backlog.submit(("a", i)) for i in range(4)]
+    gate.set()
+    backlog.stop()
+    pipeline.stop()
+    assert results.count(False) >= 1
+
+
+def test_stop_processes_everything_submitted():
+    stored, notified = [], []
+    pipeline = IngestionPipeline("test")
+    pipeline.add_stage("store", lambda item: stored.append(item) or (item if item % 2 else None),
+                       workers=3, next_stages=("notify",))
+    pipeline.add_stage("notify", notified.append, workers=2)
+    pipeline.start()
+    for i in range(100):
+        assert pipeline.submit(i)
+    pipeline.stop()
+    # None из стадии дальше не передаётся
+    assert sorted(stored) == list(range(100))
+    assert sorted(notified) == list(range(1, 100, 2))
+
+
+def test_dropped_task_does_not_stop_worker():
+    done = []
+
+    def store(item):
+        if item == "bad":
+            raise ValueError(item)
+        done.append(item)
+
+    pipeline = IngestionPipeline("test")
+    pipeline.add_stage("store", store, retries=1, retry_delay=0)
+    pipeline.start()
+    pipeline.submit("bad")
+    pipeline.submit("good")
+    pipeline.stop()
+    assert done == ["good"]
+
+
+def test_submit_refuses_when_full():
+    gate = threading.Event()
+    pipeline = IngestionPipeline("test")
+    pipeline.add_stage("store", lambda item: gate.wait(), queue_size=1)
+    pipeline.start()
+    assert pipeline.submit(1)
+    started = time.monotonic()
+    while pipeline.queue_sizes()["store"] and time.monotonic() - started < 1:
+        time.sleep(0.01)
+    assert pipeline.submit(2)
+    assert not pipeline.submit(3, timeout=0.01)
+    gate.set()
+    pipeline.stop()
@@ -0,0 +1,46 @@
+import sqlite3
+
+import config
+import db
+
+
+def _no_sheets(user):
+    return []
+
+
+def test_renamed_staffer_loses_old_username():
+    db.add_user_with_outbox(-100, 501, "staffer", "Staff", None, _no_sheets)
+    assert db.set_privilege("staffer", 1)
+    db.load_privilege_cache()
+    assert db.user_has_privileges("Staffer", 999)
+
+    db.add_user_with_outbox(-100, 501, "newname", "Staff", None, _no_sheets)
+
+    assert not db.user_has_privileges("staffer", 999)
+    assert db.user_has_privileges("NewName", 999)
+    assert db.user_has_privileges(None, 501)
+
+
+def test_renamed_regular_user_gets_no_privileges():
+    db.add_user_with_outbox(-100, 502, "regular", "User", None, _no_sheets)
+    db.load_privilege_cache()
+    db.add_user_with_outbox(-100, 502, "regular2", "User", None, _no_sheets)
+    assert not db.user_has_privileges("regular2", 999)
+
+
+def test_privileges_follow_other_process():
+    db.add_user_with_outbox(-100, 503, "remote", "Staff", None, _no_sheets)
+    db.add_user_with_outbox(-100, 504, "imported", "Staff", None, _no_sheets)
+    assert db.set_privilege("remote", 1)
+    assert db.user_has_privileges("remote", 503)
+
+    # /revoke во втором экземпляре бота с той же users.db
+    conn = sqlite3.connect(config.DB_PATH, isolation_level=None)
+    try:
+        conn.execute("UPDATE users SET is_privileged = 0 WHERE user_id = 503")
+        conn.execute("UPDATE users SET is_privileged = 1 WHERE user_id = 504")
+    finally:
+        conn.close()
+
+    assert not db.user_has_privileges("remote", 503)
+    assert db.user_has_privileges(None, 504)
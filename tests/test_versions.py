@@ -0,0 +1,71 @@
+import sqlite3
+import threading
+
+import config
+import db
+
+
+def _external_insert(user_id):
+    # Отдельное соединение - как dump_data.py, запущенный рядом с ботом
+    conn = sqlite3.connect(config.DB_PATH, isolation_level=None)
+    try:
+        conn.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, f"ext{user_id}"))
+    finally:
+        conn.close()
+
+
+def test_own_writes_do_not_count_as_external():
+    db.add_user_to_db(701, "own701", "Own", None)
+    external = db.pool.external_changes()
+    db.add_user_to_db(702, "own702", "Own", None)
+    db.set_privilege("own702", 1)
+    assert db.pool.external_changes() == external
+
+
+def test_external_write_changes_versions():
+    db.add_user_to_db(703, "own703", "Own", None)
+    data_version = db.get_data_version()
+    user_version = db.get_user_version(703)
+
+    _external_insert(704)
+
+    assert db.get_data_version() != data_version
+    assert db.get_user_version(703) != user_version
+
+
+def test_users_count_sees_external_inserts():
+    count = db.get_users_count()
+    _external_insert(705)
+    assert db.get_users_count() == count + 1
+    db.add_user_to_db(706, "own706", "Own", None)
+    assert db.get_users_count() == count + 2
+
+
+def test_users_count_exact_under_concurrent_writes_and_recounts():
+    db.get_users_count()
+    stop = threading.Event()
+
+    def insert(start):
+        for user_id in range(start, start + 150):
+            db.add_user_to_db(user_id, None, "Load", None)
+
+    def page():
+        while not stop.is_set():
+            db.get_users_count()
+
+    def external():
+        # Каждая чужая запись заставляет следующий get_users_count пересчитать число
+        for user_id in range(900000, 900030):
+            _external_insert(user_id)
+
+    writers = [threading.Thread(target=insert, args=(10000 + i * 1000,)) for i in range(4)]
+    readers = [threading.Thread(target=page) for _ in range(2)] + [threading.Thread(target=external)]
+    for t in readers + writers:
+        t.start()
+    for t in writers + readers[2:]:
+        t.join()
+    stop.set()
+    for t in readers[:2]:
+        t.join()
+    real = db.pool.read().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    assert db.get_users_count() == real
@@ -0,0 +1,132 @@
+# webhook.py
+# Приём обновлений Telegram через webhook вместо long polling.
+#
+# Встроенный HTTP-сервер принимает POST с обновлением, проверяет секретный токен
+# (заголовок X-Telegram-Bot-Api-Secret-Token), сразу отвечает 200 и передаёт
+# обновление в пул потоков, где оно разбирается и отдаётся обработчикам бота.
+#
+# Для локальной проверки без Telegram можно отправить записанные обновления:
+#   python webhook.py post updates.jsonl --url http://127.0.0.1:8443/telegram/webhook --secret <токен>
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    def __init__(self, bot, host, port, path, secret_token, workers=8, loop=None):
+        # loop задаётся для AsyncTeleBot: обработка обновления выполняется в этом цикле событий
+        if not secret_token:
+            # Без секрета любой, кто достучится до порта, может прислать обновление от имени директора
+            raise ValueError("Режим webhook требует WEBHOOK_SECRET_TOKEN (1-256 символов A-Z, a-z, 0-9, _ и -)")
+        self.bot = bot
+        self.loop = loop
+        self.path = path
+        self.secret_token = secret_token
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="webhook")
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        return self._httpd.server_address
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                if not hmac.compare_digest(
+                        self.headers.get(SECRET_HEADER, ''), server.secret_token):
+                    logger.warning("Webhook: неверный секретный токен от %s", self.client_address[0])
+                    self._reply(403)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._reply(400)
+                    return
+                # Подтверждаем сразу, обработка идёт в пуле потоков
+                self._reply(200)
+                server._executor.submit(server._dispatch, payload)
+
+            def _reply(self, code):
+                self.send_response(code)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug("Webhook: %s %s", self.client_address[0], format % args)
+
+        return Handler
+
+    def _dispatch(self, payload):
+        from telebot import types
+        try:
+            update = types.Update.de_json(payload)
+            result = self.bot.process_new_updates([update])
+            if asyncio.iscoroutine(result):
+                asyncio.run_coroutine_threadsafe(result, self.loop).result()
+        except Exception as e:
+            logger.error("Ошибка обработки обновления из webhook: %s", e)
+
+    def serve_forever(self):
+        logger.info("Webhook-сервер слушает %s:%s%s", self.address[0], self.address[1], self.path)
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._executor.shutdown(wait=True)
+        logger.info("Webhook-сервер остановлен.")
+
+
+def post_updates(path, url, secret_token=None):
+    """Отправляет обновления из JSONL-файла (по одному JSON на строку) на webhook-сервер."""
+    sent = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            request = urllib.request.Request(url, data=line.encode('utf-8'), method='POST',
+                                             headers={'Content-Type': 'application/json'})
+            if secret_token:
+                request.add_header(SECRET_HEADER, secret_token)
+            with urllib.request.urlopen(request) as response:
+                logger.info("Обновление отправлено: HTTP %s", response.status)
+            sent += 1
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Утилиты webhook-режима")
+    sub = parser.add_subparsers(dest='command', required=True)
+    post = sub.add_parser('post', help="отправить записанные обновления (JSONL) на webhook-сервер")
+    post.add_argument('source')
+    post.add_argument('--url', required=True)
+    post.add_argument('--secret')
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.command == 'post':
+        sent = post_updates(args.source, args.url, args.secret)
+        logger.info("Отправлено обновлений: %s", sent)
+
+
+if __name__ == "__main__":
+    main()